@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+"""Compare the JSON codec with the stdlib on documents of the upstreams sizes.
+
+    python bin/benchmark-json.py [--number N]
+
+Install orjson for ``pollbot.codec`` to use it.
+"""
+import argparse
+import json
+import os
+import timeit
+
+from pollbot import codec
+
+HERE = os.path.dirname(__file__)
+FIXTURES = os.path.join(HERE, "..", "tests", "fixtures")
+
+
+def product_details_releases(count=6000):
+    """A document shaped and sized like product-details firefox.json (~1.2MB)."""
+    releases = {}
+    for i in range(count):
+        version = "{}.0.{}".format(i // 100, i % 100)
+        releases["firefox-{}".format(version)] = {
+            "category": "stability",
+            "date": "2017-11-{:02d}".format(i % 28 + 1),
+            "description": None,
+            "is_security_driven": bool(i % 2),
+            "product": "firefox",
+            "build_number": i % 5 + 1,
+            "version": version,
+        }
+    return json.dumps({"releases": releases}).encode("utf-8")
+
+
+def load_documents():
+    documents = {}
+    for filename in ("releases_52.json", "latest-mozilla-central-l10n.json"):
+        with open(os.path.join(FIXTURES, filename), "rb") as f:
+            documents[filename] = f.read()
+    documents["product-details firefox.json"] = product_details_releases()
+    return documents
+
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20, help="Runs per measure")
+    args = parser.parse_args()
+
+    print("Codec: {}".format(codec.NAME))
+    print("{:<32} {:>9} {:>14} {:>14} {:>14} {:>14}".format(
+        "Document", "Size", "stdlib loads", "codec loads", "stdlib dumps", "codec dumps"))
+    for name, body in load_documents().items():
+        value = json.loads(body)
+        timings = [
+            bench(lambda: json.loads(body.decode("utf-8")), args.number),
+            bench(lambda: codec.loads(body), args.number),
+            bench(lambda: json.dumps(value).encode("utf-8"), args.number),
+            bench(lambda: codec.dumps(value), args.number),
+        ]
+        print("{:<32} {:>8}K".format(name, len(body) // 1024) +
+              "".join("{:>12.3f}ms".format(timing) for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at http://mozilla.org/MPL/2.0/.
+"""Compare the memoized versions parsing with parsing them again each time.
+
+    python bin/benchmark-versions.py [--number N]
+"""
+import argparse
+import timeit
+
+from pollbot.utils import _version_id, get_version_channel, parse_version
+
+
+def releases(count=1000):
+    """Versions like the ones listed by Buildhub for a product."""
+    versions = []
+    for i in range(count):
+        major, minor = 40 + i // 20, i % 20
+        versions.append(["{}.0".format(major), "{}.0.{}".format(major, minor),
+                         "{}.0b{}".format(major, minor + 1), "{}.0a1".format(major),
+                         "{}.{}.0esr".format(major, minor)][i % 5])
+    return versions
+
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=50, help="Runs per measure")
+    args = parser.parse_args()
+
+    versions = releases()
+    parse_version.cache_clear()
+    cold = bench(lambda: sorted(versions, key=_version_id), args.number)
+    warm = bench(lambda: sorted(versions, key=parse_version), args.number)
+    print("Sort {} versions:      parsed {:8.3f}ms  memoized {:8.3f}ms".format(
+        len(versions), cold, warm))
+
+    version = "57.0b3"
+    cold = bench(lambda: _version_id(version) >= _version_id("57.0b2"), args.number * 100)
+    warm = bench(lambda: parse_version(version) >= parse_version("57.0b2"), args.number * 100)
+    print("Compare two versions:   parsed {:8.5f}ms  memoized {:8.5f}ms".format(cold, warm))
+
+    cold = bench(lambda: get_version_channel.__wrapped__("devedition", version),
+                 args.number * 100)
+    warm = bench(lambda: parse_version(version).get_channel("devedition"), args.number * 100)
+    print("Version channel:        parsed {:8.5f}ms  memoized {:8.5f}ms".format(cold, warm))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,40 @@
+import argparse
+import asyncio
 import os
 from aiohttp import web
 from .app import get_app
+from .cache.backends import CACHE_BACKEND_URL, SQLiteBackend, get_backend
 
 PORT = int(os.getenv("PORT", 8000))
 
 
-def main():
-    web.run_app(get_app(), port=PORT)
+async def copy_snapshot(backend, command, path):
+    try:
+        if command == 'export-cache':
+            count = await backend.export_snapshot(path)
+            print("Exported {} cache entries to {}".format(count, path))
+        else:
+            count = await backend.import_snapshot(path)
+            print("Imported {} cache entries from {}".format(count, path))
+    finally:
+        await backend.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pollbot')
+    subparsers = parser.add_subparsers(dest='command')
+    for command, help in (('export-cache', 'Export the on-disk cache to a snapshot file'),
+                          ('import-cache', 'Import a snapshot file into the on-disk cache')):
+        subparser = subparsers.add_parser(command, help=help)
+        subparser.add_argument('snapshot', help='Path of the snapshot file')
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        web.run_app(get_app(), port=PORT)
+        return
+
+    backend = get_backend(CACHE_BACKEND_URL)
+    if not isinstance(backend, SQLiteBackend):
+        parser.error("POLLBOT_CACHE_BACKEND_URL must be a sqlite:// URL")
+    asyncio.get_event_loop().run_until_complete(
+        copy_snapshot(backend, args.command, args.snapshot))
@@ -3,8 +3,11 @@ import aiohttp_cors
 from aiohttp import web
 from aiohttp_swagger import setup_swagger
 
+from .cache import setup_results_cache
+from .cache.backends import setup_cache_backend
 from .middlewares import setup_middlewares
-from .views import home, release, utilities, product
+from .tasks import setup_shared_session
+from .views import home, release, scheduler, subscriptions, utilities, product, webhooks
 
 
 HERE = os.path.dirname(__file__)
@@ -16,6 +19,30 @@ def get_app():
     # Setup middlewares
     setup_middlewares(app)
 
+    # Share cached results and documents between replicas (opened first)
+    setup_cache_backend(app)
+
+    # Share a pooled HTTP session between tasks for the app lifetime
+    setup_shared_session(app)
+
+    # Keep check results in memory for a while
+    setup_results_cache(app)
+
+    # Serialize the static documents once
+    utilities.setup_static_documents(app)
+
+    # Probe the upstreams heartbeats in the background
+    utilities.setup_heartbeat_prober(app)
+
+    # Share the checks polling between the status subscribers
+    subscriptions.setup_watchers(app)
+
+    # Call the registered webhooks on status transitions
+    webhooks.setup_webhooks(app)
+
+    # Precompute the checks of the ongoing versions
+    scheduler.setup_scheduler(app)
+
     # Allow Web Application calls.
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
@@ -35,18 +62,29 @@ def get_app():
     cors.add(app.router.add_get('/v1/contribute.json', utilities.contribute_json))
     cors.add(app.router.add_get('/v1/__api__', utilities.oas_spec))
     cors.add(app.router.add_get('/v1/__version__', utilities.version))
+    cors.add(app.router.add_get('/v1/__stats__', utilities.stats))
 
     # Heartbeat
     cors.add(app.router.add_get('/v1/__heartbeat__', utilities.heartbeat))
     cors.add(app.router.add_get('/v1/__lbheartbeat__', utilities.lbheartbeat))
 
+    # Webhooks
+    cors.add(app.router.add_get('/v1/__webhooks__', webhooks.list_webhooks))
+    cors.add(app.router.add_post('/v1/__webhooks__', webhooks.create_webhook))
+    cors.add(app.router.add_delete('/v1/__webhooks__/{id}', webhooks.delete_webhook))
+
     # Statuses
+    cors.add(app.router.add_post('/v1/batch', release.view_run_batch))
     cors.add(app.router.add_get('/v1/{product}',
                                 release.view_get_releases))
     cors.add(app.router.add_get('/v1/{product}/ongoing-versions',
                                 product.get_ongoing_versions))
     cors.add(app.router.add_get('/v1/{product}/{version}',
                                 release.view_get_checks))
+    cors.add(app.router.add_get('/v1/{product}/{version}/all',
+                                release.view_run_checks))
+    cors.add(app.router.add_get('/v1/{product}/{version}/subscribe',
+                                subscriptions.subscribe))
     cors.add(app.router.add_get('/v1/{product}/{version}/archive',
                                 release.archive, name="archive"))
     cors.add(app.router.add_get('/v1/{product}/{version}/archive/partner-repacks',
@@ -70,6 +108,7 @@ def get_app():
                                 release.buildhub_check, name="buildhub"))
     cors.add(app.router.add_get('/v1/{product}/{version}/telemetry/main-summary-uptake',
                                 release.telemetry_uptake, name="telemetry-main-summary-uptake"))
+    release.setup_check_plans(app)
 
     # Swagger UI and documentation
     setup_swagger(app,
@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+from pollbot.exceptions import NotFoundError
+
+
+RESULTS_CACHE_MAX_SIZE = int(os.getenv("POLLBOT_RESULTS_CACHE_MAX_SIZE", "2048"))
+RESULTS_CACHE_STALE_TTL = int(os.getenv("POLLBOT_RESULTS_CACHE_STALE_TTL", "300"))
+NEGATIVE_CACHE_MAX_SIZE = int(os.getenv("POLLBOT_NEGATIVE_CACHE_MAX_SIZE", "512"))
+NEGATIVE_CACHE_TTL = int(os.getenv("POLLBOT_NEGATIVE_CACHE_TTL", "10"))
+
+# The TTL of results that can't change anymore.
+FOREVER = math.inf
+
+logger = logging.getLogger(__package__)
+
+
+class TTLCache:
+    """A bounded in-memory mapping whose entries expire after a time-to-live.
+
+    Once ``maxsize`` entries are stored, the least recently used one is evicted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, *, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        self._data[key] = (value, self.clock() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        try:
+            _, expires_at = self._data[key]
+        except KeyError:
+            return False
+        return expires_at is None or expires_at > self.clock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "max_size": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into a single one.
+
+    While a call for a given key is in flight, the other callers asking for
+    the same key wait for it and share its result (or its exception).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._inflight = {}
+
+    async def do(self, key, func):
+        future = self._inflight.get(key)
+        if future is not None and future.get_loop() is not asyncio.get_event_loop():
+            # Left over by a closed event loop, e.g. a stopped app.
+            future = None
+        if future is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # Shield the call so that a cancelled caller doesn't cancel it for the others.
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # Mark the exception as retrieved even if every caller went away.
+            future.exception()
+
+    async def cancel(self):
+        """Cancel the calls in flight, e.g. on shutdown."""
+        loop = asyncio.get_event_loop()
+        futures = [future for future in self._inflight.values() if future.get_loop() is loop]
+        for future in futures:
+            future.cancel()
+        await asyncio.gather(*futures, return_exceptions=True)
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def stats(self):
+        return {
+            "inflight": len(self._inflight),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
+
+
+class ResultsCache(TTLCache):
+    """A cache of computed results served stale while they are refreshed.
+
+    Once its TTL is over, a result is still returned for ``stale_ttl`` more
+    seconds while a background task computes a new one. After that hard
+    expiry, callers wait for the result to be computed again.
+
+    Negative outcomes (``NotFoundError`` or results matching ``is_negative``)
+    are kept apart, in a smaller cache with a short TTL and never served stale,
+    so that the first positive result shows up quickly, while immutable ones
+    (results matching ``is_immutable``) are kept ``FOREVER``.
+
+    When a shared ``backend`` is set, results missing from memory are looked
+    up there before being computed, and computed results are written there
+    so that the other replicas can use them.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, *, stale_ttl=0,
+                 negative_maxsize=256, negative_ttl=10, backend=None, clock=time.monotonic):
+        super().__init__(maxsize, ttl, clock=clock)
+        self.stale_ttl = stale_ttl
+        self.stale_hits = 0
+        self.backend = backend
+        self.backend_hits = 0
+        self.negatives = TTLCache(negative_maxsize, negative_ttl, clock=clock)
+        self.loads = SingleFlight()
+        self.refreshes = SingleFlight()
+        self._background = set()
+
+    def set_result(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        self.set(key, (value, self.clock() + ttl), ttl=ttl + self.stale_ttl)
+
+    def set_negative(self, key, value, ttl=None):
+        self.delete(key)
+        self.negatives.set(key, value, ttl=self.negative_ttl(ttl))
+
+    def negative_ttl(self, ttl=None):
+        if ttl is None or ttl > self.negatives.ttl:
+            return self.negatives.ttl
+        return ttl
+
+    def is_immutable(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0][1] == FOREVER
+
+    async def get_or_compute(self, key, compute, ttl=None, *,
+                             is_negative=None, is_immutable=None):
+        if self.negatives.maxsize > 0:
+            negative = self.negatives.get(key)
+            if isinstance(negative, Exception):
+                raise negative.with_traceback(None)
+            elif negative is not None:
+                return negative
+
+        entry = self.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if fresh_until <= self.clock():
+                self.stale_hits += 1
+                self.refresh_in_background(key, compute, ttl, is_negative=is_negative,
+                                           is_immutable=is_immutable)
+            return value
+        return await self.loads.do(
+            key, lambda: self._load_or_compute(key, compute, ttl, is_negative, is_immutable))
+
+    async def _load_or_compute(self, key, compute, ttl, is_negative, is_immutable):
+        if self.backend is not None:
+            record = await self.backend.load(self._backend_key(key))
+            if record is not None:
+                self.backend_hits += 1
+                return self._restore(key, record, compute, ttl, is_negative, is_immutable)
+        return await self._compute(key, compute, ttl, is_negative, is_immutable)
+
+    def _restore(self, key, record, compute, ttl, is_negative, is_immutable):
+        if "not_found" in record:
+            error = NotFoundError(record["not_found"], url=record["url"])
+            self.set_negative(key, error, ttl)
+            raise error
+        elif "negative" in record:
+            self.set_negative(key, record["negative"], ttl)
+            return record["negative"]
+
+        if not self._restore_result(key, record):
+            self.stale_hits += 1
+            self.refresh_in_background(key, compute, ttl, is_negative=is_negative,
+                                       is_immutable=is_immutable)
+        return record["value"]
+
+    def _restore_result(self, key, record):
+        # Freshness is shared between replicas, so it is kept in wall-clock time.
+        if record["fresh_until"] is None:
+            fresh_for = FOREVER
+        else:
+            fresh_for = record["fresh_until"] - time.time()
+        self.set(key, (record["value"], self.clock() + fresh_for),
+                 ttl=max(fresh_for, 0) + self.stale_ttl)
+        return fresh_for > 0
+
+    async def warm_up(self):
+        """Load the results stored in the backend, e.g. after a restart."""
+        if self.backend is None:
+            return 0
+        records = await self.backend.load_all("result:")
+        for name, record in records:
+            if "value" in record:
+                self._restore_result(tuple(name[len("result:"):].split(":")), record)
+        return len(records)
+
+    async def _compute(self, key, compute, ttl, is_negative, is_immutable):
+        if ttl is None:
+            ttl = self.ttl
+        try:
+            value = await compute()
+        except NotFoundError as e:
+            self.set_negative(key, e, ttl)
+            await self._store(key, {"not_found": str(e), "url": e.url}, self.negative_ttl(ttl))
+            raise
+
+        if is_negative is not None and is_negative(value):
+            self.set_negative(key, value, ttl)
+            await self._store(key, {"negative": value}, self.negative_ttl(ttl))
+        else:
+            if is_immutable is not None and is_immutable(value):
+                ttl = FOREVER
+            self.negatives.delete(key)
+            self.set_result(key, value, ttl)
+            fresh_until = None if ttl == FOREVER else time.time() + ttl
+            await self._store(key, {"value": value, "fresh_until": fresh_until},
+                              ttl + self.stale_ttl if ttl > 0 else 0)
+        return value
+
+    async def _store(self, key, record, ttl):
+        if self.backend is not None:
+            await self.backend.store(self._backend_key(key), record, ttl)
+
+    @staticmethod
+    def _backend_key(key):
+        if isinstance(key, tuple):
+            return "result:" + ":".join(key)
+        return "result:" + key
+
+    async def refresh(self, key, compute, ttl=None, *, is_negative=None, is_immutable=None):
+        """Compute and store the value of ``key`` now, even if it is still fresh."""
+        return await self.refreshes.do(
+            key, lambda: self._compute(key, compute, ttl, is_negative, is_immutable))
+
+    def refresh_in_background(self, key, compute, ttl=None, *,
+                              is_negative=None, is_immutable=None):
+        async def refresh():
+            try:
+                await self.refresh(key, compute, ttl, is_negative=is_negative,
+                                   is_immutable=is_immutable)
+            except Exception as e:
+                # Keep serving the stale value until its hard expiry.
+                logger.warning("Failed to refresh %s: %s", key, e)
+
+        task = asyncio.ensure_future(refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        # The computations run in their own flights, shielded from the tasks above.
+        await self.refreshes.cancel()
+        await self.loads.cancel()
+
+    def stats(self):
+        stats = super().stats()
+        stats["stale_hits"] = self.stale_hits
+        stats["refreshing"] = len(self.refreshes)
+        stats["negatives"] = self.negatives.stats()
+        if self.backend is not None:
+            stats["backend_hits"] = self.backend_hits
+            stats["backend"] = self.backend.stats()
+        return stats
+
+
+def setup_results_cache(app):
+    app['results_cache'] = ResultsCache(maxsize=RESULTS_CACHE_MAX_SIZE,
+                                        stale_ttl=RESULTS_CACHE_STALE_TTL,
+                                        negative_maxsize=NEGATIVE_CACHE_MAX_SIZE,
+                                        negative_ttl=NEGATIVE_CACHE_TTL)
+
+    async def attach_cache_backend(app):
+        app['results_cache'].backend = app.get('cache_backend')
+        await app['results_cache'].warm_up()
+
+    async def close_results_cache(app):
+        await app['results_cache'].close()
+
+    app.on_startup.append(attach_cache_backend)
+    app.on_cleanup.append(close_results_cache)
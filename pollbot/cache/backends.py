@@ -0,0 +1,478 @@
+import asyncio
+import logging
+import math
+import os
+import re
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from . import TTLCache
+from .. import codec
+
+
+CACHE_BACKEND_URL = os.getenv("POLLBOT_CACHE_BACKEND_URL", "")
+CACHE_BACKEND_TIMEOUT = float(os.getenv("POLLBOT_CACHE_BACKEND_TIMEOUT", "0.5"))
+CACHE_BACKEND_PREFIX = "pollbot:"
+CACHE_SNAPSHOT = os.getenv("POLLBOT_CACHE_SNAPSHOT", "")
+
+# Records bigger than this are compressed before being stored.
+COMPRESSION_THRESHOLD = 1024
+# Seconds the Redis server is left alone after it failed to answer.
+REDIS_RETRY_DELAY = 1
+
+logger = logging.getLogger(__package__)
+
+
+class CacheBackendError(Exception):
+    """When the shared cache backend can't be reached or answers an error."""
+
+
+def dumps(value):
+    data = codec.dumps(value)
+    if len(data) > COMPRESSION_THRESHOLD:
+        return b'z' + zlib.compress(data)
+    return b'j' + data
+
+
+def loads(data):
+    kind, data = data[:1], data[1:]
+    if kind == b'z':
+        data = zlib.decompress(data)
+    elif kind != b'j':
+        raise ValueError('Unknown record format {!r}'.format(kind))
+    return codec.loads(data)
+
+
+class CacheBackend:
+    """A key-value store shared by the PollBot replicas.
+
+    Subclasses implement ``get``, ``set`` and ``delete`` on raw bytes, while
+    ``load`` and ``store`` (de)serialize records and never fail: the shared
+    cache is an optimization and PollBot keeps working without it.
+    """
+
+    def __init__(self, *, prefix=CACHE_BACKEND_PREFIX):
+        self.prefix = prefix
+        self.errors = 0
+
+    async def get(self, key):
+        raise NotImplementedError()
+
+    async def set(self, key, data, ttl):
+        raise NotImplementedError()
+
+    async def delete(self, key):
+        raise NotImplementedError()
+
+    async def scan(self, prefix):
+        # Backends that can't list their entries don't warm up the caches.
+        return []
+
+    async def lock(self, key, owner, ttl):
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+    async def load(self, key):
+        try:
+            data = await self.get(self.prefix + key)
+            if data is not None:
+                return loads(data)
+        except (CacheBackendError, ValueError) as e:
+            self.errors += 1
+            logger.warning("Failed to read %s from the cache backend: %s", key, e)
+
+    async def load_all(self, prefix):
+        """Return the ``(key, value)`` records whose key starts with ``prefix``."""
+        try:
+            entries = await self.scan(self.prefix + prefix)
+            return [(key[len(self.prefix):], loads(data)) for key, data in entries]
+        except (CacheBackendError, ValueError) as e:
+            self.errors += 1
+            logger.warning("Failed to read %s* from the cache backend: %s", prefix, e)
+            return []
+
+    async def store(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        try:
+            await self.set(self.prefix + key, dumps(value), ttl)
+        except CacheBackendError as e:
+            self.errors += 1
+            logger.warning("Failed to write %s to the cache backend: %s", key, e)
+
+    async def remove(self, key):
+        try:
+            await self.delete(self.prefix + key)
+        except CacheBackendError as e:
+            self.errors += 1
+            logger.warning("Failed to remove %s from the cache backend: %s", key, e)
+
+    async def acquire(self, key, owner, ttl):
+        """Take or renew the ``key`` lease for ``owner``, unless another owner holds it.
+
+        Return True if ``owner`` holds the lease for ``ttl`` more seconds.
+        """
+        try:
+            return await self.lock(self.prefix + key, owner, ttl)
+        except CacheBackendError as e:
+            self.errors += 1
+            logger.warning("Failed to acquire %s from the cache backend: %s", key, e)
+            return False
+
+    def stats(self):
+        return {
+            "backend": self.__class__.__name__,
+            "errors": self.errors,
+        }
+
+
+class MemoryBackend(CacheBackend):
+    """A cache backend kept in the process memory, mostly useful for tests."""
+
+    def __init__(self, maxsize=4096, **kwargs):
+        super().__init__(**kwargs)
+        self._data = TTLCache(maxsize)
+
+    async def get(self, key):
+        return self._data.get(key)
+
+    async def set(self, key, data, ttl):
+        self._data.set(key, data, ttl=ttl)
+
+    async def delete(self, key):
+        self._data.delete(key)
+
+    async def scan(self, prefix):
+        entries = [(key, self._data.get(key)) for key in list(self._data._data)
+                   if key.startswith(prefix)]
+        return [(key, data) for key, data in entries if data is not None]
+
+    async def lock(self, key, owner, ttl):
+        holder = self._data.get(key)
+        if holder is not None and holder != owner.encode('utf-8'):
+            return False
+        self._data.set(key, owner.encode('utf-8'), ttl=ttl)
+        return True
+
+
+def encode_command(*args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif isinstance(arg, int):
+            arg = str(arg).encode('ascii')
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+async def read_reply(reader):
+    line = await reader.readuntil(b'\r\n')
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+        return payload.decode('utf-8')
+    elif kind == b'-':
+        raise CacheBackendError(payload.decode('utf-8'))
+    elif kind == b':':
+        return int(payload)
+    elif kind == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    elif kind == b'*':
+        length = int(payload)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise CacheBackendError('Unexpected reply {!r}'.format(line))
+
+
+# Renew the lease of its owner, or take it if nobody holds it.
+REDIS_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+elseif redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+class RedisBackend(CacheBackend):
+    """A cache backend speaking the Redis protocol (RESP) over a single connection."""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, *,
+                 timeout=CACHE_BACKEND_TIMEOUT, retry_delay=REDIS_RETRY_DELAY, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self._retry_at = 0
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parts = urlsplit(url)
+        db = parts.path.strip('/')
+        return cls(host=parts.hostname or 'localhost',
+                   port=parts.port or 6379,
+                   db=int(db) if db else 0,
+                   password=unquote(parts.password) if parts.password else None,
+                   **kwargs)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._call('AUTH', self.password)
+        if self.db:
+            await self._call('SELECT', self.db)
+
+    async def _call(self, *args):
+        self._writer.write(encode_command(*args))
+        await self._writer.drain()
+        return await read_reply(self._reader)
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _execute(self, *args):
+        # Commands are sent one at a time so that replies can't get mixed up.
+        async with self._lock:
+            try:
+                if self._writer is None or self._writer.is_closing():
+                    await self._connect()
+                return await self._call(*args)
+            except (OSError, EOFError, asyncio.CancelledError):
+                # A reply may be left unread on the connection.
+                self._disconnect()
+                raise
+
+    async def execute(self, *args):
+        if time.monotonic() < self._retry_at:
+            raise CacheBackendError('{}:{} not available, retrying later'.format(
+                self.host, self.port))
+        try:
+            # The timeout covers the wait for the previous commands too.
+            return await asyncio.wait_for(self._execute(*args), self.timeout)
+        except CacheBackendError:
+            raise
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            self._retry_at = time.monotonic() + self.retry_delay
+            raise CacheBackendError('{}:{} not available ({!r})'.format(
+                self.host, self.port, e))
+
+    async def get(self, key):
+        return await self.execute('GET', key)
+
+    async def set(self, key, data, ttl):
+        if ttl == math.inf:
+            await self.execute('SET', key, data)
+        else:
+            await self.execute('SET', key, data, 'PX', int(ttl * 1000))
+
+    async def delete(self, key):
+        await self.execute('DEL', key)
+
+    async def scan(self, prefix):
+        pattern = re.sub(r'([*?\[\]\\])', r'\\\1', prefix) + '*'
+        keys = []
+        cursor = b'0'
+        while True:
+            cursor, batch = await self.execute('SCAN', cursor, 'MATCH', pattern, 'COUNT', 1000)
+            keys.extend(batch)
+            if cursor == b'0':
+                break
+        if not keys:
+            return []
+        values = await self.execute('MGET', *keys)
+        return [(key.decode('utf-8'), data) for key, data in zip(keys, values)
+                if data is not None]
+
+    async def lock(self, key, owner, ttl):
+        return await self.execute('EVAL', REDIS_LOCK_SCRIPT, 1, key, owner,
+                                  int(ttl * 1000)) == 1
+
+    async def close(self):
+        self._disconnect()
+
+
+class SQLiteBackend(CacheBackend):
+    """A cache backend stored on disk, in an SQLite database in WAL mode.
+
+    It outlives restarts, and can be exported to a snapshot file that is
+    imported to pre-seed the cache of a new container.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._db = None
+        # Queries run one at a time, out of the event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        # sqlite:///var/cache/pollbot.db is absolute, sqlite://pollbot.db relative.
+        return cls(url.split('://', 1)[1], **kwargs)
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                             'key TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)')
+        return self._db
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        except sqlite3.Error as e:
+            raise CacheBackendError('{} not available ({!r})'.format(self.path, e))
+
+    def _get(self, key):
+        row = self._connect().execute(
+            'SELECT data FROM entries WHERE key = ? AND expires_at > ?',
+            (key, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def _set(self, key, data, ttl):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                       (key, data, time.time() + ttl))
+
+    def _delete(self, key):
+        with self._connect() as db:
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def _lock(self, key, owner, ttl):
+        db = self._connect()
+        owner = owner.encode('utf-8')
+        # Other processes can't take the lease between the read and the write.
+        db.execute('BEGIN IMMEDIATE')
+        with db:
+            now = time.time()
+            row = db.execute('SELECT data FROM entries WHERE key = ? AND expires_at > ?',
+                             (key, now)).fetchone()
+            if row is not None and row[0] != owner:
+                return False
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                       (key, owner, now + ttl))
+            return True
+
+    def _scan(self, prefix):
+        return self._connect().execute(
+            'SELECT key, data FROM entries WHERE substr(key, 1, ?) = ? AND expires_at > ?',
+            (len(prefix), prefix, time.time())).fetchall()
+
+    def _purge(self):
+        with self._connect() as db:
+            return db.execute('DELETE FROM entries WHERE expires_at <= ?',
+                              (time.time(),)).rowcount
+
+    def _export(self, path):
+        self._purge()
+        snapshot = sqlite3.connect(path)
+        try:
+            self._connect().backup(snapshot)
+        finally:
+            snapshot.close()
+        return self._connect().execute('SELECT count(*) FROM entries').fetchone()[0]
+
+    def _import(self, path):
+        db = self._connect()
+        db.execute('ATTACH DATABASE ? AS snapshot', (path,))
+        try:
+            with db:
+                return db.execute('INSERT OR REPLACE INTO entries '
+                                  'SELECT key, data, expires_at FROM snapshot.entries '
+                                  'WHERE expires_at > ?', (time.time(),)).rowcount
+        finally:
+            db.execute('DETACH DATABASE snapshot')
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def get(self, key):
+        return await self._run(self._get, key)
+
+    async def set(self, key, data, ttl):
+        await self._run(self._set, key, data, ttl)
+
+    async def delete(self, key):
+        await self._run(self._delete, key)
+
+    async def scan(self, prefix):
+        return await self._run(self._scan, prefix)
+
+    async def lock(self, key, owner, ttl):
+        return await self._run(self._lock, key, owner, ttl)
+
+    async def purge(self):
+        """Remove the expired entries and return how many there were."""
+        return await self._run(self._purge)
+
+    async def export_snapshot(self, path):
+        """Copy the live entries to the ``path`` snapshot file and return their number."""
+        return await self._run(self._export, path)
+
+    async def import_snapshot(self, path):
+        """Load the live entries of the ``path`` snapshot file and return their number."""
+        return await self._run(self._import, path)
+
+    async def close(self):
+        # The database is opened again if the backend is used after that.
+        if self._db is not None:
+            await self._run(self._close)
+
+
+def get_backend(url):
+    if not url:
+        return None
+    scheme = urlsplit(url).scheme
+    if scheme == 'memory':
+        return MemoryBackend()
+    elif scheme == 'redis':
+        return RedisBackend.from_url(url)
+    elif scheme == 'sqlite':
+        return SQLiteBackend.from_url(url)
+    raise ValueError('Unknown cache backend {}'.format(url))
+
+
+def setup_cache_backend(app):
+    async def open_cache_backend(app):
+        backend = get_backend(CACHE_BACKEND_URL)
+        if isinstance(backend, SQLiteBackend):
+            try:
+                await backend.purge()
+                if CACHE_SNAPSHOT and os.path.exists(CACHE_SNAPSHOT):
+                    count = await backend.import_snapshot(CACHE_SNAPSHOT)
+                    logger.info("Imported %s cache entries from %s", count, CACHE_SNAPSHOT)
+            except CacheBackendError as e:
+                logger.warning("Failed to prepare the %s cache: %s", backend.path, e)
+        app['cache_backend'] = backend
+
+    async def close_cache_backend(app):
+        backend = app.get('cache_backend')
+        if backend is not None:
+            await backend.close()
+
+    app.on_startup.append(open_cache_backend)
+    app.on_cleanup.append(close_cache_backend)
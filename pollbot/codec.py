@@ -0,0 +1,44 @@
+"""JSON (de)serialization, using orjson when it is installed.
+
+Documents are decoded from and encoded to bytes directly, which saves a
+copy of the big upstream documents, e.g. the product-details releases.
+"""
+import json
+
+from aiohttp import web
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def json_loads(data):
+    return json.loads(data)
+
+
+def json_dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def orjson_loads(data):
+    return orjson.loads(data)
+
+
+def orjson_dumps(value):
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+
+# The ``(loads, dumps)`` functions of each codec.
+CODECS = {
+    "json": (json_loads, json_dumps),
+    "orjson": (orjson_loads, orjson_dumps),
+}
+NAME = "json" if orjson is None else "orjson"
+loads, dumps = CODECS[NAME]
+
+
+def json_response(data, *, status=200, headers=None):
+    """Like ``aiohttp.web.json_response``, with the body encoded by ``dumps``."""
+    return web.Response(body=dumps(data), status=status, headers=headers,
+                        content_type='application/json', charset='utf-8')
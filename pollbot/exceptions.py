@@ -2,3 +2,7 @@ class TaskError(Exception):
     def __init__(self, message, *, url=None):
         super().__init__(message)
         self.url = url
+
+
+class NotFoundError(TaskError):
+    """When an upstream doesn't know about the requested version (yet)."""
@@ -3,6 +3,8 @@ from aiohttp import web
 import os
 import string
 
+from .codec import json_response
+
 logger = logging.getLogger(__package__)
 
 
@@ -15,7 +17,9 @@ def setup_middlewares(app):
 
 # Cache-Control middleware
 CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", "30"))
-NO_CACHE_ENDPOINTS = ['/v1/', '/v1/__version__', '/v1/__heartbeat__', '/v1/__lbheartbeat__']
+IMMUTABLE_CACHE_MAX_AGE = int(os.getenv("IMMUTABLE_CACHE_MAX_AGE", "31536000"))
+NO_CACHE_ENDPOINTS = ['/v1/', '/v1/__version__', '/v1/__heartbeat__', '/v1/__lbheartbeat__',
+                      '/v1/__stats__', '/v1/__webhooks__']
 
 
 async def cache_control_middleware(app, handler):
@@ -24,6 +28,10 @@ async def cache_control_middleware(app, handler):
         cache_control_value = "public; max-age={}".format(CACHE_MAX_AGE)
         if request.path in NO_CACHE_ENDPOINTS or CACHE_MAX_AGE <= 0:
             cache_control_value = "no-cache"
+        elif response.get('immutable') and IMMUTABLE_CACHE_MAX_AGE > 0:
+            # Views flag the responses that will never change.
+            cache_control_value = "public, max-age={}, immutable".format(
+                IMMUTABLE_CACHE_MAX_AGE)
         response.headers.setdefault("Cache-Control", cache_control_value)
         return response
     return middleware_handler
@@ -53,7 +61,7 @@ def error_pages(overrides):
 
 
 async def handle_any(request, response):
-    return web.json_response({
+    return json_response({
         "status": response.status,
         "message": response.reason
     }, status=response.status)
@@ -67,7 +75,7 @@ async def handle_404(request, response):
         #  - remove the redirect entirely; use duplicate routes instead, in app.py
         if request.path.endswith('/'):
             return web.HTTPFound('/' + request.path.strip('/'+string.whitespace))
-        return web.json_response({
+        return json_response({
             "status": 404,
             "message": "Page '{}' not found".format(request.path)
         }, status=404)
@@ -76,7 +84,7 @@ async def handle_404(request, response):
 
 async def handle_500(request, response=None, error=None):
     logger.exception(error)
-    return web.json_response({
+    return json_response({
             "status": 503,
             "message": "Service currently unavailable"
         }, status=503)
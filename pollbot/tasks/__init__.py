@@ -1,25 +1,303 @@
+import asyncio
+import codecs
+import json
+import logging
+import os
 import pkg_resources
 import sys
+import time
+from contextlib import asynccontextmanager, suppress
 
 import aiohttp
+from multidict import CIMultiDict
 
-from pollbot import __version__ as pollbot_version
+from pollbot import __version__ as pollbot_version, codec
+from pollbot.cache import FOREVER, SingleFlight, TTLCache
 from pollbot.utils import Status
 
 
-def get_session(*, headers=None):
+HTTP_POOL_LIMIT = int(os.getenv("POLLBOT_HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("POLLBOT_HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("POLLBOT_HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("POLLBOT_HTTP_DNS_CACHE_TTL", "300"))
+HTTP_VALIDATORS_CACHE_SIZE = int(os.getenv("POLLBOT_HTTP_VALIDATORS_CACHE_SIZE", "256"))
+HTTP_VALIDATORS_CACHE_TTL = int(os.getenv("POLLBOT_HTTP_VALIDATORS_CACHE_TTL", "86400"))
+HEARTBEAT_INTERVAL = int(os.getenv("POLLBOT_HEARTBEAT_INTERVAL", "30"))
+# Bytes read at once from the upstream bodies streamed by ``fetch_until``.
+STREAM_CHUNK_SIZE = 16 * 1024
+
+logger = logging.getLogger(__package__)
+
+# The application session, opened on startup and closed on cleanup.
+_shared_session = None
+
+# Identical upstream requests running at the same time share a single call.
+upstream_flights = SingleFlight()
+
+
+def get_user_agent():
     aiohttp_version = pkg_resources.get_distribution("aiohttp").version
     python_version = '.'.join([str(v) for v in sys.version_info[:3]])
+    return "PollBot/{} aiohttp/{} python/{}".format(
+        pollbot_version, aiohttp_version, python_version)
+
 
+def create_session(*, headers=None, connector=None):
     session_headers = {
-        "User-Agent": "PollBot/{} aiohttp/{} python/{}".format(
-            pollbot_version, aiohttp_version, python_version)
+        "User-Agent": get_user_agent()
     }
 
     if headers is not None:
         session_headers.update(headers)
 
-    return aiohttp.ClientSession(headers=session_headers)
+    return aiohttp.ClientSession(headers=session_headers, connector=connector)
+
+
+def create_connector():
+    # The connector keeps a pool of keep-alive connections per upstream host
+    # so that tasks don't pay for a DNS lookup and a TLS handshake each time.
+    return aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT,
+                                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                                use_dns_cache=True,
+                                ttl_dns_cache=HTTP_DNS_CACHE_TTL)
+
+
+@asynccontextmanager
+async def borrow_session(session):
+    # The shared session outlives the tasks, do not close it on exit.
+    yield session
+
+
+def get_session(*, headers=None):
+    """Return an async context manager yielding the session to query upstreams with.
+
+    The application session is used when the app is running, otherwise
+    (or if specific session headers are required) a new one is created.
+    """
+    if _shared_session is None or _shared_session.closed or headers is not None:
+        return create_session(headers=headers)
+    return borrow_session(_shared_session)
+
+
+async def open_shared_session(app):
+    global _shared_session
+    _shared_session = create_session(connector=create_connector())
+    app['http_session'] = _shared_session
+    upstream_validators.backend = app.get('cache_backend')
+    await upstream_validators.warm_up()
+
+
+async def close_shared_session(app):
+    global _shared_session
+    upstream_validators.backend = None
+    # The upstream calls in flight would outlive the app and its event loop.
+    await upstream_flights.cancel()
+    session = app.get('http_session')
+    if session is None:
+        return
+    if _shared_session is session:
+        _shared_session = None
+    await session.close()
+
+
+def setup_shared_session(app):
+    app.on_startup.append(open_shared_session)
+    app.on_cleanup.append(close_shared_session)
+
+
+class UpstreamResponse:
+    """An upstream response whose body has been entirely read."""
+
+    def __init__(self, url, status, headers, body, encoding='utf-8'):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.encoding = encoding
+        self._json = None
+
+    def text(self):
+        return self.body.decode(self.encoding, errors='replace')
+
+    def json(self):
+        # The parsed body is shared by every task that awaited this response.
+        if self._json is None:
+            self._json = codec.loads(self.body)
+        return self._json
+
+
+class ValidatorsCache(TTLCache):
+    """Upstream responses stored along with their ETag and Last-Modified validators.
+
+    They are used to revalidate documents with conditional requests, and
+    reused as is (parsed body included) when the upstream answers 304.
+
+    When a shared ``backend`` is set, the documents are also written there so
+    that the other replicas can revalidate them instead of downloading them.
+
+    Immutable documents are kept ``FOREVER`` and served without any request.
+    """
+
+    # Only the headers needed to revalidate and decode documents are shared.
+    SHARED_HEADERS = ('ETag', 'Last-Modified', 'Content-Type')
+    # Documents requested with credentials are kept in memory only, so that
+    # neither the secrets in their key nor their content end up in the backend.
+    CREDENTIAL_HEADERS = ('authorization', 'cookie', 'proxy-authorization')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backend = None
+        self.not_modified = 0
+
+    async def lookup(self, key):
+        response = self.get(key)
+        if response is None and self.is_shared(key):
+            record = await self.backend.load(self._backend_key(key))
+            if record is not None:
+                response = self._restore(key, record)
+        return response
+
+    def _restore(self, key, record):
+        headers = CIMultiDict(record["headers"])
+        body = record["body"].encode(record["encoding"])
+        response = UpstreamResponse(record["url"], 200, headers, body, record["encoding"])
+        self.set(key, response, ttl=FOREVER if record.get("immutable") else None)
+        return response
+
+    async def warm_up(self):
+        """Load the documents stored in the backend, e.g. after a restart."""
+        if self.backend is None:
+            return 0
+        records = await self.backend.load_all("http:")
+        for name, record in records:
+            url, headers, allow_redirects = json.loads(name[len("http:"):])
+            key = (url, tuple(tuple(header) for header in headers), allow_redirects)
+            self._restore(key, record)
+        return len(records)
+
+    async def store(self, key, response, *, immutable=False):
+        if response.status != 200:
+            return
+        if immutable:
+            ttl = FOREVER
+        elif 'ETag' in response.headers or 'Last-Modified' in response.headers:
+            ttl = self.ttl
+        else:
+            return
+
+        self.set(key, response, ttl=ttl)
+        if self.is_shared(key):
+            headers = {name: response.headers[name] for name in self.SHARED_HEADERS
+                       if name in response.headers}
+            record = {
+                "url": response.url,
+                "headers": headers,
+                "encoding": response.encoding,
+                "body": response.text(),
+                "immutable": immutable,
+            }
+            await self.backend.store(self._backend_key(key), record, ttl)
+
+    def is_shared(self, key):
+        _, headers, _ = key
+        return self.backend is not None and not any(
+            name.lower() in self.CREDENTIAL_HEADERS for name, _ in headers)
+
+    @staticmethod
+    def _backend_key(key):
+        return "http:" + json.dumps(key, separators=(',', ':'))
+
+    @staticmethod
+    def conditional_headers(response):
+        headers = {}
+        if 'ETag' in response.headers:
+            headers['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            headers['If-Modified-Since'] = response.headers['Last-Modified']
+        return headers
+
+    def stats(self):
+        stats = super().stats()
+        stats["not_modified"] = self.not_modified
+        return stats
+
+
+upstream_validators = ValidatorsCache(maxsize=HTTP_VALIDATORS_CACHE_SIZE,
+                                      ttl=HTTP_VALIDATORS_CACHE_TTL)
+
+
+async def _fetch(method, url, headers, data, allow_redirects, immutable):
+    cache_key = None
+    cached = None
+    request_headers = headers
+    if method == 'GET':
+        cache_key = (url, tuple(sorted((headers or {}).items())), allow_redirects)
+        cached = await upstream_validators.lookup(cache_key)
+        if cached is not None and immutable:
+            return cached
+        if cached is not None:
+            request_headers = dict(headers or {})
+            request_headers.update(upstream_validators.conditional_headers(cached))
+
+    async with get_session() as session:
+        async with session.request(method, url, headers=request_headers, data=data,
+                                   allow_redirects=allow_redirects) as resp:
+            if resp.status == 304 and cached is not None:
+                upstream_validators.not_modified += 1
+                return cached
+            body = await resp.read()
+            response = UpstreamResponse(url, resp.status, resp.headers, body,
+                                        resp.get_encoding())
+
+    if cache_key is not None:
+        await upstream_validators.store(cache_key, response, immutable=immutable)
+    return response
+
+
+async def fetch(url, *, method='GET', headers=None, data=None, allow_redirects=True,
+                immutable=False):
+    """Query an upstream and return its response once entirely read.
+
+    Concurrent identical requests share the same upstream call and response.
+    Set ``immutable`` for documents that never change once published, e.g.
+    files at a release tag: they are then only downloaded once.
+    """
+    key = (method, url, tuple(sorted((headers or {}).items())), data, allow_redirects)
+    return await upstream_flights.do(
+        key, lambda: _fetch(method, url, headers, data, allow_redirects, immutable))
+
+
+async def _fetch_until(url, parser_class, args, allow_redirects):
+    parser = parser_class(*args)
+    async with get_session() as session:
+        async with session.get(url, allow_redirects=allow_redirects) as resp:
+            if resp.status != 200:
+                return resp.status, parser
+            decoder = codecs.getincrementaldecoder(resp.charset or 'utf-8')(errors='replace')
+            async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                if parser.consume(decoder.decode(chunk)):
+                    resp.close()
+                    break
+            else:
+                parser.consume(decoder.decode(b'', final=True))
+            return resp.status, parser
+
+
+async def fetch_until(url, parser_class, *args, allow_redirects=True):
+    """Stream the text of an upstream response to a ``parser_class(*args)`` parser.
+
+    Reading stops once the parser ``consume`` method returns True, and the
+    connection is then closed rather than reused, so that the rest of the
+    body isn't downloaded at all. Return the response status and the parser,
+    which only got the body if the status is 200.
+
+    Concurrent identical calls share the same upstream call and parser. The
+    bodies aren't entirely read, so they aren't revalidated like in ``fetch``.
+    """
+    key = ('STREAM', url, parser_class, args, allow_redirects)
+    return await upstream_flights.do(
+        key, lambda: _fetch_until(url, parser_class, args, allow_redirects))
 
 
 def heartbeat_factory(url, headers=None):
@@ -32,7 +310,82 @@ def heartbeat_factory(url, headers=None):
     return heartbeat
 
 
-def build_task_response(status, link, message, fail_message=None):
+class HeartbeatProber:
+    """Probe upstreams heartbeats on a schedule and keep their latest outcome.
+
+    ``heartbeats`` maps names to the functions built by ``heartbeat_factory``.
+    Concurrent probes share the same upstream calls.
+    """
+
+    def __init__(self, heartbeats, *, interval=HEARTBEAT_INTERVAL):
+        self.heartbeats = heartbeats
+        self.interval = interval
+        self.results = {}
+        self.flights = SingleFlight()
+        self._task = None
+
+    async def probe(self, name):
+        started = time.monotonic()
+        try:
+            success = await self.heartbeats[name]()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("%s heartbeat failed: %r", name, e)
+            success = False
+
+        now = time.time()
+        result = self.results.setdefault(name, {"last_success": None})
+        result["success"] = success
+        result["latency"] = round(time.monotonic() - started, 3)
+        result["checked_at"] = now
+        if success:
+            result["last_success"] = now
+        return success
+
+    async def _probe_all(self):
+        await asyncio.gather(*[self.probe(name) for name in self.heartbeats])
+        return self.snapshot()
+
+    async def refresh(self):
+        """Probe every upstream now and return the new snapshot."""
+        return await self.flights.do("heartbeats", self._probe_all)
+
+    def snapshot(self):
+        """Return the latest success of every upstream, None if they weren't all probed."""
+        if any(name not in self.results for name in self.heartbeats):
+            return None
+        return {name: self.results[name]["success"] for name in self.heartbeats}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        # The probes run in their own flight, shielded from the task above.
+        await self.flights.cancel()
+
+    def stats(self):
+        return {name: dict(result) for name, result in self.results.items()}
+
+
+class TaskResponse(dict):
+    """A task response body, ``immutable`` when the outcome can't change anymore."""
+    immutable = False
+
+
+def build_task_response(status, link, message, fail_message=None, *, immutable=False):
     if fail_message is None:
         fail_message = message
 
@@ -40,8 +393,11 @@ def build_task_response(status, link, message, fail_message=None):
         message = message if status else fail_message
         status = Status.EXISTS if status else Status.MISSING
 
-    return {
+    response = TaskResponse({
         "status": status.value,
         "message": message,
         "link": link
-    }
+    })
+    # Only a published resource is there to stay.
+    response.immutable = immutable and status is Status.EXISTS
+    return response
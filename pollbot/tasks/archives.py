@@ -1,8 +1,17 @@
 import asyncio
+import os
+import weakref
 from collections import defaultdict
-from pollbot.exceptions import TaskError
+from pollbot.cache import FOREVER, TTLCache
+from pollbot.exceptions import NotFoundError, TaskError
 from pollbot.utils import Status, Channel, get_version_channel, strip_candidate_info
-from . import get_session, heartbeat_factory, build_task_response
+from . import fetch, heartbeat_factory, build_task_response
+
+
+LOCALES_CACHE_SIZE = int(os.getenv("POLLBOT_LOCALES_CACHE_SIZE", "256"))
+LOCALES_TIP_TTL = int(os.getenv("POLLBOT_LOCALES_TIP_TTL", "300"))
+
+HG_URL = 'https://hg.mozilla.org'
 
 
 NIGHTLY_PLATFORMS = {
@@ -48,6 +57,13 @@ THUNDERBIRD_CHANNEL_REPOS = {
 
 JSON_HEADERS = {"Accept": "application/json"}
 
+# The parsed locales lists by (repository, tag or revision).
+locales_cache = TTLCache(maxsize=LOCALES_CACHE_SIZE, ttl=LOCALES_TIP_TTL)
+
+# The indexed nightly listings by (product, version), for each listing response.
+# They are dropped along with the response once a new listing is fetched.
+nightly_listings = weakref.WeakKeyDictionary()
+
 
 def get_nightly_platforms(product):
     if product in ['firefox', 'devedition']:
@@ -81,63 +97,81 @@ def product_locales_path(product):
         raise Exception('Unknown product {}'.format(product))
 
 
+def parse_locales(text):
+    locales = set()
+    for line in text.split('\n'):
+        try:
+            locale, _ = line.split(' ', 1)
+        except ValueError:
+            locale = line
+        # We ignore here ja-JP-mac since because it is ja for the mac platform.
+        # And we want them to be considered as the same locale.
+        if locale and locale != 'ja-JP-mac':
+            locales.add(locale)
+    return frozenset(locales)
+
+
+async def get_candidate_revision(product, version):
+    # Not supported for Thunderbird
+    if 'rc' in version:
+        version, build = version.split('rc')
+    else:
+        version, build = version.split('build')
+    # The build info of a candidate never changes once published.
+    url = ('https://archive.mozilla.org/pub/{}/candidates/{}-candidates/build{}'
+           '/linux-x86_64/en-US/firefox-{}.txt')
+    url = url.format(product, version, build, version)
+    resp = await fetch(url, immutable=True)
+    if resp.status != 200:
+        msg = '{} not available (HTTP {})'.format(url, resp.status)
+        error_class = NotFoundError if resp.status == 404 else TaskError
+        raise error_class(msg, url=url)
+    buildID, rev_url = resp.text().strip().split('\n')
+    repo_url, revision = rev_url.split('/rev/')
+    return repo_url, revision
+
+
 async def get_locales(product, version):
+    """Return the frozenset of the locales shipped with this product version."""
     channel = get_version_channel(product, version)
     locales_path = product_locales_path(product)
+    locales_file = 'shipped-locales'
     tag_product = product.upper()
     tag = "{}_{}_RELEASE".format(tag_product, version.replace('.', '_'))
     if channel is Channel.NIGHTLY:
-        repo_name = get_channel_repo(product, channel, version)
-        url = "https://hg.mozilla.org/{}/raw-file/tip/{}/locales/all-locales".format(
-            repo_name, locales_path
-        )
+        repo_url = "{}/{}".format(HG_URL, get_channel_repo(product, channel, version))
+        revision = 'tip'
+        locales_file = 'all-locales'
     elif channel in (Channel.RELEASE, Channel.BETA, Channel.AURORA):
-        repo_name = get_channel_repo(product, channel, version)
-        url = ("https://hg.mozilla.org/releases/{}/raw-file/{}/"
-               "{}/locales/shipped-locales").format(repo_name, tag, locales_path)
+        repo_url = "{}/releases/{}".format(HG_URL, get_channel_repo(product, channel, version))
+        revision = tag
     elif channel is Channel.CANDIDATE:
-        # Not supported for Thunderbird
-        if 'rc' in version:
-            version, build = version.split('rc')
-        else:
-            version, build = version.split('build')
-        # Build revision URL
-        url = ('https://archive.mozilla.org/pub/{}/candidates/{}-candidates/build{}'
-               '/linux-x86_64/en-US/firefox-{}.txt')
-        url = url.format(product, version, build, version)
-        async with get_session() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    msg = '{} not available (HTTP {})'.format(url, resp.status)
-                    raise TaskError(msg, url=url)
-                body = await resp.text()
-                buildID, rev_url = body.strip().split('\n')
-        url = '{}/browser/locales/shipped-locales'.format(rev_url.replace('rev', 'raw-file'))
+        repo_url, revision = await get_candidate_revision(product, version)
+        locales_path = 'browser'
     else:
         # Not supported for Thunderbird (Channel.ESR)
         major, _ = version.split('.', 1)
-        branch = "mozilla-esr{}".format(major)
-        url = ("https://hg.mozilla.org/releases/{}/raw-file/{}/"
-               "browser/locales/shipped-locales").format(branch, tag)
-
-    async with get_session() as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                msg = '{} not available (HTTP {})'.format(url, resp.status)
-                raise TaskError(msg, url=url)
-            hg_locales = []
-            body = await resp.text()
-            for line in body.split('\n'):
-                try:
-                    locale, _ = line.split(' ', 1)
-                except ValueError:
-                    locale = line
-                # We ignore here ja-JP-mac since because it is ja for the mac platform.
-                # And we want them to be considered as the same locale.
-                if locale and locale != 'ja-JP-mac':
-                    hg_locales.append(locale)
-
-            return hg_locales
+        repo_url = "{}/releases/mozilla-esr{}".format(HG_URL, major)
+        revision = tag
+        locales_path = 'browser'
+
+    key = (repo_url, revision)
+    locales = locales_cache.get(key)
+    if locales is not None:
+        return locales
+
+    url = "{}/raw-file/{}/{}/locales/{}".format(repo_url, revision, locales_path, locales_file)
+    # Only the tip moves, the locales at a tag or a revision are there to stay.
+    immutable = revision != 'tip'
+    resp = await fetch(url, immutable=immutable)
+    if resp.status != 200:
+        msg = '{} not available (HTTP {})'.format(url, resp.status)
+        error_class = NotFoundError if resp.status == 404 else TaskError
+        raise error_class(msg, url=url)
+
+    locales = parse_locales(resp.text())
+    locales_cache.set(key, locales, ttl=FOREVER if immutable else None)
+    return locales
 
 
 def verdict(url, locales, missing_locales, missing_files):
@@ -170,82 +204,157 @@ def verdict(url, locales, missing_locales, missing_files):
     return status, message
 
 
-async def check_nightly_releases_files(url, files, product, version):
+def get_nightly_file_locale(platform, locale):
+    if platform == 'mac' and locale == 'ja':
+        # https://github.com/mozilla/bedrock/ \
+        # blob/d55993a32d6571ce0df1aae62379d94a096324c7/ \
+        # bedrock/firefox/firefox_details.py#L221
+        return 'ja-JP-mac'
+    return locale
+
+
+class NightlyListing:
+    """The files of a nightly l10n listing, indexed by (platform, locale)."""
+
+    def __init__(self, product, version, filenames):
+        self.product = product
+        self.version = version
+        self.platforms = get_nightly_platforms(product)
+        self.files = {}
+        affixes = []
+        for platform, platform_pattern in self.platforms.items():
+            filename = platform_pattern.format_map(dict(version=version, locale='\0'))
+            prefix, suffix = filename.split('\0')
+            affixes.append((platform, prefix, suffix))
+        for filename in filenames:
+            for platform, prefix, suffix in affixes:
+                if (len(filename) > len(prefix) + len(suffix) and
+                        filename.startswith(prefix) and filename.endswith(suffix)):
+                    locale = filename[len(prefix):len(filename) - len(suffix)]
+                    self.files[(platform, locale)] = filename
+
+    def filename(self, platform, locale):
+        """Return the expected name of the file of a locale for a platform."""
+        locale = get_nightly_file_locale(platform, locale)
+        return self.platforms[platform].format_map(dict(version=self.version, locale=locale))
+
+    def __contains__(self, key):
+        platform, locale = key
+        return (platform, get_nightly_file_locale(platform, locale)) in self.files
+
+    def missing_platforms(self, locale):
+        """Return the platforms without any file for this locale."""
+        return [platform for platform in self.platforms if (platform, locale) not in self]
+
+
+def get_nightly_listing(resp, product, version):
+    """Return the index of a nightly l10n listing response, built once per response."""
+    listings = nightly_listings.setdefault(resp, {})
+    listing = listings.get((product, version))
+    if listing is None:
+        filenames = [r["name"] for r in resp.json()["files"]
+                     if r["name"].lower().startswith(product) and
+                     not r["name"].endswith('mar')]
+        listing = NightlyListing(product, version, filenames)
+        listings[(product, version)] = listing
+    return listing
+
+
+async def check_nightly_releases_files(url, listing, product, version):
     locales = await get_locales(product, version)
-    nightly_platforms = get_nightly_platforms(product)
     missing_locales = []
     missing_files = []
     # Make sure all locales are present
     for locale in locales:
-        missing_files_for_locale = []
-        for platform, platform_pattern in nightly_platforms.items():
-            current_locale = locale
-            if platform == 'mac' and locale == 'ja':
-                # https://github.com/mozilla/bedrock/ \
-                # blob/d55993a32d6571ce0df1aae62379d94a096324c7/ \
-                # bedrock/firefox/firefox_details.py#L221
-                current_locale = 'ja-JP-mac'
-            filename = platform_pattern.format_map(dict(version=version,
-                                                        locale=current_locale))
-            if filename not in files:
-                missing_files_for_locale.append(filename)
-        if len(missing_files_for_locale) == len(nightly_platforms):
+        missing_platforms = listing.missing_platforms(locale)
+        if len(missing_platforms) == len(listing.platforms):
             # All platform files where missing for this locale.
             # The locale is missing from the release.
             missing_locales.append(locale)
-        elif missing_files_for_locale:
+        else:
             # Only some files where missing.
             # Add them the list of mising files.
-            missing_files.extend(missing_files_for_locale)
+            missing_files.extend(listing.filename(platform, locale)
+                                 for platform in missing_platforms)
 
     return verdict(url, locales, missing_locales, missing_files)
 
 
 async def get_platform_locale(url, platform):
-    async with get_session() as session:
-        url = '{}/{}/'.format(url.rstrip('/'), platform)
-        async with session.get(url, headers=JSON_HEADERS) as resp:
-            if resp.status != 200:
-                msg = 'Archive CDN not available; failing to get {} (HTTP {})'.format(
-                    url, resp.status)
-                raise TaskError(msg, url=url)
-
-            body = await resp.json()
-            return sorted([p.strip('/') for p in body['prefixes'] if not p.startswith('xpi')])
+    url = '{}/{}/'.format(url.rstrip('/'), platform)
+    resp = await fetch(url, headers=JSON_HEADERS)
+    if resp.status != 200:
+        msg = 'Archive CDN not available; failing to get {} (HTTP {})'.format(
+            url, resp.status)
+        raise TaskError(msg, url=url)
+
+    body = resp.json()
+    return sorted([p.strip('/') for p in body['prefixes'] if not p.startswith('xpi')])
+
+
+class LocalesMatrix:
+    """The release platforms of each locale, as bitsets of ``RELEASE_PLATFORMS``."""
+
+    COMPLETE = (1 << len(RELEASE_PLATFORMS)) - 1
+
+    def __init__(self, rows=None):
+        self.rows = rows or {}
+
+    @classmethod
+    def complete(cls, locales):
+        """A matrix with every locale available for all platforms."""
+        return cls(dict.fromkeys(locales, cls.COMPLETE))
+
+    @classmethod
+    def from_platform_locales(cls, platform_locales):
+        """Build a matrix from the locales of each platform, in ``RELEASE_PLATFORMS`` order."""
+        rows = defaultdict(int)
+        for i, locales in enumerate(platform_locales):
+            for locale in locales:
+                if RELEASE_PLATFORMS[i] == 'mac' and locale == 'ja-JP-mac':
+                    locale = 'ja'
+                rows[locale] |= 1 << i
+        return cls(dict(rows))
+
+    def diff(self, other):
+        """Return the matrix of the platforms where only one matrix has a locale."""
+        rows = {}
+        for locale in self.rows.keys() | other.rows.keys():
+            mask = self.rows.get(locale, 0) ^ other.rows.get(locale, 0)
+            if mask:
+                rows[locale] = mask
+        return LocalesMatrix(rows)
+
+    def platforms(self, locale):
+        mask = self.rows.get(locale, 0)
+        return [platform for i, platform in enumerate(RELEASE_PLATFORMS) if mask >> i & 1]
+
+    def missing(self):
+        """Split a diff into the locales missing for all platforms, and the other files."""
+        missing_locales = []
+        missing_files = []
+        for locale, mask in self.rows.items():
+            if mask == self.COMPLETE:
+                missing_locales.append(locale)
+                continue
+            for platform in self.platforms(locale):
+                file_locale = 'ja-JP-mac' if platform == 'mac' and locale == 'ja' else locale
+                missing_files.append("{} for {}".format(file_locale, platform))
+        return missing_locales, missing_files
+
+
+async def get_locales_matrix(url):
+    """Return the locales matrix of the release or candidate build at this url."""
+    platform_locales = await asyncio.gather(
+        *[get_platform_locale(url, platform) for platform in RELEASE_PLATFORMS])
+    return LocalesMatrix.from_platform_locales(platform_locales)
 
 
 async def check_releases_files(url, product, version):
     # Make sure all platforms have got the same locale set.
-    responses = await asyncio.gather(
-        get_locales(product, version),
-        *[get_platform_locale(url, platform) for platform in RELEASE_PLATFORMS]
-    )
-
-    locales = set(responses[0])
-    platform_locales = map(set, responses[1:])
-
-    missing = defaultdict(set)
-
-    # Make sure the platform locale set matches the expected one.
-    for i, platform_locale in enumerate(platform_locales):
-        platform = RELEASE_PLATFORMS[i]
-        if platform == 'mac' and 'ja-JP-mac' in platform_locale:
-            platform_locale.add('ja')
-            platform_locale.remove('ja-JP-mac')
-        for d in locales ^ platform_locale:
-            missing[d].add(platform)
-
-    missing_locales = []
-    missing_files = []
-    for locale, platforms in missing.items():
-        if len(platforms) < len(RELEASE_PLATFORMS):
-            for platform in platforms:
-                if platform.startswith('mac') and locale == 'ja':
-                    locale = 'ja-JP-mac'
-                missing_files.append("{} for {}".format(locale, platform))
-        else:
-            missing_locales.append(locale)
-
+    locales, matrix = await asyncio.gather(get_locales(product, version),
+                                           get_locales_matrix(url))
+    missing_locales, missing_files = LocalesMatrix.complete(locales).diff(matrix).missing()
     return verdict(url, locales, missing_locales, missing_files)
 
 
@@ -267,72 +376,65 @@ def build_version_url(product, version):
 
 
 async def archives(product, version):
-    async with get_session() as session:
-        channel = get_version_channel(product, version)
-        url = build_version_url(product, version)
-        if channel is Channel.NIGHTLY:
-            message = "No archive found at {}".format(url)
-
-            async with session.get(url, headers=JSON_HEADERS) as resp:
-                if resp.status != 200:
-                    success = False
-                else:
-                    body = await resp.json()
-                    files = sorted([r["name"] for r in body["files"]
-                                    if r["name"].lower().startswith(product) and
-                                    not r["name"].endswith('mar')],
-                                   reverse=True)
-
-                    success, message = await check_nightly_releases_files(
-                        url, files, product, version)
-
-                return build_task_response(success, url, message)
+    channel = get_version_channel(product, version)
+    url = build_version_url(product, version)
+    if channel is Channel.NIGHTLY:
+        message = "No archive found at {}".format(url)
+
+        resp = await fetch(url, headers=JSON_HEADERS)
+        if resp.status != 200:
+            success = False
         else:
-            url = build_version_url(product, version)
+            listing = get_nightly_listing(resp, product, version)
+            success, message = await check_nightly_releases_files(
+                url, listing, product, version)
 
-            async with session.get(url, headers=JSON_HEADERS) as resp:
-                if resp.status >= 500:
-                    msg = 'Archive CDN not available (HTTP {})'.format(resp.status)
-                    raise TaskError(msg, url=url)
-                success = resp.status < 400
-                message = ("No archive found for this version number at {}".format(url))
-                if success:
-                    success, message = await check_releases_files(url, product, version)
-                return build_task_response(success, url, message)
+        return build_task_response(success, url, message)
+    else:
+        resp = await fetch(url, headers=JSON_HEADERS)
+        if resp.status >= 500:
+            msg = 'Archive CDN not available (HTTP {})'.format(resp.status)
+            raise TaskError(msg, url=url)
+        success = resp.status < 400
+        message = ("No archive found for this version number at {}".format(url))
+        if success:
+            success, message = await check_releases_files(url, product, version)
+        # Shipped releases files are never updated, unlike the candidates ones.
+        return build_task_response(success, url, message,
+                                   immutable=channel is not Channel.CANDIDATE)
 
 
 async def partner_repacks(product, version):
     # Not supported for Thunderbird
     channel = get_version_channel(product, version)
-    async with get_session() as session:
-        if channel is Channel.CANDIDATE:
-            url = build_version_url(product, version)
-            version = strip_candidate_info(version)
-        else:
-            base_url = 'https://archive.mozilla.org/pub/{}/candidates/{}-candidates/'.format(
-                product, version)
-            success = False
-            async with session.get(base_url, headers=JSON_HEADERS) as resp:
-                if resp.status != 200:
-                    url = base_url
-                    message = "No candidates found for that version."
-                    return build_task_response(success, url, message)
-
-                body = await resp.json()
-                builds = sorted([p.strip('/') for p in body['prefixes'] if p.startswith('build')],
-                                reverse=True)
-                url = '{}{}/'.format(base_url, builds[0])
-
-        # Look for partner-repacks
-        async with session.get(url, headers=JSON_HEADERS) as resp:
-            body = await resp.json()
-            dirs = sorted([p.strip('/') for p in body['prefixes']])
-            if 'partner-repacks' in dirs:
-                success = True
-                message = "Partner-repacks found in {}".format(url)
-            else:
-                message = "No partner-repacks in {}".format(url)
+    success = False
+    if channel is Channel.CANDIDATE:
+        url = build_version_url(product, version)
+        version = strip_candidate_info(version)
+    else:
+        base_url = 'https://archive.mozilla.org/pub/{}/candidates/{}-candidates/'.format(
+            product, version)
+        resp = await fetch(base_url, headers=JSON_HEADERS)
+        if resp.status != 200:
+            url = base_url
+            message = "No candidates found for that version."
             return build_task_response(success, url, message)
 
+        body = resp.json()
+        builds = sorted([p.strip('/') for p in body['prefixes'] if p.startswith('build')],
+                        reverse=True)
+        url = '{}{}/'.format(base_url, builds[0])
+
+    # Look for partner-repacks
+    resp = await fetch(url, headers=JSON_HEADERS)
+    body = resp.json()
+    dirs = sorted([p.strip('/') for p in body['prefixes']])
+    if 'partner-repacks' in dirs:
+        success = True
+        message = "Partner-repacks found in {}".format(url)
+    else:
+        message = "No partner-repacks in {}".format(url)
+    return build_task_response(success, url, message)
+
 
 heartbeat = heartbeat_factory('https://archive.mozilla.org/pub/firefox/releases/')
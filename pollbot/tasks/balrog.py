@@ -1,30 +1,29 @@
 import re
 
 from pollbot.exceptions import TaskError
-from pollbot.utils import Channel, Status, get_version_channel, build_version_id
-from . import get_session, build_task_response, heartbeat_factory
+from pollbot.utils import Channel, Status, get_version_channel, parse_version
+from . import fetch, build_task_response, heartbeat_factory
 
 
 async def get_release_info(release_mapping):
     release_url = 'https://aus-api.mozilla.org/api/v1/releases/{}'.format(release_mapping)
-    async with get_session() as session:
-        async with session.get(release_url) as resp:
-            body = await resp.json()
-            platforms = body['platforms']
-            built_platforms = [x for x in platforms.keys() if 'locales' in platforms[x]]
-            if not built_platforms:
-                raise TaskError('No platform with locales were found in {}'.format(
-                    sorted(platforms.keys())), url=release_url)
-
-            build_ids = {}
-            appVersions = set()
-
-            for platform in built_platforms:
-                # any value is fine since all locales share the same buildID and displayVersion
-                platform_info = [x for x in platforms[platform]['locales'].values()][0]
-                build_ids[platform] = platform_info['buildID']
-                appVersions.add(platform_info['displayVersion'].replace(' Beta ', 'b'))
-            return build_ids, appVersions
+    resp = await fetch(release_url)
+    body = resp.json()
+    platforms = body['platforms']
+    built_platforms = [x for x in platforms.keys() if 'locales' in platforms[x]]
+    if not built_platforms:
+        raise TaskError('No platform with locales were found in {}'.format(
+            sorted(platforms.keys())), url=release_url)
+
+    build_ids = {}
+    appVersions = set()
+
+    for platform in built_platforms:
+        # any value is fine since all locales share the same buildID and displayVersion
+        platform_info = [x for x in platforms[platform]['locales'].values()][0]
+        build_ids[platform] = platform_info['buildID']
+        appVersions.add(platform_info['displayVersion'].replace(' Beta ', 'b'))
+    return build_ids, appVersions
 
 
 async def balrog_rules(product, version):
@@ -39,44 +38,43 @@ async def balrog_rules(product, version):
             expected_rule_mapping = 'Firefox-mozilla-central-nightly-latest'
         else:
             expected_rule_mapping = 'Thunderbird-comm-central-nightly-latest'
-        async with get_session() as session:
-            async with session.get(url) as resp:
-                rule = await resp.json()
-                status = rule['mapping'] == expected_rule_mapping
-
-                build_ids, appVersions = await get_release_info(rule['mapping'])
-
-                last_build_id = max(build_ids.values())
-                date = last_build_id[:8]
-
-                old_build_id = [bid for bid in build_ids.values() if not bid.startswith(date)]
-
-                if rule['mapping'] != expected_rule_mapping:
-                    status = Status.MISSING
-                    message = ('Balrog rule is configured for {} ({}) instead of '
-                               '"{}"')
-                    message = message.format(rule['mapping'],
-                                             ', '.join(sorted(set(build_ids.values()))),
-                                             expected_rule_mapping)
-                elif old_build_id:
-                    platforms = [k for k, v in build_ids.items() if v in old_build_id]
-                    status = Status.INCOMPLETE
-                    message = ("Balrog rule is configured for {} ({}) platform {} with build ID {}"
-                               " seem outdated.")
-                    message = message.format(rule['mapping'],
-                                             ', '.join(sorted(set(build_ids.values()))),
-                                             ', '.join(platforms),
-                                             ', '.join(sorted(set(old_build_id))))
-                else:
-                    status = Status.EXISTS
-                    message = (
-                        'Balrog rule is configured for the latest Nightly {} build ({}) '
-                        'with an update rate of {}%')
-                    message = message.format(', '.join(sorted(appVersions)),
-                                             ', '.join(sorted(set(build_ids.values()))),
-                                             rule['backgroundRate'])
-
-                return build_task_response(status, url, message)
+        resp = await fetch(url)
+        rule = resp.json()
+        status = rule['mapping'] == expected_rule_mapping
+
+        build_ids, appVersions = await get_release_info(rule['mapping'])
+
+        last_build_id = max(build_ids.values())
+        date = last_build_id[:8]
+
+        old_build_id = [bid for bid in build_ids.values() if not bid.startswith(date)]
+
+        if rule['mapping'] != expected_rule_mapping:
+            status = Status.MISSING
+            message = ('Balrog rule is configured for {} ({}) instead of '
+                       '"{}"')
+            message = message.format(rule['mapping'],
+                                     ', '.join(sorted(set(build_ids.values()))),
+                                     expected_rule_mapping)
+        elif old_build_id:
+            platforms = [k for k, v in build_ids.items() if v in old_build_id]
+            status = Status.INCOMPLETE
+            message = ("Balrog rule is configured for {} ({}) platform {} with build ID {}"
+                       " seem outdated.")
+            message = message.format(rule['mapping'],
+                                     ', '.join(sorted(set(build_ids.values()))),
+                                     ', '.join(platforms),
+                                     ', '.join(sorted(set(old_build_id))))
+        else:
+            status = Status.EXISTS
+            message = (
+                'Balrog rule is configured for the latest Nightly {} build ({}) '
+                'with an update rate of {}%')
+            message = message.format(', '.join(sorted(appVersions)),
+                                     ', '.join(sorted(set(build_ids.values()))),
+                                     rule['backgroundRate'])
+
+        return build_task_response(status, url, message)
 
     elif channel in (Channel.BETA, Channel.AURORA):
         rule_name = 'devedition' if product == 'devedition' else '{}-beta'.format(product)
@@ -92,20 +90,19 @@ async def balrog_rules(product, version):
             rule_name = 'firefox-release'
         url = 'https://aus-api.mozilla.org/api/v1/rules/{}'.format(rule_name)
 
-    async with get_session() as session:
-        async with session.get(url) as resp:
-            rule = await resp.json()
-            build_ids, appVersions = await get_release_info(rule['mapping'])
+    resp = await fetch(url)
+    rule = resp.json()
+    build_ids, appVersions = await get_release_info(rule['mapping'])
 
-            status = build_version_id(appVersions.pop()) >= build_version_id(version)
+    status = parse_version(appVersions.pop()) >= parse_version(version)
 
-            exists_message = (
-                'Balrog rule has been updated for {} ({}) with an update rate of {}%'
-            ).format(rule['mapping'], ', '.join(sorted(set(build_ids.values()))),
-                     rule['backgroundRate'])
-            missing_message = 'Balrog rule is set for {} ({}) which is lower than {}'.format(
-                rule['mapping'], ', '.join(sorted(set(build_ids.values()))), version)
-            return build_task_response(status, url, exists_message, missing_message)
+    exists_message = (
+        'Balrog rule has been updated for {} ({}) with an update rate of {}%'
+    ).format(rule['mapping'], ', '.join(sorted(set(build_ids.values()))),
+             rule['backgroundRate'])
+    missing_message = 'Balrog rule is set for {} ({}) which is lower than {}'.format(
+        rule['mapping'], ', '.join(sorted(set(build_ids.values()))), version)
+    return build_task_response(status, url, exists_message, missing_message)
 
 
 heartbeat = heartbeat_factory('https://aus-api.mozilla.org/__heartbeat__')
@@ -1,15 +1,28 @@
 import os.path
 import re
+from functools import lru_cache
+from html.parser import HTMLParser
 
 from pyquery import PyQuery as pq
 
 from pollbot.exceptions import TaskError
-from pollbot.utils import (build_version_id, Channel, Status, get_version_channel,
+from pollbot.utils import (parse_version, Channel, Status, get_version_channel,
                            get_version_from_filename)
-from . import get_session, heartbeat_factory, build_task_response
+from . import fetch, fetch_until, heartbeat_factory, build_task_response
 from .archives import get_locales
 
 
+# Links to these sites should let them pick the user locale.
+LOCALIZED_DOMAINS = ('https://addons.mozilla.org',
+                     'https://www.mozilla.org',
+                     'https://developer.mozilla.org',
+                     'https://support.mozilla.org')
+
+# Elements without an end tag.
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                           'link', 'meta', 'param', 'source', 'track', 'wbr'])
+
+
 def get_www_server(product):
     if product in ['firefox', 'devedition']:
         return 'www.mozilla.org'
@@ -19,6 +32,113 @@ def get_www_server(product):
         raise Exception('Unknown product {}'.format(product))
 
 
+@lru_cache(maxsize=32)
+def get_locales_matcher(locales):
+    """Return the pattern finding the ``/{locale}/`` parts of a link.
+
+    ``locales`` is a frozenset, the patterns of the recent ones are kept.
+    """
+    # The lookahead finds every locale even when they share their slashes.
+    names = '|'.join(re.escape(locale) for locale in sorted(locales))
+    return re.compile('/(?=({})/)'.format(names))
+
+
+class ReleaseNotesScanner(HTMLParser):
+    """Collect the links of the release notes main content in a single pass.
+
+    Use ``consume`` to feed the page text as it is read, it also looks for
+    the message of the release notes that aren't published yet.
+    """
+
+    COMING_SOON = 'are coming soon!'
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.coming_soon = False
+        self._tail = ''
+        self._stack = []
+        self._main_depth = None
+
+    def consume(self, text):
+        if not self.coming_soon:
+            # The message can be split between two chunks.
+            text_with_tail = self._tail + text
+            self.coming_soon = self.COMING_SOON in text_with_tail
+            self._tail = text_with_tail[-len(self.COMING_SOON) + 1:]
+        self.feed(text)
+        return False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._main_depth is not None and tag == 'a' and attrs.get('href'):
+            self.links.append(attrs['href'])
+        if tag in VOID_ELEMENTS:
+            return
+        self._stack.append(tag)
+        if self._main_depth is None and attrs.get('id') == 'main-content':
+            self._main_depth = len(self._stack)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self._stack:
+            return
+        # Unclosed elements, e.g. <li> or <p>, are closed along with their parent.
+        while self._stack.pop() != tag:
+            pass
+        if self._main_depth is not None and len(self._stack) < self._main_depth:
+            self._main_depth = None
+
+
+class ElementsExtractor(HTMLParser):
+    """Read the attributes of the ``<html>`` element and of the elements with these ids.
+
+    Use ``consume`` to feed the page text, it returns True once they were all found.
+    """
+
+    def __init__(self, ids=()):
+        super().__init__(convert_charrefs=True)
+        self.ids = frozenset(ids)
+        self.html = None
+        self.elements = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'html' and self.html is None:
+            self.html = dict(attrs)
+        element_id = dict(attrs).get('id')
+        if element_id in self.ids and element_id not in self.elements:
+            self.elements[element_id] = dict(attrs)
+
+    @property
+    def done(self):
+        return self.html is not None and len(self.elements) == len(self.ids)
+
+    def consume(self, text):
+        self.feed(text)
+        return self.done
+
+    def attr(self, name, element_id=None):
+        attrs = self.html if element_id is None else self.elements.get(element_id)
+        return (attrs or {}).get(name)
+
+
+def count_unexpected_links(links, locales):
+    """Return the number of HTTP links and of links containing a locale."""
+    matcher = get_locales_matcher(locales)
+    http_count = 0
+    localized_count = 0
+    for link in links:
+        if link.startswith('http://'):
+            http_count += 1
+        elif link.startswith(LOCALIZED_DOMAINS):
+            localized_count += len({m.group(1) for m in matcher.finditer(link)})
+    return http_count, localized_count
+
+
 async def release_notes(product, full_version):
     channel = get_version_channel(product, full_version)
     version = full_version
@@ -36,67 +156,41 @@ async def release_notes(product, full_version):
         version
     )
 
-    async with get_session() as session:
-        async with session.get(url, allow_redirects=False) as resp:
-            status = resp.status == 200
-
-            body = await resp.text()
-
-            localized_count = 0
-            http_count = 0
-            coming_soon = False
-
-            if body:
-
-                if 'are coming soon!' in body:
-                    coming_soon = True
-
-                d = pq(body)
-
-                domains = ['https://addons.mozilla.org',
-                           'https://www.mozilla.org',
-                           'https://developer.mozilla.org',
-                           'https://support.mozilla.org']
-
-                locales = await get_locales(product, full_version)
-
-                links = [d(n).attr('href') for n in d('#main-content a')]
-
-                for link in links:
-                    if link.startswith('http://'):
-                        http_count += 1
-                    else:
-                        for domain in domains:
-                            if link.startswith(domain):
-                                for locale in locales:
-                                    if '/{}/'.format(locale) in link:
-                                        localized_count += 1
-
-            exists_message = "Release notes were found for version {}".format(version)
-            missing_message = "No release notes were published for version {}".format(version)
-            if localized_count > 0:
-                exists_message += " but {} {} should not contain the locale in the URL"
-                exists_message = exists_message.format(localized_count,
-                                                       'links' if localized_count > 1 else 'link')
-                status = Status.INCOMPLETE
-
-            if coming_soon:
-                exists_message += ' but show a `coming soon` message.'
-                status = Status.INCOMPLETE
-            elif localized_count and http_count:
-                exists_message += ' and '
-            elif http_count:
-                exists_message += ' but '
-            else:
-                exists_message += '.'
+    # The page is scanned as it is read, without keeping it.
+    response_status, scanner = await fetch_until(url, ReleaseNotesScanner,
+                                                 allow_redirects=False)
+    status = response_status == 200
+    coming_soon = scanner.coming_soon
+    http_count = localized_count = 0
+    if scanner.links:
+        locales = await get_locales(product, full_version)
+        http_count, localized_count = count_unexpected_links(scanner.links, locales)
+
+    exists_message = "Release notes were found for version {}".format(version)
+    missing_message = "No release notes were published for version {}".format(version)
+    if localized_count > 0:
+        exists_message += " but {} {} should not contain the locale in the URL"
+        exists_message = exists_message.format(localized_count,
+                                               'links' if localized_count > 1 else 'link')
+        status = Status.INCOMPLETE
+
+    if coming_soon:
+        exists_message += ' but show a `coming soon` message.'
+        status = Status.INCOMPLETE
+    elif localized_count and http_count:
+        exists_message += ' and '
+    elif http_count:
+        exists_message += ' but '
+    else:
+        exists_message += '.'
 
-            if http_count > 0:
-                exists_message += "{} {} should use the HTTPS protocol rather than HTTP."
-                exists_message = exists_message.format(http_count,
-                                                       'links' if localized_count > 1 else 'link')
-                status = Status.INCOMPLETE
+    if http_count > 0:
+        exists_message += "{} {} should use the HTTPS protocol rather than HTTP."
+        exists_message = exists_message.format(http_count,
+                                               'links' if localized_count > 1 else 'link')
+        status = Status.INCOMPLETE
 
-            return build_task_response(status, url, exists_message, missing_message)
+    return build_task_response(status, url, exists_message, missing_message)
 
 
 async def security_advisories(product, version):
@@ -111,40 +205,45 @@ async def security_advisories(product, version):
             message="Security advisories are never published for {} releases".format(
                 channel.value.lower()))
 
-    async with get_session() as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                msg = 'Security advisories page not available  ({})'.format(resp.status)
-                raise TaskError(msg)
-            # Does the content contains the version number?
-            body = await resp.text()
-            d = pq(body)
-
-            if product in ['firefox', 'devedition']:
-                security_product = 'firefox'
-                if channel is Channel.ESR:
-                    version = re.sub('esr$', '', version)
-                    last_release = d("html").attr('data-esr-versions')
-                else:
-                    last_release = d("html").attr('data-latest-firefox')
-            elif product == 'thunderbird':
-                security_product = product
-                last_release_h3_id = d('h3.level-heading:first').attr('id')  # thunderbird91.6.1
-                if not last_release_h3_id.startswith('thunderbird'):
-                    msg = 'Security advisories not found for {}'.format(product)
-                    raise TaskError(msg)
-                last_release = last_release_h3_id[11:]  # Drop "thunderbird" prefix
-
-            status = build_version_id(last_release) >= build_version_id(version)
-            message = ("Security advisories for release were "
-                       "updated up to version {}".format(last_release))
-
-            version_title = "#{}{}".format(security_product, version.split('.')[0])
-            if status and not d(version_title):
-                status = Status.INCOMPLETE
-                message += " but nothing was published for {} yet.".format(version_title)
-
-            return build_task_response(status, url, message)
+    if product == 'thunderbird':
+        resp = await fetch(url)
+        if resp.status != 200:
+            msg = 'Security advisories page not available  ({})'.format(resp.status)
+            raise TaskError(msg)
+        d = pq(resp.text())
+        security_product = product
+        last_release_h3_id = d('h3.level-heading:first').attr('id')  # thunderbird91.6.1
+        if not last_release_h3_id.startswith('thunderbird'):
+            msg = 'Security advisories not found for {}'.format(product)
+            raise TaskError(msg)
+        last_release = last_release_h3_id[11:]  # Drop "thunderbird" prefix
+        published = d('#thunderbird{}'.format(version.split('.')[0]))
+    else:
+        security_product = 'firefox'
+        if channel is Channel.ESR:
+            version = re.sub('esr$', '', version)
+            attribute = 'data-esr-versions'
+        else:
+            attribute = 'data-latest-firefox'
+        # The latest advisories are at the top of the page, stop reading once found.
+        version_id = "{}{}".format(security_product, version.split('.')[0])
+        status, extractor = await fetch_until(url, ElementsExtractor, (version_id,))
+        if status != 200:
+            msg = 'Security advisories page not available  ({})'.format(status)
+            raise TaskError(msg)
+        last_release = extractor.attr(attribute)
+        published = version_id in extractor.elements
+
+    status = parse_version(last_release) >= parse_version(version)
+    message = ("Security advisories for release were "
+               "updated up to version {}".format(last_release))
+
+    version_title = "#{}{}".format(security_product, version.split('.')[0])
+    if status and not published:
+        status = Status.INCOMPLETE
+        message += " but nothing was published for {} yet.".format(version_title)
+
+    return build_task_response(status, url, message)
 
 
 def get_downloads_url(product, channel):
@@ -167,50 +266,64 @@ def get_downloads_url(product, channel):
     return url
 
 
+async def read_download_page(url, ids=()):
+    """Stream the download page until the <html> element and these ids are found."""
+    status, extractor = await fetch_until(url, ElementsExtractor, tuple(ids))
+    if status != 200:
+        msg = 'Download page not available  ({})'.format(status)
+        raise TaskError(msg)
+    return extractor
+
+
 async def download_links(product, version):
     channel = get_version_channel(product, version)
     url = get_downloads_url(product, channel)
 
-    async with get_session() as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                msg = 'Download page not available  ({})'.format(resp.status)
-                raise TaskError(msg)
-            body = await resp.text()
-            d = pq(body)
-
-            if product == 'thunderbird':
-                if channel is Channel.NIGHTLY:
-                    link_path = ".download-link.btn-daily"
-                    url = d(link_path).attr('href')
-                    filename = os.path.basename(url)
-                    last_release = get_version_from_filename(filename)
-                else:
-                    last_release = d("#all-downloads").attr('data-thunderbird-version')
+    if channel in (Channel.NIGHTLY, Channel.BETA, Channel.AURORA):
+        resp = await fetch(url)
+        if resp.status != 200:
+            msg = 'Download page not available  ({})'.format(resp.status)
+            raise TaskError(msg)
+        body = resp.text()
+        d = pq(body)
+
+        if product == 'thunderbird':
+            if channel is Channel.NIGHTLY:
+                link_path = ".download-link.btn-daily"
+                url = d(link_path).attr('href')
+                filename = os.path.basename(url)
+                last_release = get_version_from_filename(filename)
             else:
-                if channel in (Channel.NIGHTLY, Channel.BETA, Channel.AURORA):
-                    if product == 'devedition':
-                        link_path = "#intro-download > .download-list > .os_linux64 > a"
-                    elif channel is Channel.NIGHTLY:
-                        link_path = "#desktop-nightly-download > .download-list > .os_linux64 > a"
-                    else:  # channel is Channel.BETA:
-                        link_path = "#desktop-beta-download > .download-list > .os_linux64 > a"
-                    url = d(link_path).attr('href')
-                    async with session.get(url, allow_redirects=False) as resp:
-                        url = resp.headers['Location']
-                        filename = os.path.basename(url)
-                        last_release = get_version_from_filename(filename)
-                elif channel is Channel.ESR:
-                    version = re.sub('esr$', '', version)
-                    last_release = d("html").attr('data-esr-versions')
-                else:
-                    # Does the content contains the version number?
-                    last_release = d("html").attr('data-latest-firefox')
-
-            status = build_version_id(last_release) >= build_version_id(version)
-            message = ("The download links for release have been published for version {}".format(
-                last_release))
-            return build_task_response(status, url, message)
+                last_release = d("#all-downloads").attr('data-thunderbird-version')
+        else:
+            if product == 'devedition':
+                link_path = "#intro-download > .download-list > .os_linux64 > a"
+            elif channel is Channel.NIGHTLY:
+                link_path = "#desktop-nightly-download > .download-list > .os_linux64 > a"
+            else:  # channel is Channel.BETA:
+                link_path = "#desktop-beta-download > .download-list > .os_linux64 > a"
+            url = d(link_path).attr('href')
+            resp = await fetch(url, allow_redirects=False)
+            url = resp.headers['Location']
+            filename = os.path.basename(url)
+            last_release = get_version_from_filename(filename)
+    # The versions of the release pages are read without downloading the whole page.
+    elif product == 'thunderbird':
+        extractor = await read_download_page(url, ids=['all-downloads'])
+        last_release = extractor.attr('data-thunderbird-version', 'all-downloads')
+    elif channel is Channel.ESR:
+        version = re.sub('esr$', '', version)
+        extractor = await read_download_page(url)
+        last_release = extractor.attr('data-esr-versions')
+    else:
+        # Does the content contains the version number?
+        extractor = await read_download_page(url)
+        last_release = extractor.attr('data-latest-firefox')
+
+    status = parse_version(last_release) >= parse_version(version)
+    message = ("The download links for release have been published for version {}".format(
+        last_release))
+    return build_task_response(status, url, message)
 
 
 heartbeat = heartbeat_factory('https://www.mozilla.org/en-US/firefox/all/')
@@ -2,9 +2,9 @@ import os.path
 
 
 from pollbot.exceptions import TaskError
-from pollbot.utils import (build_version_id, Channel, get_version_channel,
+from pollbot.utils import (parse_version, Channel, get_version_channel,
                            get_version_from_filename)
-from . import get_session, heartbeat_factory, build_task_response
+from . import fetch, heartbeat_factory, build_task_response
 
 
 async def bouncer(product, version):
@@ -28,19 +28,18 @@ async def bouncer(product, version):
     url = 'https://download.mozilla.org?product={}-latest-ssl&os=linux64&lang=en-US'.format(
             product_channel)
 
-    async with get_session() as session:
-        async with session.get(url, allow_redirects=False) as resp:
-            if resp.status == 302:
-                url = resp.headers['Location']
-            else:
-                msg = 'Bouncer is down ({}).'.format(resp.status)
-                raise TaskError(msg, url=url)
-
-            filename = os.path.basename(url)
-            last_release = get_version_from_filename(filename)
-            status = build_version_id(last_release) >= build_version_id(version)
-            message = "Bouncer for {} redirects to version {}".format(channel_value, last_release)
-            return build_task_response(status, url, message)
+    resp = await fetch(url, allow_redirects=False)
+    if resp.status == 302:
+        url = resp.headers['Location']
+    else:
+        msg = 'Bouncer is down ({}).'.format(resp.status)
+        raise TaskError(msg, url=url)
+
+    filename = os.path.basename(url)
+    last_release = get_version_from_filename(filename)
+    status = parse_version(last_release) >= parse_version(version)
+    message = "Bouncer for {} redirects to version {}".format(channel_value, last_release)
+    return build_task_response(status, url, message)
 
 
 heartbeat = heartbeat_factory('https://download.mozilla.org/')
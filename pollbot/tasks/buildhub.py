@@ -1,11 +1,12 @@
 import json
 
-from pollbot.exceptions import TaskError
+from pollbot.exceptions import NotFoundError, TaskError
 from pollbot.utils import (
-    Channel, Status, build_version_id, get_version_channel, yesterday, strip_candidate_info
+    Channel, Status, get_version_channel, parse_version, yesterday, strip_candidate_info
 )
 
-from . import get_session, build_task_response, heartbeat_factory
+from . import fetch, build_task_response, heartbeat_factory
+from .product_details import ongoing_versions
 
 
 BUILDHUB_HEARTBEAT = "https://buildhub.moz.tools/__heartbeat__"
@@ -49,24 +50,23 @@ async def get_releases(product):
         },
         "size": 0
     }
-    async with get_session() as session:
-        async with session.post(BUILDHUB_API, data=json.dumps(query)) as response:
-            if response.status != 200:
-                message = "Buildhub is not available ({})".format(response.status)
-                url = "{}?products[0]={}".format(BUILDHUB_WEB, product)
-                raise TaskError(message, url=url)
+    response = await fetch(BUILDHUB_API, method='POST', data=json.dumps(query))
+    if response.status != 200:
+        message = "Buildhub is not available ({})".format(response.status)
+        url = "{}?products[0]={}".format(BUILDHUB_WEB, product)
+        raise TaskError(message, url=url)
 
-            data = await response.json()
-        versions = sorted([r['key'] for r in data['aggregations']['by_version']['buckets']
-                           if strip_candidate_info(r['key']) == r['key']],
-                          key=lambda version: build_version_id(version))
+    data = response.json()
+    versions = sorted([r['key'] for r in data['aggregations']['by_version']['buckets']
+                       if strip_candidate_info(r['key']) == r['key']],
+                      key=parse_version)
 
-        if not versions:
-            message = "Couldn't find any version matching."
-            url = "{}?products[0]={}".format(BUILDHUB_WEB, product)
-            raise TaskError(message, url=url)
+    if not versions:
+        message = "Couldn't find any version matching."
+        url = "{}?products[0]={}".format(BUILDHUB_WEB, product)
+        raise NotFoundError(message, url=url)
 
-        return versions
+    return versions
 
 
 def get_buildhub_url(product, version, channel):
@@ -118,16 +118,36 @@ async def get_build_ids_for_version(product, version, *, size=10):
         },
         "size": 0
     }
-    async with get_session() as session:
-        async with session.post(BUILDHUB_API, data=json.dumps(query)) as response:
-            data = await response.json()
-        build_ids = [r['key'] for r in data['aggregations']['by_version']['buckets']]
+    response = await fetch(BUILDHUB_API, method='POST', data=json.dumps(query))
+    data = response.json()
+    build_ids = [r['key'] for r in data['aggregations']['by_version']['buckets']]
 
-        if not build_ids:
-            message = "Couldn't find any build matching."
-            raise TaskError(message, url=get_buildhub_url(product, version, channel))
+    if not build_ids:
+        message = "Couldn't find any build matching."
+        raise NotFoundError(message, url=get_buildhub_url(product, version, channel))
 
-        return build_ids
+    return build_ids
+
+
+async def is_finished_version(product, version, channel):
+    """Return True once a newer version than this one was shipped on its channel,
+    or on its branch for ESR versions.
+
+    No more builds are added to a finished version, e.g. for a respin.
+    """
+    if channel not in (Channel.RELEASE, Channel.ESR):
+        return False
+    try:
+        versions = await ongoing_versions(product)
+    except TaskError:
+        return False
+    current = versions.get(channel.value.lower())
+    if not isinstance(current, str):
+        return False
+    if channel is Channel.ESR and current.split('.')[0] != version.split('.')[0]:
+        # An older ESR branch may still be updated alongside the current one.
+        return False
+    return parse_version(current) > parse_version(version)
 
 
 async def buildhub(product, version):
@@ -156,7 +176,9 @@ async def buildhub(product, version):
         exists_message = exists_message.format(', '.join(build_ids))
 
     url = get_buildhub_url(product, version, channel)
-    return build_task_response(status, url, exists_message, missing_message)
+    immutable = status is True and await is_finished_version(product, version, channel)
+    return build_task_response(status, url, exists_message, missing_message,
+                               immutable=immutable)
 
 
 heartbeat = heartbeat_factory(BUILDHUB_HEARTBEAT)
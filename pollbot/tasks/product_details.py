@@ -1,6 +1,6 @@
 from pollbot.exceptions import TaskError
-from pollbot.utils import Channel, get_version_channel, build_version_id, Status
-from . import get_session, heartbeat_factory, build_task_response
+from pollbot.utils import Channel, get_version_channel, parse_version, Status
+from . import fetch, heartbeat_factory, build_task_response
 
 _product_details = {
     "thunderbird": {
@@ -49,39 +49,37 @@ def details_ongoing_versions(product, body):
 
 
 async def ongoing_versions(product):
-    async with get_session() as session:
-        url = 'https://product-details.mozilla.org/1.0/{}'.format(details_versions_url(product))
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                msg = 'Product Details info not available (HTTP {})'.format(resp.status)
-                raise TaskError(msg, url=url)
-            body = await resp.json()
-            return details_ongoing_versions(product, body)
+    url = 'https://product-details.mozilla.org/1.0/{}'.format(details_versions_url(product))
+    resp = await fetch(url)
+    if resp.status != 200:
+        msg = 'Product Details info not available (HTTP {})'.format(resp.status)
+        raise TaskError(msg, url=url)
+    body = resp.json()
+    return details_ongoing_versions(product, body)
 
 
 async def product_details(product, version):
     if get_version_channel(product, version) is Channel.NIGHTLY:
         versions = await ongoing_versions(product)
-        status = build_version_id(versions["nightly"]) >= build_version_id(version)
+        status = parse_version(versions["nightly"]) >= parse_version(version)
         message = "Last nightly version is {}".format(versions["nightly"])
         url = "https://product-details.mozilla.org/1.0/{}".format(details_versions_url(product))
         return build_task_response(status, url, message)
 
-    async with get_session() as session:
-        url = 'https://product-details.mozilla.org/1.0/{}'.format(details_releases_url(product))
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                msg = 'Product Details info not available (HTTP {})'.format(resp.status)
-                raise TaskError(msg, url=url)
-            body = await resp.json()
-            details_product = 'firefox' if product == 'devedition' else product
-            status = '{}-{}'.format(details_product, version) in body['releases']
-
-            exists_message = "We found product-details information about version {}"
-            missing_message = "We did not find product-details information about version {}"
-            return build_task_response(status, url,
-                                       exists_message.format(version),
-                                       missing_message.format(version))
+    url = 'https://product-details.mozilla.org/1.0/{}'.format(details_releases_url(product))
+    resp = await fetch(url)
+    if resp.status != 200:
+        msg = 'Product Details info not available (HTTP {})'.format(resp.status)
+        raise TaskError(msg, url=url)
+    body = resp.json()
+    details_product = 'firefox' if product == 'devedition' else product
+    status = '{}-{}'.format(details_product, version) in body['releases']
+
+    exists_message = "We found product-details information about version {}"
+    missing_message = "We did not find product-details information about version {}"
+    return build_task_response(status, url,
+                               exists_message.format(version),
+                               missing_message.format(version))
 
 
 async def devedition_and_beta_in_sync(product, version):
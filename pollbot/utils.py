@@ -1,5 +1,9 @@
 import datetime
 from enum import Enum
+from functools import lru_cache, total_ordering
+
+# Number of parsed versions kept in memory.
+VERSIONS_CACHE_SIZE = 4096
 
 
 class Channel(Enum):
@@ -35,7 +39,7 @@ def strip_candidate_info(version):
     return version
 
 
-def build_version_id(version):
+def _version_id(version):
     channel = '0'
 
     version = strip_candidate_info(version)
@@ -60,6 +64,7 @@ def build_version_id(version):
                                release_code, channel.zfill(3))
 
 
+@lru_cache(maxsize=VERSIONS_CACHE_SIZE)
 def get_version_channel(product, version):  # pragma: no cover
     if version.endswith('esr'):
         return Channel.ESR
@@ -75,6 +80,55 @@ def get_version_channel(product, version):  # pragma: no cover
         return Channel.RELEASE
 
 
+@total_ordering
+class Version:
+    """A parsed product version, ordered like the release process.
+
+    Versions of the same build compare equal, e.g. ``57.0`` and ``57.0build2``.
+    Use ``parse_version`` to get them, parsed versions are memoized.
+    """
+    __slots__ = ('string', 'key', 'channel')
+
+    def __init__(self, version):
+        self.string = version
+        self.key = _version_id(version)
+        # The channel of the firefox and thunderbird versions, see ``get_channel``.
+        self.channel = get_version_channel(None, version)
+
+    def get_channel(self, product):
+        if product == 'devedition' and self.channel is Channel.BETA:
+            return Channel.AURORA
+        return self.channel
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.key == other.key
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return 'Version({!r})'.format(self.string)
+
+    def __str__(self):
+        return self.string
+
+
+@lru_cache(maxsize=VERSIONS_CACHE_SIZE)
+def parse_version(version):
+    return Version(version)
+
+
+def build_version_id(version):
+    return parse_version(version).key
+
+
 def get_version_from_filename(filename):
     parts = filename.split('-', 1)[1].split('.')[:-2]  # Remove firefox- and .tar.bz2
     return '.'.join([p for p in parts if p[0].isdigit()])
@@ -82,9 +136,9 @@ def get_version_from_filename(filename):
 
 def is_valid_version(version):
     try:
-        build_version_id(version)
+        parse_version(version)
         return True
-    except IndexError:
+    except (IndexError, ValueError):
         return False
 
 
@@ -1,6 +1,5 @@
-from aiohttp import web
-
 from pollbot import PRODUCTS
+from ..codec import json_response
 from ..utils import is_valid_version, Channel, get_version_channel
 
 
@@ -10,13 +9,13 @@ def validate_product_version(func):
         version = request.match_info.get('version')
 
         if product not in PRODUCTS:
-            return web.json_response({
+            return json_response({
                 'status': 404,
                 'message': 'Invalid product: {} not in {}'.format(product, PRODUCTS)
             }, status=404)
 
         if version and not is_valid_version(version):
-            return web.json_response({
+            return json_response({
                 'status': 404,
                 'message': 'Invalid version number: {}'.format(version)
             }, status=404)
@@ -25,7 +24,7 @@ def validate_product_version(func):
             if product == "devedition":
                 channel = get_version_channel(product, version)
                 if channel is not Channel.AURORA:
-                    return web.json_response({
+                    return json_response({
                         'status': 404,
                         'message': 'Invalid version number for devedition: {}'.format(version)
                     }, status=404)
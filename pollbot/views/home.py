@@ -1,6 +1,7 @@
 from aiohttp import web
 
 from .. import __version__ as pollbot_version, HTTP_API_VERSION, PRODUCTS
+from ..codec import json_response
 
 
 async def redirect(request):
@@ -10,7 +11,7 @@ async def redirect(request):
 async def index(request):
     proto = request.headers.get('X-Forwarded-Proto', 'http')
     host = request.headers['Host']
-    return web.json_response({
+    return json_response({
         "project_name": "pollbot",
         "project_version": pollbot_version,
         "url": "https://github.com/mozilla/PollBot",
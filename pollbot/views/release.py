@@ -1,55 +1,124 @@
+import asyncio
 import logging
+import os
+import time
 from aiohttp import web
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
 
+from pollbot import PRODUCTS
+from .. import codec
+from ..codec import json_response
 from ..tasks import balrog, buildhub, telemetry
 from ..tasks.archives import archives, partner_repacks
 from ..tasks.bedrock import release_notes, security_advisories, download_links
 from ..tasks.bouncer import bouncer
 from ..tasks.buildhub import get_releases
 from ..tasks.product_details import product_details, devedition_and_beta_in_sync
-from ..utils import Channel, get_version_channel
+from ..utils import Channel, Status, get_version_channel, is_valid_version
 from .decorators import validate_product_version
 
 logger = logging.getLogger(__package__)
 
 
-def status_response(task):
+def get_check_ttl(check_name):
+    env_name = "POLLBOT_CACHE_TTL_{}".format(check_name.upper().replace('-', '_'))
+    return int(os.getenv(env_name, CHECKS_TTL[check_name]))
+
+
+def is_missing(response):
+    return response["status"] == Status.MISSING.value
+
+
+def is_immutable(response):
+    return getattr(response, "immutable", False)
+
+
+async def run_check(app, task, check_name, product, version):
+    """Run a check task, through the results cache when it is named.
+
+    Return the response body along with whether it is immutable.
+    """
+    scheduler = app.get('scheduler')
+    if scheduler is not None:
+        scheduler.touch(product, version)
+
+    cache = None
+    if check_name is not None:
+        cache = app.get('results_cache')
+
+    try:
+        if cache is not None:
+            key = (check_name, product, version)
+            response = await cache.get_or_compute(key,
+                                                  lambda: task(product, version),
+                                                  ttl=get_check_ttl(check_name),
+                                                  is_negative=is_missing,
+                                                  is_immutable=is_immutable)
+            return response, cache.is_immutable(key)
+        response = await task(product, version)
+        return response, is_immutable(response)
+    except Exception as e:  # In case something went bad, we return an error status message
+        logger.exception(e)
+        body = {
+            'status': 'error',
+            'message': str(e)
+        }
+        if hasattr(e, 'url') and e.url is not None:
+            body['link'] = e.url
+        return body, False
+
+
+def status_response(task, check_name=None):
     @validate_product_version
     async def wrapped(request, product, version):
-        try:
-            response = await task(product, version)
-        except Exception as e:  # In case something went bad, we return an error status message
-            logger.exception(e)
-            body = {
-                'status': 'error',
-                'message': str(e)
-            }
-            if hasattr(e, 'url') and e.url is not None:
-                body['link'] = e.url
-
-            return web.json_response(body)
-        return web.json_response(response)
+        body, immutable = await run_check(request.app, task, check_name, product, version)
+        response = json_response(body)
+        response['immutable'] = immutable
+        return response
     return wrapped
 
 
-archive = status_response(archives)
-partner_repacks = status_response(partner_repacks)
-bedrock_release_notes = status_response(release_notes)
-bedrock_security_advisories = status_response(security_advisories)
-bedrock_download_links = status_response(download_links)
-bouncer_download_links = status_response(bouncer)
-product_details = status_response(product_details)
-devedition_beta_check = status_response(devedition_and_beta_in_sync)
-balrog_rules = status_response(balrog.balrog_rules)
-buildhub_check = status_response(buildhub.buildhub)
-telemetry_uptake = status_response(telemetry.main_summary_uptake)
+# The check tasks by name, used to run them all at once.
+CHECKS_TASKS = {
+    "archive": archives,
+    "partner-repacks": partner_repacks,
+    "release-notes": release_notes,
+    "security-advisories": security_advisories,
+    "download-links": download_links,
+    "bouncer": bouncer,
+    "product-details": product_details,
+    "devedition-beta-matches": devedition_and_beta_in_sync,
+    "balrog-rules": balrog.balrog_rules,
+    "buildhub": buildhub.buildhub,
+    "telemetry-main-summary-uptake": telemetry.main_summary_uptake,
+}
+
+archive = status_response(archives, "archive")
+partner_repacks = status_response(partner_repacks, "partner-repacks")
+bedrock_release_notes = status_response(release_notes, "release-notes")
+bedrock_security_advisories = status_response(security_advisories, "security-advisories")
+bedrock_download_links = status_response(download_links, "download-links")
+bouncer_download_links = status_response(bouncer, "bouncer")
+product_details = status_response(product_details, "product-details")
+devedition_beta_check = status_response(devedition_and_beta_in_sync, "devedition-beta-matches")
+balrog_rules = status_response(balrog.balrog_rules, "balrog-rules")
+buildhub_check = status_response(buildhub.buildhub, "buildhub")
+telemetry_uptake = status_response(telemetry.main_summary_uptake,
+                                   "telemetry-main-summary-uptake")
 
 
 @validate_product_version
 async def view_get_releases(request, product):
-    return web.json_response({
-        "releases": await get_releases(product)
+    cache = request.app.get('results_cache')
+    if cache is not None:
+        releases = await cache.get_or_compute(("releases", product),
+                                              lambda: get_releases(product),
+                                              ttl=RELEASES_TTL)
+    else:
+        releases = await get_releases(product)
+    return json_response({
+        "releases": releases
     })
 
 
@@ -90,46 +159,213 @@ CHECKS = OrderedDict(
                                           Channel.AURORA, Channel.NIGHTLY],
     }.items(), key=lambda t: t[0]))
 
+# How long (in seconds) a check result is kept in the results cache.
+# Each value can be overridden with a POLLBOT_CACHE_TTL_<CHECK_NAME> variable.
+CHECKS_TTL = {
+    "archive": 30,
+    "partner-repacks": 60,
+    "release-notes": 60,
+    "security-advisories": 60,
+    "download-links": 60,
+    "product-details": 60,
+    "devedition-beta-matches": 60,
+    "balrog-rules": 30,
+    "bouncer": 30,
+    "buildhub": 60,
+    "telemetry-main-summary-uptake": 300,
+}
+
+# How long (in seconds) the list of product releases is kept in the results cache.
+RELEASES_TTL = int(os.getenv("POLLBOT_CACHE_TTL_RELEASES", "300"))
+
 NOT_ACTIONABLE = ['-uptake']
+# Maximum number of checks of a batch request, and how many of them run at once.
+BATCH_MAX_SIZE = int(os.getenv("POLLBOT_BATCH_MAX_SIZE", "100"))
+BATCH_CONCURRENCY = int(os.getenv("POLLBOT_BATCH_CONCURRENCY", "10"))
+# Accept header values for which check results are streamed as they complete.
+STREAM_CONTENT_TYPES = ('application/x-ndjson', 'text/event-stream')
 IGNORES = {'devedition': ['partner-repacks'],
            'thunderbird': ['partner-repacks',
                            'devedition-beta-matches',
                            'telemetry-main-summary-uptake']}
 
 
-@validate_product_version
-async def view_get_checks(request, product, version):
+CheckPlan = namedtuple('CheckPlan', ['name', 'title', 'path', 'actionable'])
+
+
+def build_check_plans(router=None):
+    """Return the checks to run, actionable ones first, by product and channel.
+
+    With a ``router``, each check gets the path of its endpoint for the
+    product, with a ``{version}`` placeholder.
+    """
+    plans = {}
+    for product in PRODUCTS:
+        for channel in Channel:
+            checks = []
+            for check_name, channels in CHECKS.items():
+                if channel not in channels or check_name in IGNORES.get(product, []):
+                    continue
+                path = None
+                if router is not None:
+                    path = router[check_name].canonical.replace('{product}', product)
+                actionable = all([na not in check_name for na in NOT_ACTIONABLE])
+                checks.append(CheckPlan(check_name, CHECKS_TITLE[check_name], path, actionable))
+            checks.sort(key=lambda plan: plan.actionable, reverse=True)
+            plans[(product, channel)] = tuple(checks)
+    return MappingProxyType(plans)
+
+
+CHECK_PLANS = build_check_plans()
+
+
+def setup_check_plans(app):
+    """Prepare the check plans of the app, once its routes are all added."""
+    app['check_plans'] = build_check_plans(app.router)
+
+
+def get_version_checks(product, version):
+    """Return the names of the checks related to this product version."""
     channel = get_version_channel(product, version)
+    return [plan.name for plan in CHECK_PLANS[(product, channel)]]
 
+
+def get_checks_info(request, product, version):
     proto = request.headers.get('X-Forwarded-Proto', 'http')
     host = request.headers['Host']
+    prefix = "{}://{}".format(proto, host)
+    plans = request.app['check_plans'][(product, get_version_channel(product, version))]
+    return [(plan.name, {
+        "title": plan.title,
+        "url": prefix + plan.path.replace('{version}', version),
+        "actionable": plan.actionable,
+    }) for plan in plans]
+
+
+@validate_product_version
+async def view_get_checks(request, product, version):
+    channel = get_version_channel(product, version)
+    return json_response({
+        "product": product,
+        "version": version,
+        "channel": channel.value.lower(),
+        "checks": [info for _, info in get_checks_info(request, product, version)],
+    })
+
+
+async def timed_check(request, check_name, info, product, version):
+    started = time.monotonic()
+    body, immutable = await run_check(request.app, CHECKS_TASKS[check_name], check_name,
+                                      product, version)
+    info = dict(info, result=body, duration=round(time.monotonic() - started, 3))
+    return info, immutable
+
+
+def get_stream_content_type(request):
+    accept = request.headers.get('Accept', '')
+    for content_type in STREAM_CONTENT_TYPES:
+        if content_type in accept:
+            return content_type
+
+
+async def stream_checks(request, content_type, runs):
+    """Write each check result as soon as it is available."""
+    response = web.StreamResponse(headers={'Content-Type': content_type,
+                                           'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    for run in asyncio.as_completed(runs):
+        info, _ = await run
+        data = codec.dumps(info)
+        if content_type == 'text/event-stream':
+            data = b'event: check\ndata: ' + data + b'\n'
+        await response.write(data + b'\n')
+    if content_type == 'text/event-stream':
+        # Otherwise EventSource clients would reconnect.
+        await response.write(b'event: end\ndata: {}\n\n')
+    await response.write_eof()
+    return response
+
+
+@validate_product_version
+async def view_run_checks(request, product, version):
+    channel = get_version_channel(product, version)
+    runs = [timed_check(request, check_name, info, product, version)
+            for check_name, info in get_checks_info(request, product, version)]
 
-    checks = []
-    router = request.app.router
-
-    for check_name, channels in CHECKS.items():
-        check_related_to_version = False
-        if channel in channels:
-            # List of related channels
-            check_related_to_version = True
-
-        if product in IGNORES:
-            if check_name in IGNORES[product]:
-                check_related_to_version = False
-
-        if check_related_to_version:
-            prefix = "{}://{}".format(proto, host)
-            url = router[check_name].url_for(product=product, version=version)
-            info = {
-                "title": CHECKS_TITLE[check_name],
-                "url": "{}{}".format(prefix, url),
-                "actionable": all([na not in check_name for na in NOT_ACTIONABLE])
-            }
-            checks.append(info)
-
-    return web.json_response({
+    content_type = get_stream_content_type(request)
+    if content_type is not None:
+        return await stream_checks(request, content_type, runs)
+
+    outcomes = await asyncio.gather(*runs)
+    response = json_response({
         "product": product,
         "version": version,
         "channel": channel.value.lower(),
-        "checks": sorted(checks, key=lambda check: check['actionable'], reverse=True),
+        "checks": [info for info, _ in outcomes],
+    })
+    response['immutable'] = all(immutable for _, immutable in outcomes)
+    return response
+
+
+def get_check_error(product, version, check_name):
+    """Return why this check can't be run, None if it can."""
+    if product not in PRODUCTS:
+        return 'Invalid product: {} not in {}'.format(product, PRODUCTS)
+    if not is_valid_version(version):
+        return 'Invalid version number: {}'.format(version)
+    if product == "devedition" and get_version_channel(product, version) is not Channel.AURORA:
+        return 'Invalid version number for devedition: {}'.format(version)
+    if check_name not in CHECKS_TASKS:
+        return 'Invalid check: {}'.format(check_name)
+
+
+def batch_error(message):
+    return json_response({
+        'status': 400,
+        'message': message
+    }, status=400)
+
+
+async def view_run_batch(request):
+    try:
+        body = codec.loads(await request.read())
+    except ValueError:
+        return batch_error('Invalid JSON body')
+
+    entries = body.get('checks') if isinstance(body, dict) else None
+    if not isinstance(entries, list):
+        return batch_error('A list of checks is expected')
+    if len(entries) > BATCH_MAX_SIZE:
+        return batch_error('Too many checks: {} > {}'.format(len(entries), BATCH_MAX_SIZE))
+
+    keys = []
+    for entry in entries:
+        key = None
+        if isinstance(entry, dict):
+            key = (entry.get('product'), entry.get('version'), entry.get('check'))
+        if key is None or not all(isinstance(value, str) for value in key):
+            return batch_error('Invalid check: {}'.format(codec.dumps(entry).decode()))
+        keys.append(key)
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(product, version, check_name):
+        error = get_check_error(product, version, check_name)
+        if error is not None:
+            return {'status': 'error', 'message': error}
+        async with semaphore:
+            result, _ = await run_check(request.app, CHECKS_TASKS[check_name], check_name,
+                                        product, version)
+        return result
+
+    # Duplicated checks only run once.
+    unique_keys = list(OrderedDict.fromkeys(keys))
+    results = dict(zip(unique_keys, await asyncio.gather(*[run(*key) for key in unique_keys])))
+    return json_response({
+        "results": [{
+            "product": product,
+            "version": version,
+            "check": check_name,
+            "result": results[(product, version, check_name)],
+        } for product, version, check_name in keys]
     })
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import suppress
+
+from pollbot import PRODUCTS
+from ..cache import FOREVER
+from ..tasks.product_details import ongoing_versions
+from ..utils import Channel, Status, get_version_channel, is_valid_version
+from .release import CHECKS_TASKS, get_check_ttl, get_version_checks, is_immutable, is_missing
+
+logger = logging.getLogger(__package__)
+
+# Seconds between two refreshes of a check until it exists (0 disables the
+# scheduler), and once it exists.
+SCHEDULER_FAST_INTERVAL = float(os.getenv("POLLBOT_SCHEDULER_FAST_INTERVAL", "60"))
+SCHEDULER_SLOW_INTERVAL = float(os.getenv("POLLBOT_SCHEDULER_SLOW_INTERVAL", "600"))
+# Versions that weren't requested for that many seconds are refreshed less often.
+SCHEDULER_IDLE_TIME = float(os.getenv("POLLBOT_SCHEDULER_IDLE_TIME", "900"))
+SCHEDULER_CONCURRENCY = int(os.getenv("POLLBOT_SCHEDULER_CONCURRENCY", "4"))
+
+IDLE_FACTOR = 4
+# Nightly and ESR versions change less often than the others.
+CHANNEL_FACTORS = {Channel.NIGHTLY: 2, Channel.ESR: 2}
+# Seconds between two updates of the ongoing versions, and between two ticks.
+VERSIONS_INTERVAL = 300
+TICK_INTERVAL = 5
+# Only the replica holding this lease in the shared cache precomputes the checks.
+LEASE_KEY = "scheduler:lease"
+LEASE_TTL = 60
+
+
+class Scheduler:
+    """Keep the checks results of the ongoing versions fresh in the results cache.
+
+    A check is refreshed often until it exists, then less often, and no
+    more once its result is immutable.
+
+    With a shared cache backend, a single replica precomputes the results and
+    the other ones load them from the backend.
+    """
+
+    def __init__(self, app, *, products=PRODUCTS, fast_interval=SCHEDULER_FAST_INTERVAL,
+                 slow_interval=SCHEDULER_SLOW_INTERVAL, idle_time=SCHEDULER_IDLE_TIME,
+                 concurrency=SCHEDULER_CONCURRENCY, clock=time.monotonic):
+        self.app = app
+        self.products = products
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.idle_time = idle_time
+        self.concurrency = concurrency
+        self.clock = clock
+        self.owner = uuid.uuid4().hex
+        self.jobs = {}
+        self.statuses = {}
+        self.requested = {}
+        self.versions_updated_at = None
+        self.runs = 0
+        self._task = None
+
+    def touch(self, product, version):
+        """Remember that a version was requested, and refresh it sooner if it was idle."""
+        if self.fast_interval <= 0:
+            return
+        now = self.clock()
+        requested_at = self.requested.get((product, version))
+        self.requested[(product, version)] = now
+        if requested_at is None or requested_at + self.idle_time < now:
+            due_at = now + self.fast_interval
+            for key, job_due_at in self.jobs.items():
+                if key[1:] == (product, version) and due_at < job_due_at < FOREVER:
+                    self.jobs[key] = due_at
+
+    async def get_ongoing_versions(self, product):
+        versions = await ongoing_versions(product)
+        return {version for channel, version in versions.items()
+                if (product == "devedition") == (channel == "devedition") and
+                isinstance(version, str) and is_valid_version(version)}
+
+    async def update_versions(self):
+        keys = set()
+        for product in self.products:
+            try:
+                versions = await self.get_ongoing_versions(product)
+            except Exception as e:
+                logger.warning("Failed to get the %s ongoing versions: %r", product, e)
+                keys.update(key for key in self.jobs if key[1] == product)
+                continue
+            for version in versions:
+                keys.update((check_name, product, version)
+                            for check_name in get_version_checks(product, version))
+
+        now = self.clock()
+        self.jobs = {key: self.jobs.get(key, now) for key in keys}
+        # Versions idle for that long are as good as never requested.
+        self.requested = {version: requested_at
+                          for version, requested_at in self.requested.items()
+                          if requested_at + self.idle_time >= now}
+        self.statuses = {key: self.statuses[key] for key in keys if key in self.statuses}
+        self.versions_updated_at = now
+
+    def interval(self, key, status=None):
+        _, product, version = key
+        interval = self.fast_interval
+        if status == Status.EXISTS.value:
+            interval = self.slow_interval
+        interval *= CHANNEL_FACTORS.get(get_version_channel(product, version), 1)
+        requested_at = self.requested.get((product, version))
+        if requested_at is None or requested_at + self.idle_time < self.clock():
+            interval *= IDLE_FACTOR
+        return interval
+
+    async def run(self, key, semaphore):
+        check_name, product, version = key
+        cache = self.app['results_cache']
+        # Past their TTL, results are served stale until the next refresh or their hard expiry.
+        ttl = get_check_ttl(check_name)
+
+        async def compute():
+            return await CHECKS_TASKS[check_name](product, version)
+
+        async with semaphore:
+            try:
+                result = await cache.refresh(key, compute, ttl=ttl, is_negative=is_missing,
+                                             is_immutable=is_immutable)
+                status = result["status"]
+            except Exception as e:
+                logger.warning("Failed to refresh the %s check of %s %s: %r",
+                               check_name, product, version, e)
+                status = Status.ERROR.value
+
+        self.runs += 1
+        self.statuses[key] = status
+        if cache.is_immutable(key):
+            self.jobs[key] = FOREVER
+        else:
+            self.jobs[key] = self.clock() + self.interval(key, status)
+
+    async def acquire_lease(self):
+        backend = self.app.get('cache_backend')
+        return backend is None or await backend.acquire(LEASE_KEY, self.owner, LEASE_TTL)
+
+    async def tick(self):
+        if not await self.acquire_lease():
+            return
+        if (self.versions_updated_at is None or
+                self.versions_updated_at + VERSIONS_INTERVAL <= self.clock()):
+            await self.update_versions()
+
+        now = self.clock()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self.run(key, semaphore)
+                               for key, due_at in self.jobs.items() if due_at <= now])
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(TICK_INTERVAL)
+
+    def start(self):
+        if self._task is None and self.fast_interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def stats(self):
+        return {
+            "versions": len({key[1:] for key in self.jobs}),
+            "jobs": len(self.jobs),
+            "done": sum(1 for due_at in self.jobs.values() if due_at == FOREVER),
+            "runs": self.runs,
+        }
+
+
+def setup_scheduler(app):
+    app['scheduler'] = Scheduler(app)
+
+    async def start_scheduler(app):
+        app['scheduler'].start()
+
+    async def stop_scheduler(app):
+        await app['scheduler'].stop()
+
+    app.on_startup.append(start_scheduler)
+    app.on_cleanup.append(stop_scheduler)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+from contextlib import suppress
+
+from aiohttp import web
+
+from .. import codec
+from ..codec import json_response
+from .decorators import validate_product_version
+from .release import CHECKS_TASKS, get_version_checks, run_check
+
+logger = logging.getLogger(__package__)
+
+# Seconds between two polls of the checks of a watched version.
+WATCH_INTERVAL = float(os.getenv("POLLBOT_WATCH_INTERVAL", "30"))
+# Seconds between two keep-alive comments on idle event streams.
+SSE_KEEPALIVE = 15
+
+
+class EventsQueue(asyncio.Queue):
+    """The pending events of a subscriber, at most one per check.
+
+    A slow subscriber gets the latest status of its checks instead of the whole
+    history of their transitions, so its queue never grows beyond its checks.
+    """
+
+    def push(self, event):
+        for i, pending in enumerate(self._queue):
+            if pending["check"] == event["check"]:
+                self._queue[i] = event
+                return
+        self.put_nowait(event)
+
+
+class VersionWatcher:
+    """Poll the checks of a product version and push their status transitions.
+
+    Subscribers receive the latest known result of their checks, then a new
+    event each time a check status changes. Only the latest one of each check
+    is kept for the subscribers that fall behind.
+    """
+
+    def __init__(self, app, product, version, *, interval=WATCH_INTERVAL):
+        self.app = app
+        self.product = product
+        self.version = version
+        self.interval = interval
+        self.check_names = get_version_checks(product, version)
+        self.results = {}
+        self.subscribers = {}
+        self._task = None
+
+    def subscribe(self, checks=None):
+        checks = set(checks or self.check_names)
+        queue = EventsQueue(maxsize=len(checks))
+        self.subscribers[queue] = checks
+        for check_name, result in self.results.items():
+            if check_name in checks:
+                queue.push(self.event(check_name, result))
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    def event(self, check_name, result):
+        return dict(result, check=check_name, product=self.product, version=self.version)
+
+    def publish(self, check_name, result):
+        event = self.event(check_name, result)
+        for queue, checks in self.subscribers.items():
+            if check_name in checks:
+                queue.push(event)
+
+    async def poll(self, check_name):
+        result, _ = await run_check(self.app, CHECKS_TASKS[check_name], check_name,
+                                    self.product, self.version)
+        previous = self.results.get(check_name)
+        self.results[check_name] = result
+        if previous is None or previous['status'] != result['status']:
+            self.publish(check_name, result)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.gather(*[self.poll(check_name) for check_name in self.check_names])
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+class Watchers:
+    """Share a single watcher between all the subscribers of a product version."""
+
+    def __init__(self, app, *, interval=WATCH_INTERVAL):
+        self.app = app
+        self.interval = interval
+        self.watchers = {}
+
+    def subscribe(self, product, version, checks=None):
+        watcher = self.watchers.get((product, version))
+        if watcher is None:
+            watcher = VersionWatcher(self.app, product, version, interval=self.interval)
+            self.watchers[(product, version)] = watcher
+            watcher.start()
+        return watcher, watcher.subscribe(checks)
+
+    async def unsubscribe(self, watcher, queue):
+        watcher.unsubscribe(queue)
+        if not watcher.subscribers:
+            # The last subscriber is gone, stop polling.
+            self.watchers.pop((watcher.product, watcher.version), None)
+            await watcher.stop()
+
+    async def close(self):
+        watchers, self.watchers = self.watchers, {}
+        await asyncio.gather(*[watcher.stop() for watcher in watchers.values()])
+
+    def stats(self):
+        return {
+            "watchers": len(self.watchers),
+            "subscribers": sum(len(watcher.subscribers) for watcher in self.watchers.values()),
+        }
+
+
+def setup_watchers(app):
+    app['watchers'] = Watchers(app)
+
+    async def close_watchers(app):
+        await app['watchers'].close()
+
+    app.on_cleanup.append(close_watchers)
+
+
+async def send_websocket_events(request, queue):
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    async def forward():
+        while True:
+            await ws.send_str(codec.dumps(await queue.get()).decode('utf-8'))
+
+    sender = asyncio.ensure_future(forward())
+    try:
+        async for message in ws:  # Messages from the client are ignored.
+            pass
+    finally:
+        sender.cancel()
+        with suppress(asyncio.CancelledError, ConnectionResetError):
+            await sender
+    return ws
+
+
+async def send_server_sent_events(request, queue):
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                           'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    with suppress(ConnectionResetError):
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Notice disconnected clients even without any transition.
+                await response.write(b':\n\n')
+                continue
+            await response.write(b'event: check\ndata: ' + codec.dumps(event) + b'\n\n')
+    return response
+
+
+@validate_product_version
+async def subscribe(request, product, version):
+    checks = None
+    if request.query.get('checks'):
+        checks = request.query['checks'].split(',')
+        unknown = sorted(set(checks) - set(get_version_checks(product, version)))
+        if unknown:
+            return json_response({
+                'status': 400,
+                'message': 'Invalid checks for {} {}: {}'.format(product, version,
+                                                                 ', '.join(unknown))
+            }, status=400)
+
+    watchers = request.app['watchers']
+    watcher, queue = watchers.subscribe(product, version, checks)
+    try:
+        if web.WebSocketResponse().can_prepare(request).ok:
+            return await send_websocket_events(request, queue)
+        return await send_server_sent_events(request, queue)
+    finally:
+        await watchers.unsubscribe(watcher, queue)
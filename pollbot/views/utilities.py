@@ -1,13 +1,17 @@
-import asyncio
+import hashlib
 import json
 import os.path
+from collections import OrderedDict
 from contextlib import suppress
 
 import ruamel.yaml as yaml
 from aiohttp import web
 
+from pollbot import codec
+from pollbot.codec import json_response
 from pollbot.tasks import (
-    archives, balrog, bedrock, buildhub, product_details, telemetry, bouncer
+    archives, balrog, bedrock, buildhub, product_details, telemetry, bouncer,
+    upstream_flights, upstream_validators, HeartbeatProber
 )
 
 
@@ -15,55 +19,144 @@ HERE = os.path.dirname(__file__)
 VERSION_FILE = os.getenv("VERSION_FILE", "version.json")
 
 
-async def version(request):
+class StaticDocument:
+    """A JSON document loaded once, kept serialized along with its ETag."""
+
+    def __init__(self, content):
+        self.content = content
+        self.body = codec.dumps(content)
+        self.etag = make_etag(self.body)
+
+    def response(self, request, *, host=None):
+        body, etag = self.body, self.etag
+        if host is not None:
+            # Splice the host in rather than serializing the whole document again.
+            separator = b',' if self.content else b''
+            body = b'{"host":' + codec.dumps(host) + separator + self.body[1:]
+            etag = make_etag(body)
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [value.strip() for value in if_none_match.split(',')]:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json',
+                            headers={'ETag': etag})
+
+
+def make_etag(body):
+    return '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+
+def load_yaml_file(filename):
+    with open(os.path.join(HERE, "..", filename)) as stream:
+        # The C based loader is used when available, this only runs on startup anyway.
+        content = yaml.YAML(typ='safe').load(stream)
+    if not isinstance(content, dict):
+        raise ValueError("{} should contain a YAML mapping".format(filename))
+    return StaticDocument(content)
+
+
+def load_version_file():
     # Use the version.json file in the current dir.
     with suppress(IOError):
         with open(VERSION_FILE) as fd:
-            return web.json_response(json.load(fd))
-    return web.HTTPNotFound()
+            content = json.load(fd)
+        if not isinstance(content, dict):
+            raise ValueError("{} should contain a JSON object".format(VERSION_FILE))
+        return StaticDocument(content)
 
 
-def render_yaml_file(filename):
-    with open(os.path.join(HERE, "..", filename)) as stream:
-        content = yaml.YAML(typ='safe', pure=True).load(stream)
-    return web.json_response(content)
+def setup_static_documents(app):
+    app['static_documents'] = {
+        "api": load_yaml_file("api.yaml"),
+        "contribute": load_yaml_file("contribute.yaml"),
+        "version": load_version_file(),
+    }
+
+
+async def version(request):
+    document = request.app['static_documents']["version"]
+    if document is None:
+        return web.HTTPNotFound()
+    return document.response(request)
 
 
 async def oas_spec(request):
-    with open(os.path.join(HERE, "..", 'api.yaml')) as stream:
-        content = yaml.YAML(typ='safe', pure=True).load(stream)
-    content['host'] = request.headers['Host']
-    return web.json_response(content)
+    document = request.app['static_documents']["api"]
+    return document.response(request, host=request.headers['Host'])
 
 
 async def contribute_json(request):
-    return render_yaml_file("contribute.yaml")
+    return request.app['static_documents']["contribute"].response(request)
 
 
 async def contribute_redirect(request):
     return web.HTTPFound('/v1/contribute.json')
 
 
+async def stats(request):
+    info = {}
+    results_cache = request.app.get('results_cache')
+    if results_cache is not None:
+        info["results_cache"] = results_cache.stats()
+    info["upstream_requests"] = upstream_flights.stats()
+    info["upstream_validators"] = upstream_validators.stats()
+    info["locales"] = archives.locales_cache.stats()
+    heartbeat_prober = request.app.get('heartbeat_prober')
+    if heartbeat_prober is not None:
+        info["heartbeats"] = heartbeat_prober.stats()
+    watchers = request.app.get('watchers')
+    if watchers is not None:
+        info["subscriptions"] = watchers.stats()
+    webhooks = request.app.get('webhooks')
+    if webhooks is not None:
+        info["webhooks"] = webhooks.stats()
+    scheduler = request.app.get('scheduler')
+    if scheduler is not None:
+        info["scheduler"] = scheduler.stats()
+    return json_response(info)
+
+
 async def lbheartbeat(request):
-    return web.json_response({"status": "running"})
+    return json_response({"status": "running"})
+
+
+HEARTBEATS = OrderedDict([
+    ("archive", archives.heartbeat),
+    ("balrog", balrog.heartbeat),
+    ("bedrock", bedrock.heartbeat),
+    ("bouncer", bouncer.heartbeat),
+    ("buildhub", buildhub.heartbeat),
+    ("product-details", product_details.heartbeat),
+    ("telemetry", telemetry.heartbeat),
+    ("thunderbird_net", bedrock.heartbeat_tbnet),
+])
+
+
+def setup_heartbeat_prober(app):
+    app['heartbeat_prober'] = HeartbeatProber(HEARTBEATS)
+
+    async def start_heartbeat_prober(app):
+        app['heartbeat_prober'].start()
+
+    async def stop_heartbeat_prober(app):
+        await app['heartbeat_prober'].stop()
+
+    app.on_startup.append(start_heartbeat_prober)
+    app.on_cleanup.append(stop_heartbeat_prober)
 
 
 async def heartbeat(request):
-    info = await asyncio.gather(archives.heartbeat(),
-                                balrog.heartbeat(),
-                                bedrock.heartbeat(),
-                                bouncer.heartbeat(),
-                                buildhub.heartbeat(),
-                                product_details.heartbeat(),
-                                telemetry.heartbeat(),
-                                bedrock.heartbeat_tbnet())
-    status = all(info) and 200 or 503
-    return web.json_response({"archive": info[0],
-                              "balrog": info[1],
-                              "bedrock": info[2],
-                              "bouncer": info[3],
-                              "buildhub": info[4],
-                              "product-details": info[5],
-                              "telemetry": info[6],
-                              "thunderbird_net": info[7]},
-                             status=status)
+    prober = request.app.get('heartbeat_prober')
+    if prober is None:
+        # Outside of the app, probe the upstreams right away.
+        info = await HeartbeatProber(HEARTBEATS).refresh()
+    else:
+        # Upstreams are probed in the background from the startup on,
+        # or on demand if the background probes are disabled.
+        info = prober.snapshot()
+        if (info is None or prober.interval <= 0 or
+                request.query.get('fresh') in ('1', 'true')):
+            info = await prober.refresh()
+
+    status = all(info.values()) and 200 or 503
+    return json_response(info, status=status)
@@ -0,0 +1,370 @@
+import asyncio
+import hmac
+import logging
+import os
+import uuid
+from contextlib import suppress
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+from pollbot import PRODUCTS
+from .. import codec
+from ..cache import FOREVER
+from ..codec import json_response
+from ..tasks import get_session
+from ..utils import Status, is_valid_version
+from .release import get_version_checks
+
+logger = logging.getLogger(__package__)
+
+# Token to send as ``Authorization: Bearer <token>`` to manage the webhooks.
+# Webhooks are disabled unless it is set.
+WEBHOOKS_TOKEN = os.getenv("POLLBOT_WEBHOOKS_TOKEN", "")
+# Seconds to wait for other transitions to send along with the first one.
+WEBHOOKS_BATCH_DELAY = float(os.getenv("POLLBOT_WEBHOOKS_BATCH_DELAY", "1"))
+# Number of retries of a failed delivery, the delay doubling each time.
+WEBHOOKS_RETRIES = int(os.getenv("POLLBOT_WEBHOOKS_RETRIES", "5"))
+WEBHOOKS_RETRY_DELAY = float(os.getenv("POLLBOT_WEBHOOKS_RETRY_DELAY", "2"))
+# Seconds to wait for a webhook to answer.
+WEBHOOKS_TIMEOUT = float(os.getenv("POLLBOT_WEBHOOKS_TIMEOUT", "10"))
+
+# Seconds the replica calling the webhooks holds its lease, renewed every third of it.
+WEBHOOKS_LEASE_TTL = float(os.getenv("POLLBOT_WEBHOOKS_LEASE_TTL", "30"))
+
+REGISTRATION_PREFIX = "webhooks:registration:"
+PENDING_PREFIX = "webhooks:pending:"
+LEASE_KEY = "webhooks:lease"
+
+
+class Webhooks:
+    """Call the registered URLs when checks of a version reach the EXISTS status.
+
+    Transitions are detected by the shared version watchers. The events of
+    a URL are delivered in batches and retried on failure.
+
+    With a cache backend, each registration and the pending events of each
+    URL are stored under their own key to survive restarts, and only the
+    replica holding the delivery lease watches the registrations and calls
+    the webhooks. The other replicas only store the registrations they get.
+    """
+
+    def __init__(self, app, *, batch_delay=WEBHOOKS_BATCH_DELAY, retries=WEBHOOKS_RETRIES,
+                 retry_delay=WEBHOOKS_RETRY_DELAY, timeout=WEBHOOKS_TIMEOUT,
+                 lease_ttl=WEBHOOKS_LEASE_TTL):
+        self.app = app
+        self.batch_delay = batch_delay
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.lease_ttl = lease_ttl
+        self.owner = uuid.uuid4().hex
+        self.registrations = {}
+        self.pending = {}
+        self.delivered = 0
+        self.dropped = 0
+        self._lease_held = False
+        self._consumers = {}
+        self._deliveries = {}
+        self._task = None
+
+    @property
+    def backend(self):
+        return self.app.get('cache_backend')
+
+    @property
+    def leader(self):
+        return self.backend is None or self._lease_held
+
+    async def load(self):
+        if self.backend is not None:
+            await self.sync()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def sync(self):
+        """Take or renew the delivery lease, and follow the stored registrations if held."""
+        if not await self.backend.acquire(LEASE_KEY, self.owner, self.lease_ttl):
+            if self._lease_held:
+                logger.warning("Another replica now calls the webhooks")
+                self._lease_held = False
+                await self._stop()
+            return
+        self._lease_held = True
+
+        errors = self.backend.errors
+        records = await self.backend.load_all(REGISTRATION_PREFIX)
+        pending = await self.backend.load_all(PENDING_PREFIX)
+        if self.backend.errors > errors:
+            # Keep watching the known registrations until the backend answers.
+            return
+
+        registrations = {registration["id"]: registration for _, registration in records}
+        for registration_id in list(self.registrations):
+            if registration_id not in registrations:
+                # Unregistered on another replica.
+                del self.registrations[registration_id]
+                await self._cancel(self._consumers.pop(registration_id, None))
+        for registration_id, registration in registrations.items():
+            if registration_id not in self.registrations:
+                self.registrations[registration_id] = registration
+                self._consume(registration)
+        for key, events in pending:
+            url = key[len(PENDING_PREFIX):]
+            if url not in self.pending:
+                self.pending[url] = events
+                self._schedule(url)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.exception(e)
+
+    async def save_registration(self, registration):
+        if self.backend is not None:
+            await self.backend.store(REGISTRATION_PREFIX + registration["id"], registration,
+                                     FOREVER)
+
+    async def save_pending(self, url):
+        if self.backend is None:
+            return
+        if self.pending.get(url):
+            await self.backend.store(PENDING_PREFIX + url, self.pending[url], FOREVER)
+        else:
+            await self.backend.remove(PENDING_PREFIX + url)
+
+    async def get_registrations(self):
+        if self.backend is None:
+            return list(self.registrations.values())
+        return [registration for _, registration
+                in await self.backend.load_all(REGISTRATION_PREFIX)]
+
+    async def register(self, url, product, version, checks):
+        registration = {
+            "id": uuid.uuid4().hex,
+            "url": url,
+            "product": product,
+            "version": version,
+            "checks": checks,
+            "statuses": {},
+        }
+        await self.save_registration(registration)
+        if self.leader:
+            # Otherwise, the leader picks it up on its next sync.
+            self.registrations[registration["id"]] = registration
+            self._consume(registration)
+        return registration
+
+    async def unregister(self, registration_id):
+        key = REGISTRATION_PREFIX + registration_id
+        known = registration_id in self.registrations
+        if not known and self.backend is not None:
+            known = await self.backend.load(key) is not None
+        if not known:
+            return False
+        self.registrations.pop(registration_id, None)
+        await self._cancel(self._consumers.pop(registration_id, None))
+        if self.backend is not None:
+            await self.backend.remove(key)
+        return True
+
+    def _consume(self, registration):
+        self._consumers[registration["id"]] = asyncio.ensure_future(
+            self._watch(registration))
+
+    async def _watch(self, registration):
+        watchers = self.app['watchers']
+        watcher, queue = watchers.subscribe(registration["product"], registration["version"],
+                                            registration["checks"])
+        try:
+            while True:
+                await self.notify(registration, await queue.get())
+        finally:
+            await watchers.unsubscribe(watcher, queue)
+
+    async def notify(self, registration, event):
+        status = event["status"]
+        if status == Status.ERROR.value:
+            # A failing check doesn't tell anything about the resource.
+            return
+        previous = registration["statuses"].get(event["check"])
+        if previous == status:
+            return
+        registration["statuses"][event["check"]] = status
+        # The first status is only recorded, webhooks are called on transitions.
+        if previous is not None and status == Status.EXISTS.value:
+            event = dict(event, webhook=registration["id"])
+            self.pending.setdefault(registration["url"], []).append(event)
+            self._schedule(registration["url"])
+            await self.save_pending(registration["url"])
+        await self.save_registration(registration)
+
+    def _schedule(self, url):
+        if url not in self._deliveries:
+            self._deliveries[url] = asyncio.ensure_future(self._deliver(url))
+
+    async def _post(self, url, events):
+        # Calls are not shared like the upstream ones, and can't hold the events for long.
+        try:
+            async with get_session() as session:
+                async with session.post(url, headers={'Content-Type': 'application/json'},
+                                        data=codec.dumps({"events": events}),
+                                        timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                    status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Failed to call the %s webhook: %r", url, e)
+            return False
+        if status >= 300:
+            logger.warning("The %s webhook answered %s", url, status)
+            return False
+        return True
+
+    async def _deliver(self, url):
+        attempt = 0
+        try:
+            await asyncio.sleep(self.batch_delay)
+            while self.pending.get(url):
+                events = list(self.pending[url])
+                if await self._post(url, events):
+                    self.delivered += len(events)
+                elif attempt < self.retries:
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                    attempt += 1
+                    continue
+                else:
+                    logger.error("Dropping %s events of the %s webhook", len(events), url)
+                    self.dropped += len(events)
+                attempt = 0
+                # Events may have been added during the delivery.
+                del self.pending[url][:len(events)]
+                if not self.pending[url]:
+                    del self.pending[url]
+                await self.save_pending(url)
+        finally:
+            self._deliveries.pop(url, None)
+
+    async def _cancel(self, task):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    async def _stop(self):
+        tasks = list(self._consumers.values()) + list(self._deliveries.values())
+        self._consumers = {}
+        await asyncio.gather(*[self._cancel(task) for task in tasks])
+        # They are still stored for the next leader.
+        self.registrations = {}
+        self.pending = {}
+
+    async def close(self):
+        task, self._task = self._task, None
+        await self._cancel(task)
+        await self._stop()
+
+    def stats(self):
+        return {
+            "leader": self.leader,
+            "registrations": len(self.registrations),
+            "pending": sum(len(events) for events in self.pending.values()),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+def setup_webhooks(app):
+    app['webhooks'] = Webhooks(app)
+
+    async def load_webhooks(app):
+        await app['webhooks'].load()
+
+    async def close_webhooks(app):
+        await app['webhooks'].close()
+
+    app.on_startup.append(load_webhooks)
+    app.on_cleanup.append(close_webhooks)
+
+
+def require_token(func):
+    async def decorate(request):
+        if not WEBHOOKS_TOKEN:
+            return json_response({
+                'status': 403,
+                'message': 'Webhooks are disabled'
+            }, status=403)
+
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization, 'Bearer {}'.format(WEBHOOKS_TOKEN)):
+            return json_response({
+                'status': 401,
+                'message': 'Invalid webhooks token'
+            }, status=401)
+
+        return await func(request)
+
+    return decorate
+
+
+def bad_request(message):
+    return json_response({
+        'status': 400,
+        'message': message
+    }, status=400)
+
+
+def public(registration):
+    return {key: value for key, value in registration.items() if key != "statuses"}
+
+
+@require_token
+async def create_webhook(request):
+    try:
+        body = codec.loads(await request.read())
+    except ValueError:
+        return bad_request('Invalid JSON body')
+
+    url = body.get('url') if isinstance(body, dict) else None
+    if not isinstance(url, str) or urlsplit(url).scheme not in ('http', 'https'):
+        return bad_request('Invalid webhook URL: {}'.format(url))
+
+    product = body.get('product')
+    if product not in PRODUCTS:
+        return bad_request('Invalid product: {} not in {}'.format(product, PRODUCTS))
+
+    version = body.get('version')
+    if not isinstance(version, str) or not is_valid_version(version):
+        return bad_request('Invalid version number: {}'.format(version))
+
+    version_checks = get_version_checks(product, version)
+    checks = body.get('checks') or version_checks
+    if not isinstance(checks, list) or not all(isinstance(check, str) for check in checks):
+        return bad_request('Invalid checks: {}'.format(checks))
+    unknown = sorted(set(checks) - set(version_checks))
+    if unknown:
+        return bad_request('Invalid checks for {} {}: {}'.format(product, version,
+                                                                 ', '.join(unknown)))
+
+    registration = await request.app['webhooks'].register(url, product, version, checks)
+    return json_response(public(registration), status=201)
+
+
+@require_token
+async def list_webhooks(request):
+    registrations = await request.app['webhooks'].get_registrations()
+    return json_response({
+        "webhooks": [public(registration) for registration in registrations]
+    })
+
+
+@require_token
+async def delete_webhook(request):
+    registration_id = request.match_info['id']
+    if not await request.app['webhooks'].unregister(registration_id):
+        return json_response({
+            'status': 404,
+            'message': 'Unknown webhook: {}'.format(registration_id)
+        }, status=404)
+    return web.Response(status=204)
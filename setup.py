@@ -40,6 +40,9 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
+    extras_require={
+        'fast-json': ['orjson'],
+    },
     entry_points={
         'console_scripts': ['pollbot=pollbot.__main__:main']
     },
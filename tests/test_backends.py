@@ -0,0 +1,382 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+from multidict import CIMultiDict
+
+from pollbot.__main__ import main
+from pollbot.cache import ResultsCache
+from pollbot.cache.backends import (CacheBackendError, MemoryBackend, RedisBackend,
+                                    SQLiteBackend, dumps, get_backend, loads, read_reply)
+from pollbot.exceptions import NotFoundError
+from pollbot.tasks import UpstreamResponse, ValidatorsCache
+
+
+class RedisStandIn:
+    """A local server speaking enough of the Redis protocol for the tests."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.stalled = False
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                command = await read_reply(reader)
+                self.commands.append(command)
+                if self.stalled:
+                    continue
+                writer.write(self.execute(command[0].upper(), *command[1:]))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, name, *args):
+        if name in (b'PING', b'AUTH', b'SELECT'):
+            return b'+OK\r\n'
+        elif name == b'SET':
+            key, value, *options = args
+            expires_at = float('inf')
+            if options:
+                expires_at = time.monotonic() + int(options[1]) / 1000
+            self.data[key] = (value, expires_at)
+            return b'+OK\r\n'
+        elif name == b'GET':
+            value, expires_at = self.data.get(args[0], (None, 0))
+            if value is None or expires_at <= time.monotonic():
+                return b'$-1\r\n'
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        elif name == b'DEL':
+            return b':%d\r\n' % (self.data.pop(args[0], None) is not None)
+        elif name == b'SCAN':
+            prefix = args[2].rstrip(b'*').replace(b'\\', b'')
+            keys = [key for key, (_, expires_at) in self.data.items()
+                    if key.startswith(prefix) and expires_at > time.monotonic()]
+            return b'*2\r\n$1\r\n0\r\n' + self.array(keys)
+        elif name == b'MGET':
+            return self.array([self.data.get(key, (None, 0))[0] for key in args])
+        elif name == b'EVAL':
+            # Only the lease script is used.
+            key, owner, ttl = args[2:]
+            value, expires_at = self.data.get(key, (None, 0))
+            if value is not None and expires_at > time.monotonic() and value != owner:
+                return b':0\r\n'
+            self.data[key] = (owner, time.monotonic() + int(ttl) / 1000)
+            return b':1\r\n'
+        return b'-ERR unknown command\r\n'
+
+    @staticmethod
+    def array(values):
+        items = [b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+                 for value in values]
+        return b'*%d\r\n' % len(values) + b''.join(items)
+
+
+@pytest.fixture
+async def redis_server():
+    server = RedisStandIn()
+    await server.start()
+    yield server
+    await server.stop()
+
+
+def test_records_are_serialized_compactly():
+    record = {"value": {"status": "exists"}, "fresh_until": 12.5}
+    assert dumps(record) == b'j{"value":{"status":"exists"},"fresh_until":12.5}'
+    assert loads(dumps(record)) == record
+
+
+def test_big_records_are_compressed():
+    record = {"body": "x" * 10000}
+    data = dumps(record)
+    assert data.startswith(b'z')
+    assert len(data) < 1000
+    assert loads(data) == record
+
+
+def test_unknown_records_are_rejected():
+    with pytest.raises(ValueError):
+        loads(b'?{}')
+
+
+def test_get_backend_from_url():
+    assert get_backend("") is None
+    assert isinstance(get_backend("memory://"), MemoryBackend)
+    backend = get_backend("redis://:s3cr3t@cache.example.com:6380/2")
+    assert isinstance(backend, RedisBackend)
+    assert (backend.host, backend.port, backend.db, backend.password) == (
+        "cache.example.com", 6380, 2, "s3cr3t")
+    backend = get_backend("sqlite:///var/cache/pollbot.db")
+    assert isinstance(backend, SQLiteBackend)
+    assert backend.path == "/var/cache/pollbot.db"
+    with pytest.raises(ValueError):
+        get_backend("memcached://localhost")
+
+
+async def test_memory_backend_stores_records():
+    backend = MemoryBackend()
+    await backend.store("key", {"a": 1}, ttl=10)
+    assert await backend.load("key") == {"a": 1}
+    await backend.delete("pollbot:key")
+    assert await backend.load("key") is None
+
+    await backend.store("a:1", {"a": 1}, ttl=10)
+    await backend.store("b:1", {"b": 1}, ttl=10)
+    assert await backend.load_all("a:") == [("a:1", {"a": 1})]
+
+
+async def test_redis_backend_stores_records_with_a_ttl(redis_server):
+    backend = RedisBackend(port=redis_server.port)
+    await backend.store("key", {"a": 1}, ttl=10)
+    assert await backend.load("key") == {"a": 1}
+    assert redis_server.commands[0] == [b'SET', b'pollbot:key', b'j{"a":1}', b'PX', b'10000']
+
+    await backend.delete("pollbot:key")
+    assert await backend.load("key") is None
+    await backend.close()
+
+
+async def test_redis_backend_lists_records_by_prefix(redis_server):
+    backend = RedisBackend(port=redis_server.port)
+    await backend.store("webhooks:registration:a", {"a": 1}, ttl=10)
+    await backend.store("webhooks:pending:b", {"b": 2}, ttl=10)
+    assert await backend.load_all("webhooks:registration:") == [
+        ("webhooks:registration:a", {"a": 1})]
+    await backend.close()
+
+
+async def test_leases_have_a_single_owner(redis_server, tmp_path):
+    backends = [MemoryBackend(), RedisBackend(port=redis_server.port),
+                SQLiteBackend(str(tmp_path / "cache.db"))]
+    for backend in backends:
+        assert await backend.acquire("lease", "a", ttl=10)
+        assert await backend.acquire("lease", "a", ttl=10)
+        assert not await backend.acquire("lease", "b", ttl=10)
+        await backend.remove("lease")
+        assert await backend.acquire("lease", "b", ttl=10)
+        await backend.close()
+
+
+async def test_redis_backend_authenticates_and_selects_the_database(redis_server):
+    backend = RedisBackend.from_url("redis://:s3cr3t@127.0.0.1:{}/3".format(redis_server.port))
+    await backend.load("key")
+    assert redis_server.commands[:2] == [[b'AUTH', b's3cr3t'], [b'SELECT', b'3']]
+    await backend.close()
+
+
+async def test_redis_backend_raises_server_errors(redis_server):
+    backend = RedisBackend(port=redis_server.port)
+    with pytest.raises(CacheBackendError):
+        await backend.execute('FLUSHALL')
+    await backend.close()
+
+
+async def test_unavailable_backends_are_ignored(redis_server):
+    backend = RedisBackend(port=redis_server.port)
+    await redis_server.stop()
+    await backend.store("key", {"a": 1}, ttl=10)
+    assert await backend.load("key") is None
+    assert not await backend.acquire("lease", "a", ttl=10)
+    assert backend.errors == 3
+
+
+async def test_stalled_backends_are_waited_for_a_bounded_time(redis_server):
+    backend = RedisBackend(port=redis_server.port, timeout=0.05, retry_delay=0.2)
+    redis_server.stalled = True
+    started = time.monotonic()
+    assert await asyncio.gather(*[backend.load("key") for _ in range(10)]) == [None] * 10
+    assert time.monotonic() - started < 0.2
+    assert backend.errors == 10
+
+    # The backend is left alone for a while, then used again.
+    redis_server.stalled = False
+    await backend.store("key", {"a": 1}, ttl=10)
+    assert await backend.load("key") is None
+    await asyncio.sleep(0.2)
+    await backend.store("key", {"a": 1}, ttl=10)
+    assert await backend.load("key") == {"a": 1}
+    await backend.close()
+
+
+async def test_results_are_shared_between_replicas(redis_server):
+    replicas = [ResultsCache(ttl=10, backend=RedisBackend(port=redis_server.port))
+                for _ in range(2)]
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"status": "exists"}
+
+    for replica in replicas:
+        assert await replica.get_or_compute(("archive", "firefox", "57.0"), compute) == {
+            "status": "exists"}
+    assert len(calls) == 1
+    assert replicas[1].backend_hits == 1
+    for replica in replicas:
+        await replica.backend.close()
+
+
+async def test_immutable_results_are_shared_without_expiration(redis_server):
+    replicas = [ResultsCache(ttl=10, backend=RedisBackend(port=redis_server.port))
+                for _ in range(2)]
+
+    async def compute():
+        return {"status": "exists"}
+
+    await replicas[0].get_or_compute("key", compute, is_immutable=lambda value: True)
+    assert redis_server.commands[-1] == [
+        b'SET', b'pollbot:result:key', b'j{"value":{"status":"exists"},"fresh_until":null}']
+
+    await replicas[1].get_or_compute("key", compute)
+    assert replicas[1].is_immutable("key")
+    for replica in replicas:
+        await replica.backend.close()
+
+
+async def test_not_found_errors_are_shared_between_replicas():
+    backend = MemoryBackend()
+    replicas = [ResultsCache(ttl=10, backend=backend) for _ in range(2)]
+
+    async def compute():
+        raise NotFoundError("Not found", url="https://example.com")
+
+    with pytest.raises(NotFoundError):
+        await replicas[0].get_or_compute("key", compute)
+
+    async def never_called():
+        raise AssertionError("Should have been shared")
+
+    with pytest.raises(NotFoundError) as excinfo:
+        await replicas[1].get_or_compute("key", never_called)
+    assert excinfo.value.url == "https://example.com"
+    assert "key" in replicas[1].negatives
+
+
+async def test_stale_shared_results_are_served_while_refreshing():
+    backend = MemoryBackend()
+    await backend.store("result:key", {"value": "a", "fresh_until": time.time() - 1}, ttl=60)
+    cache = ResultsCache(ttl=10, stale_ttl=60, backend=backend)
+
+    async def compute():
+        return "b"
+
+    assert await cache.get_or_compute("key", compute) == "a"
+    assert cache.stale_hits == 1
+    await asyncio.gather(*cache._background)
+    assert await cache.get_or_compute("key", compute) == "b"
+    assert (await backend.load("result:key"))["value"] == "b"
+
+
+@pytest.fixture
+async def sqlite_backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.db"))
+    yield backend
+    await backend.close()
+
+
+async def test_sqlite_backend_stores_records_in_wal_mode(sqlite_backend):
+    await sqlite_backend.store("key", {"a": 1}, ttl=10)
+    assert await sqlite_backend.load("key") == {"a": 1}
+    assert sqlite_backend._db.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+
+    await sqlite_backend.delete("pollbot:key")
+    assert await sqlite_backend.load("key") is None
+
+
+async def test_sqlite_backend_outlives_restarts(sqlite_backend):
+    await sqlite_backend.store("key", {"a": 1}, ttl=10)
+    await sqlite_backend.close()
+
+    restarted = SQLiteBackend(sqlite_backend.path)
+    assert await restarted.load("key") == {"a": 1}
+    await restarted.close()
+
+
+async def test_sqlite_backend_purges_expired_records(sqlite_backend):
+    await sqlite_backend.store("old", {"a": 1}, ttl=10)
+    await sqlite_backend.store("new", {"a": 2}, ttl=10)
+    with mock.patch("time.time", return_value=time.time() + 5):
+        await sqlite_backend.store("new", {"a": 2}, ttl=10)
+    with mock.patch("time.time", return_value=time.time() + 11):
+        assert await sqlite_backend.load("old") is None
+        assert await sqlite_backend.purge() == 1
+    assert await sqlite_backend.load_all("") == [("new", {"a": 2})]
+
+
+async def test_sqlite_backend_snapshots_can_be_exported_and_imported(sqlite_backend, tmp_path):
+    await sqlite_backend.store("result:archive:firefox:57.0", {"value": 1}, ttl=10)
+    await sqlite_backend.store("result:archive:firefox:58.0", {"value": 2}, ttl=10)
+    snapshot = str(tmp_path / "snapshot.db")
+    assert await sqlite_backend.export_snapshot(snapshot) == 2
+
+    other = SQLiteBackend(str(tmp_path / "other.db"))
+    assert await other.import_snapshot(snapshot) == 2
+    assert await other.load("result:archive:firefox:58.0") == {"value": 2}
+    await other.close()
+
+
+async def test_results_cache_warms_up_from_the_backend(sqlite_backend):
+    cache = ResultsCache(ttl=10, backend=sqlite_backend)
+
+    async def compute():
+        return {"status": "exists"}
+
+    await cache.get_or_compute(("archive", "firefox", "57.0"), compute)
+
+    restarted = ResultsCache(ttl=10, backend=sqlite_backend)
+    assert await restarted.warm_up() == 1
+    assert ("archive", "firefox", "57.0") in restarted
+
+
+async def test_validators_cache_warms_up_from_the_backend(sqlite_backend):
+    url = "https://product-details.mozilla.org/1.0/firefox.json"
+    key = (url, (("Accept", "application/json"),), True)
+    validators = ValidatorsCache()
+    validators.backend = sqlite_backend
+    await validators.store(key, UpstreamResponse(url, 200, CIMultiDict({"ETag": '"abc"'}),
+                                                 b'{"releases": {}}'))
+
+    restarted = ValidatorsCache()
+    restarted.backend = sqlite_backend
+    assert await restarted.warm_up() == 1
+    response = restarted.get(key)
+    assert response.headers["ETag"] == '"abc"'
+    assert response.json() == {"releases": {}}
+
+
+async def test_validators_cache_does_not_share_authenticated_documents():
+    url = "https://sql.telemetry.mozilla.org/api/queries/1/results.json"
+    key = (url, (("Authorization", "Key s3cr3t"),), True)
+    validators = ValidatorsCache()
+    validators.backend = MemoryBackend()
+    await validators.store(key, UpstreamResponse(url, 200, CIMultiDict({"ETag": '"abc"'}),
+                                                 b'{}'))
+    assert key in validators
+    assert await validators.backend.load_all("") == []
+
+
+def test_snapshots_can_be_exported_from_the_command_line(tmp_path, capsys):
+    url = "sqlite://{}".format(tmp_path / "cache.db")
+    with mock.patch("pollbot.__main__.CACHE_BACKEND_URL", url):
+        main(["export-cache", str(tmp_path / "snapshot.db")])
+        main(["import-cache", str(tmp_path / "snapshot.db")])
+    assert "Exported 0 cache entries" in capsys.readouterr().out
+
+
+def test_snapshot_commands_require_a_sqlite_backend():
+    with pytest.raises(SystemExit):
+        main(["export-cache", "snapshot.db"])
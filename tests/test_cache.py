@@ -0,0 +1,314 @@
+import asyncio
+
+import pytest
+
+from pollbot.cache import ResultsCache, SingleFlight, TTLCache
+from pollbot.exceptions import NotFoundError, TaskError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_returns_stored_values():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert "a" in cache
+    assert cache.get("b") is None
+    assert cache.get("b", 42) == 42
+
+
+def test_ttl_cache_expires_values():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=30)
+    clock.now += 10
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_ttl_cache_does_not_store_values_with_a_null_ttl():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1, ttl=0)
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used_values():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_counts_hits_and_misses():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {
+        "size": 1,
+        "max_size": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 0,
+    }
+
+
+async def test_single_flight_shares_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return {"answer": 42}
+
+    results = await asyncio.gather(*[flights.do("key", call) for _ in range(5)])
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert flights.stats() == {"inflight": 0, "calls": 1, "shared": 4}
+
+
+async def test_single_flight_does_not_share_sequential_calls():
+    flights = SingleFlight()
+
+    async def call():
+        return 42
+
+    await flights.do("key", call)
+    await flights.do("key", call)
+    assert flights.calls == 2
+    assert flights.shared == 0
+
+
+async def test_single_flight_shares_exceptions():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0)
+        raise ValueError("Boom")
+
+    results = await asyncio.gather(flights.do("key", call), flights.do("key", call),
+                                   return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flights) == 0
+
+
+async def test_single_flight_call_survives_a_cancelled_caller():
+    flights = SingleFlight()
+    event = asyncio.Event()
+
+    async def call():
+        await event.wait()
+        return 42
+
+    first = asyncio.ensure_future(flights.do("key", call))
+    second = asyncio.ensure_future(flights.do("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+    event.set()
+    assert await second == 42
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+async def test_single_flight_ignores_calls_left_by_another_event_loop():
+    flights = SingleFlight()
+    loop = asyncio.new_event_loop()
+    flights._inflight["key"] = loop.create_future()
+    loop.close()
+
+    async def call():
+        return 42
+
+    assert await flights.do("key", call) == 42
+    await flights.cancel()
+
+
+def build_compute(*values):
+    calls = []
+    values = list(values)
+
+    async def compute():
+        calls.append(1)
+        value = values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    return compute, calls
+
+
+async def test_results_cache_computes_missing_values_once():
+    cache = ResultsCache(ttl=10)
+    compute, calls = build_compute("a", "b")
+    assert await cache.get_or_compute("key", compute) == "a"
+    assert await cache.get_or_compute("key", compute) == "a"
+    assert len(calls) == 1
+
+
+async def test_results_cache_serves_stale_values_while_refreshing():
+    clock = FakeClock()
+    cache = ResultsCache(ttl=10, stale_ttl=60, clock=clock)
+    compute, calls = build_compute("a", "b")
+    await cache.get_or_compute("key", compute)
+    clock.now += 20
+
+    assert await cache.get_or_compute("key", compute) == "a"
+    assert cache.stale_hits == 1
+    await asyncio.gather(*cache._background)
+    assert await cache.get_or_compute("key", compute) == "b"
+    assert len(calls) == 2
+
+
+async def test_results_cache_waits_for_values_past_their_hard_expiry():
+    clock = FakeClock()
+    cache = ResultsCache(ttl=10, stale_ttl=60, clock=clock)
+    compute, calls = build_compute("a", "b")
+    await cache.get_or_compute("key", compute)
+    clock.now += 70
+
+    assert await cache.get_or_compute("key", compute) == "b"
+    assert len(calls) == 2
+    assert cache.stale_hits == 0
+
+
+async def test_results_cache_keeps_stale_values_if_the_refresh_fails():
+    clock = FakeClock()
+    cache = ResultsCache(ttl=10, stale_ttl=60, clock=clock)
+    compute, calls = build_compute("a", ValueError("Boom"))
+    await cache.get_or_compute("key", compute)
+    clock.now += 20
+
+    assert await cache.get_or_compute("key", compute) == "a"
+    await asyncio.gather(*cache._background)
+    assert await cache.get_or_compute("key", compute) == "a"
+
+
+async def test_results_cache_does_not_store_errors():
+    cache = ResultsCache(ttl=10)
+    compute, calls = build_compute(ValueError("Boom"), "a")
+    with pytest.raises(ValueError):
+        await cache.get_or_compute("key", compute)
+    assert await cache.get_or_compute("key", compute) == "a"
+
+
+async def test_results_cache_close_cancels_background_refreshes():
+    clock = FakeClock()
+    cache = ResultsCache(ttl=10, stale_ttl=60, clock=clock)
+
+    states = []
+
+    async def compute():
+        states.append("started")
+        await asyncio.sleep(0.05)
+        states.append("finished")
+        return "b"
+
+    cache.set_result("key", "a")
+    clock.now += 20
+    await cache.get_or_compute("key", compute)
+    assert len(cache._background) == 1
+    await asyncio.sleep(0.01)
+    assert states == ["started"]
+    await cache.close()
+    assert len(cache._background) == 0
+    assert len(cache.refreshes) == 0
+
+    await asyncio.sleep(0.1)
+    assert states == ["started"]
+
+
+async def test_results_cache_keeps_negative_results_apart_for_a_short_time():
+    clock = FakeClock()
+    cache = ResultsCache(ttl=60, stale_ttl=60, negative_ttl=5, clock=clock)
+    compute, calls = build_compute("missing", "missing", "exists")
+
+    def is_negative(value):
+        return value == "missing"
+
+    assert await cache.get_or_compute("key", compute, is_negative=is_negative) == "missing"
+    assert await cache.get_or_compute("key", compute, is_negative=is_negative) == "missing"
+    assert len(calls) == 1
+    assert "key" in cache.negatives
+    assert "key" not in cache
+
+    clock.now += 5
+    await cache.get_or_compute("key", compute, is_negative=is_negative)
+    clock.now += 5
+    assert await cache.get_or_compute("key", compute, is_negative=is_negative) == "exists"
+    assert "key" not in cache.negatives
+    assert "key" in cache
+
+
+async def test_results_cache_keeps_not_found_errors_for_a_short_time():
+    cache = ResultsCache(ttl=60, negative_ttl=5)
+    compute, calls = build_compute(NotFoundError("Not found"), "exists")
+
+    for _ in range(2):
+        with pytest.raises(NotFoundError):
+            await cache.get_or_compute("key", compute)
+    assert len(calls) == 1
+
+
+async def test_results_cache_does_not_keep_other_task_errors():
+    cache = ResultsCache(ttl=60, negative_ttl=5)
+    compute, calls = build_compute(TaskError("Down"), "exists")
+
+    with pytest.raises(TaskError):
+        await cache.get_or_compute("key", compute)
+    assert await cache.get_or_compute("key", compute) == "exists"
+
+
+async def test_results_cache_negative_ttl_is_capped_by_the_result_ttl():
+    cache = ResultsCache(ttl=60, negative_ttl=5)
+    compute, calls = build_compute(NotFoundError("Not found"), "exists")
+
+    with pytest.raises(NotFoundError):
+        await cache.get_or_compute("key", compute, ttl=0)
+    assert await cache.get_or_compute("key", compute, ttl=0) == "exists"
+
+
+async def test_results_cache_bounds_negative_results():
+    cache = ResultsCache(ttl=60, negative_maxsize=2, negative_ttl=5)
+    for key in ("a", "b", "c"):
+        with pytest.raises(NotFoundError):
+            await cache.get_or_compute(key, build_compute(NotFoundError(key))[0])
+    assert len(cache.negatives) == 2
+
+
+async def test_results_cache_keeps_immutable_results_forever():
+    clock = FakeClock()
+    cache = ResultsCache(ttl=10, clock=clock)
+    compute, calls = build_compute("final", "other")
+
+    def is_immutable(value):
+        return value == "final"
+
+    await cache.get_or_compute("key", compute, is_immutable=is_immutable)
+    clock.now += 365 * 24 * 3600
+    assert await cache.get_or_compute("key", compute, is_immutable=is_immutable) == "final"
+    assert cache.is_immutable("key")
+    assert len(calls) == 1
+
+
+async def test_results_cache_refresh_recomputes_fresh_values():
+    cache = ResultsCache(ttl=10)
+    compute, calls = build_compute("a", "b")
+
+    assert await cache.get_or_compute("key", compute) == "a"
+    assert await cache.refresh("key", compute, ttl=60) == "b"
+    assert await cache.get_or_compute("key", compute) == "b"
+    assert len(calls) == 2
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from pollbot import codec
+
+
+@pytest.fixture(autouse=True, params=sorted(codec.CODECS))
+def codec_name(request, monkeypatch):
+    """Run each test with both codecs, orjson only if it is installed."""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    loads, dumps = codec.CODECS[request.param]
+    monkeypatch.setattr(codec, "loads", loads)
+    monkeypatch.setattr(codec, "dumps", dumps)
+    return request.param
+
+
+def test_documents_are_decoded_from_bytes():
+    assert codec.loads(b'{"releases": {"firefox-57.0": {"version": "57.0"}}}') == {
+        "releases": {"firefox-57.0": {"version": "57.0"}}}
+
+
+def test_values_are_encoded_compactly_to_bytes():
+    data = codec.dumps({"status": "exists", "locales": ["fr", "de"]})
+    assert isinstance(data, bytes)
+    assert json.loads(data) == {"status": "exists", "locales": ["fr", "de"]}
+    assert b" " not in data
+
+
+def test_json_responses_are_encoded_with_the_codec():
+    response = codec.json_response({"status": 404}, status=404)
+    assert response.status == 404
+    assert response.content_type == "application/json"
+    assert response.charset == "utf-8"
+    assert response.body == codec.dumps({"status": 404})
+
+
+def test_non_string_keys_are_encoded_as_strings():
+    assert json.loads(codec.dumps({57: "exists"})) == {"57": "exists"}
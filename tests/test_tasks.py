@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import json
 import os
@@ -5,16 +6,25 @@ from copy import deepcopy
 
 import aiohttp
 import asynctest
+import mock
 import pytest
 
 from aioresponses import aioresponses
-
-from pollbot.exceptions import TaskError
-from pollbot.tasks import get_session, telemetry
-from pollbot.tasks.archives import archives, partner_repacks, RELEASE_PLATFORMS
+from yarl import URL
+
+from pollbot.cache.backends import MemoryBackend
+from pollbot.exceptions import NotFoundError, TaskError
+from pollbot.tasks import (get_session, telemetry, open_shared_session,
+                           close_shared_session, fetch, fetch_until, upstream_flights,
+                           upstream_validators, HeartbeatProber)
+from pollbot.tasks.archives import (archives, get_locales, get_nightly_listing, locales_cache,
+                                    nightly_listings, partner_repacks, RELEASE_PLATFORMS,
+                                    LocalesMatrix, NightlyListing)
 from pollbot.tasks.balrog import balrog_rules
 from pollbot.tasks.buildhub import buildhub, BUILDHUB_API, BUILDHUB_HEARTBEAT
-from pollbot.tasks.bedrock import release_notes, security_advisories, download_links
+from pollbot.tasks.bedrock import (release_notes, security_advisories, download_links,
+                                   count_unexpected_links, get_locales_matcher,
+                                   ElementsExtractor, ReleaseNotesScanner)
 from pollbot.tasks.bouncer import bouncer
 from pollbot.tasks.buildhub import get_releases
 from pollbot.tasks.product_details import (product_details, ongoing_versions,
@@ -57,6 +67,10 @@ class DeliveryTasksTest(asynctest.TestCase):
         self.mocked.start()
         self.addCleanup(self.mocked.stop)
 
+        # Immutable upstream documents would otherwise be kept between tests.
+        self.addCleanup(upstream_validators.clear)
+        self.addCleanup(locales_cache.clear)
+
         # Just to make absolutely sure no tests leak to a real server
         telemetry.TELEMETRY_SERVER = "https://sql.telemetry.example.com"
 
@@ -65,6 +79,103 @@ class DeliveryTasksTest(asynctest.TestCase):
         async with get_session() as session:
             assert session._default_headers['User-Agent'].startswith("PollBot/")
 
+    async def test_tasks_share_the_application_session(self):
+        app = {}
+        await open_shared_session(app)
+        async with get_session() as session:
+            assert session is app['http_session']
+        assert not app['http_session'].closed
+
+        async with get_session(headers={"Authorization": "Key foo"}) as session:
+            assert session is not app['http_session']
+
+        await close_shared_session(app)
+        assert app['http_session'].closed
+        async with get_session() as session:
+            assert session is not app['http_session']
+
+    async def test_shared_session_keeps_connections_per_host(self):
+        app = {}
+        await open_shared_session(app)
+        connector = app['http_session'].connector
+        assert connector.limit_per_host > 0
+        assert connector.use_dns_cache
+        await close_shared_session(app)
+
+    async def test_concurrent_identical_fetches_share_the_upstream_call(self):
+        url = 'https://product-details.mozilla.org/1.0/firefox.json'
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {}}))
+        shared = upstream_flights.shared
+
+        responses = await asyncio.gather(fetch(url), fetch(url), fetch(url))
+        assert all(resp.status == 200 for resp in responses)
+        assert responses[0].json() is responses[2].json()
+        assert upstream_flights.shared == shared + 2
+
+    async def test_fetches_with_different_headers_are_not_shared(self):
+        url = 'https://product-details.mozilla.org/1.0/firefox.json'
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {}}))
+        self.mocked.get(url, status=404)
+
+        responses = await asyncio.gather(fetch(url), fetch(url, headers={"Accept": "text/html"}))
+        assert sorted(resp.status for resp in responses) == [200, 404]
+
+    async def test_fetch_revalidates_documents_with_an_etag(self):
+        url = 'https://product-details.mozilla.org/1.0/firefox.json'
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {}}),
+                        headers={"ETag": '"abc"'})
+        self.mocked.get(url, status=304)
+        not_modified = upstream_validators.not_modified
+
+        first = await fetch(url)
+        second = await fetch(url)
+        assert second.status == 200
+        assert second.json() is first.json()
+        assert upstream_validators.not_modified == not_modified + 1
+
+        calls = self.mocked.requests[('GET', URL(url))]
+        assert 'If-None-Match' not in (calls[0].kwargs['headers'] or {})
+        assert calls[1].kwargs['headers']['If-None-Match'] == '"abc"'
+
+    async def test_fetch_revalidates_documents_with_a_last_modified_date(self):
+        url = 'https://product-details.mozilla.org/1.0/firefox.json'
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {}}),
+                        headers={"Last-Modified": last_modified})
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {"firefox-1.0": {}}}))
+
+        await fetch(url)
+        second = await fetch(url)
+        assert second.json() == {"releases": {"firefox-1.0": {}}}
+
+        calls = self.mocked.requests[('GET', URL(url))]
+        assert calls[1].kwargs['headers']['If-Modified-Since'] == last_modified
+
+    async def test_fetch_does_not_store_documents_without_validators(self):
+        url = 'https://product-details.mozilla.org/1.0/firefox.json'
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {}}))
+
+        await fetch(url)
+        assert len(upstream_validators) == 0
+
+    async def test_fetch_revalidates_documents_stored_by_other_replicas(self):
+        self.addCleanup(setattr, upstream_validators, 'backend', None)
+        upstream_validators.backend = MemoryBackend()
+        url = 'https://product-details.mozilla.org/1.0/firefox.json'
+        self.mocked.get(url, status=200, body=json.dumps({"releases": {}}),
+                        headers={"ETag": '"abc"'})
+        self.mocked.get(url, status=304)
+
+        await fetch(url)
+        # Another replica only shares the backend.
+        upstream_validators.clear()
+        second = await fetch(url)
+        assert second.status == 200
+        assert second.json() == {"releases": {}}
+
+        calls = self.mocked.requests[('GET', URL(url))]
+        assert calls[1].kwargs['headers']['If-None-Match'] == '"abc"'
+
     async def test_get_releases_tasks_return_releases(self):
         self.mocked.post(BUILDHUB_API, status=200, body=json.dumps({
             "aggregations": {
@@ -87,7 +198,7 @@ class DeliveryTasksTest(asynctest.TestCase):
                     "buckets": [],
                 }
             }}))
-        with pytest.raises(TaskError) as excinfo:
+        with pytest.raises(NotFoundError) as excinfo:
             await get_releases('firefox')
         assert str(excinfo.value) == "Couldn't find any version matching."
 
@@ -145,6 +256,61 @@ class DeliveryTasksTest(asynctest.TestCase):
                                        "the URL and 1 link should use the HTTPS protocol "
                                        "rather than HTTP.")
 
+    def test_releasenotes_scanner_only_collects_the_main_content_links(self):
+        scanner = ReleaseNotesScanner()
+        scanner.feed('''
+<html>
+  <body>
+    <a href="https://www.mozilla.org/fr/firefox/">Header</a>
+    <div id="main-content">
+      <div><img src="logo.png"><br/>
+        <ul>
+          <li><a href="https://support.mozilla.org/kb/a">A</a>
+          <li><a name="anchor">No link</a>
+          <li><a href="https://support.mozilla.org/kb/b">B</a>
+        </ul>
+      </div>
+      <a href="https://developer.mozilla.org/kb/c">C</a>
+    </div>
+    <a href="https://www.mozilla.org/de/firefox/">Footer</a>
+  </body>
+</html>''')
+        scanner.close()
+        assert scanner.links == ['https://support.mozilla.org/kb/a',
+                                 'https://support.mozilla.org/kb/b',
+                                 'https://developer.mozilla.org/kb/c']
+
+    async def test_releasenotes_tasks_find_coming_soon_messages_split_between_chunks(self):
+        url = 'https://www.mozilla.org/en-US/firefox/60.0a1/releasenotes/'
+        self.mocked.get(url, status=200, body=(
+            '<html><body><div id="main-content"><h2>The notes are not yet publicly available, '
+            'but are coming soon! Please check this page again later.</h2></div></body></html>'))
+
+        with mock.patch('pollbot.tasks.STREAM_CHUNK_SIZE', 7):
+            received = await release_notes('firefox', '60.0a1')
+        assert received["status"] == Status.INCOMPLETE.value
+        assert received["message"] == ("Release notes were found for version 60.0a1 "
+                                       "but show a `coming soon` message.")
+
+    def test_releasenotes_scanner_consumes_the_page_by_chunks(self):
+        scanner = ReleaseNotesScanner()
+        page = ('<div id="main-content"><a href="https://support.mozilla.org/fr/kb">A</a>'
+                '<p>Are coming soon? No.</p></div>')
+        for i in range(0, len(page), 5):
+            assert not scanner.consume(page[i:i + 5])
+        assert scanner.links == ['https://support.mozilla.org/fr/kb']
+        assert not scanner.coming_soon
+
+    def test_count_unexpected_links_counts_each_locale_of_the_localized_domains(self):
+        locales = frozenset(['de', 'es', 'es-ES', 'fr'])
+        links = ['https://support.mozilla.org/fr/de/kb',
+                 'https://support.mozilla.org/es-ES/kb',
+                 'https://support.mozilla.org/kb/es',
+                 'https://example.com/fr/',
+                 'http://www.mozilla.org/fr/']
+        assert count_unexpected_links(links, locales) == (1, 3)
+        assert get_locales_matcher(frozenset(locales)) is get_locales_matcher(locales)
+
     async def test_releasenotes_tasks_returns_incomplete_if_coming_soon(self):
         url = ('https://hg.mozilla.org/mozilla-central/raw-file/tip/browser/locales/all-locales')
         self.mocked.get(url, status=200, body=SHIPPED_LOCALES_BODY)
@@ -260,6 +426,7 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
 
         received = await archives('firefox', '57.0rc4')
         assert received["status"] == Status.EXISTS.value
+        assert not received.immutable
 
     async def test_archives_tasks_returns_task_error_if_mercurial_is_down(self):
         url = "https://hg.mozilla.org/mozilla-central/raw-file/tip/browser/locales/all-locales"
@@ -309,6 +476,7 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
 
         received = await archives('firefox', '57.0a1')
         assert received["status"] == Status.EXISTS.value, received['message']
+        assert not received.immutable
 
     async def test_archives_tasks_returns_false_if_absent_for_nightly(self):
         url = 'https://archive.mozilla.org/pub/firefox/nightly/latest-mozilla-central-l10n/'
@@ -317,6 +485,36 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
         received = await archives('firefox', '57.0a1')
         assert received["status"] == Status.MISSING.value
 
+    async def test_archives_tasks_index_the_nightly_listing_once(self):
+        url = "https://hg.mozilla.org/mozilla-central/raw-file/tip/browser/locales/all-locales"
+        self.mocked.get(url, status=200, body=ALL_LOCALES_BODY)
+        url = "https://archive.mozilla.org/pub/firefox/nightly/latest-mozilla-central-l10n/"
+        self.mocked.get(url, status=200, body=json.dumps(LATEST_MOZILLA_CENTRAL_L10N_BODY),
+                        headers={'ETag': '"abc"'})
+        self.mocked.get(url, status=304)
+
+        await archives('firefox', '57.0a1')
+        # The listing is not modified, the response is reused along with its index.
+        resp = await fetch(url, headers={"Accept": "application/json"})
+        listing = nightly_listings[resp][('firefox', '57.0a1')]
+        assert get_nightly_listing(resp, 'firefox', '57.0a1') is listing
+
+    def test_nightly_listing_is_indexed_by_platform_and_locale(self):
+        listing = NightlyListing('firefox', '57.0a1', [
+            'Firefox Installer.fr.exe',
+            'firefox-57.0a1.fr.win32.installer.exe',
+            'firefox-57.0a1.fr.mac.dmg',
+            'firefox-57.0a1.ja-JP-mac.mac.dmg',
+            'firefox-57.0a1.ja.linux-x86_64.tar.bz2',
+            'firefox-56.0a1.de.mac.dmg',
+        ])
+        assert ('win32', 'fr') in listing
+        assert ('mac', 'ja') in listing
+        assert ('mac', 'de') not in listing
+        assert listing.missing_platforms('fr') == ['win64', 'linux32', 'linux64']
+        assert listing.missing_platforms('ja') == ['windows', 'win32', 'win64', 'linux32']
+        assert listing.filename('mac', 'ja') == 'firefox-57.0a1.ja-JP-mac.mac.dmg'
+
     async def test_archives_tasks_returns_true_if_folder_and_releases_exists(self):
         url = 'https://archive.mozilla.org/pub/firefox/releases/52.0.2/'
         self.mocked.get(url, status=200)
@@ -327,6 +525,73 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
 
         received = await archives('firefox', '52.0.2')
         assert received["status"] == Status.EXISTS.value
+        assert received.immutable
+
+    def test_locales_matrix_diff_lists_missing_locales_and_files(self):
+        matrix = LocalesMatrix.from_platform_locales([
+            ['fr', 'ja'], ['fr', 'ja'], ['ja-JP-mac'], ['fr', 'ja', 'zu'], ['fr', 'ja'],
+        ])
+        assert matrix.platforms('ja') == RELEASE_PLATFORMS
+        missing_locales, missing_files = LocalesMatrix.complete(['de', 'fr', 'ja']).diff(
+            matrix).missing()
+        assert missing_locales == ['de']
+        assert sorted(missing_files) == ['fr for mac', 'zu for win32']
+
+    def test_locales_matrix_diff_compares_two_builds(self):
+        build1 = LocalesMatrix.from_platform_locales([['fr', 'ja']] * 5)
+        build2 = LocalesMatrix.from_platform_locales([['fr']] * 2 + [['fr', 'ja-JP-mac']] +
+                                                     [['fr']] * 2)
+        assert build1.diff(build2).rows == {'ja': 0b11011}
+        assert build1.diff(build1).rows == {}
+        assert build2.diff(build1).missing() == (
+            [], ['ja for linux-i686', 'ja for linux-x86_64', 'ja for win32', 'ja for win64'])
+
+    async def test_archives_tasks_download_tagged_shipped_locales_once(self):
+        url = ('https://hg.mozilla.org/releases/mozilla-release/raw-file/'
+               'FIREFOX_52_0_2_RELEASE/browser/locales/shipped-locales')
+        self.mocked.get(url, status=200, body=SHIPPED_LOCALES_BODY)
+        for _ in range(2):
+            self.mocked.get('https://archive.mozilla.org/pub/firefox/releases/52.0.2/',
+                            status=200)
+            self.mock_platforms(RELEASE_PLATFORMS, RELEASES_52_BODY)
+            received = await archives('firefox', '52.0.2')
+            assert received["status"] == Status.EXISTS.value
+
+        assert len(self.mocked.requests[('GET', URL(url))]) == 1
+
+    async def test_get_locales_returns_a_frozenset_pinned_to_the_release_tag(self):
+        url = ('https://hg.mozilla.org/releases/mozilla-release/raw-file/'
+               'FIREFOX_52_0_2_RELEASE/browser/locales/shipped-locales')
+        self.mocked.get(url, status=200, body=SHIPPED_LOCALES_BODY)
+
+        locales = await get_locales('firefox', '52.0.2')
+        assert isinstance(locales, frozenset)
+        assert 'ja' in locales and 'ja-JP-mac' not in locales
+        assert await get_locales('firefox', '52.0.2') is locales
+        key = ('https://hg.mozilla.org/releases/mozilla-release', 'FIREFOX_52_0_2_RELEASE')
+        assert locales_cache._data[key][1] == float('inf')
+
+    async def test_get_locales_keeps_tip_locales_for_a_short_time(self):
+        url = "https://hg.mozilla.org/mozilla-central/raw-file/tip/browser/locales/all-locales"
+        self.mocked.get(url, status=200, body=ALL_LOCALES_BODY)
+
+        await get_locales('firefox', '57.0a1')
+        _, expires_at = locales_cache._data[('https://hg.mozilla.org/mozilla-central', 'tip')]
+        assert expires_at <= locales_cache.clock() + locales_cache.ttl
+
+    async def test_get_locales_reads_the_candidate_revision_once(self):
+        url = ("https://archive.mozilla.org/pub/firefox/candidates/57.0-candidates/build4/"
+               "linux-x86_64/en-US/firefox-57.0.txt")
+        self.mocked.get(url, status=200, body='''20171112125346
+https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a464f92695524fc
+''')
+        url = ("https://hg.mozilla.org/releases/mozilla-release/raw-file/"
+               "3702966a64c80e17d01f613b0a464f92695524fc/browser/locales/shipped-locales")
+        self.mocked.get(url, status=200, body=SHIPPED_LOCALES_BODY)
+
+        first = await get_locales('firefox', '57.0rc4')
+        assert await get_locales('firefox', '57.0build4') is first
+        assert len(self.mocked.requests) == 2
 
     async def test_archives_tasks_returns_incomplete_if_a_file_is_missing(self):
         url = 'https://archive.mozilla.org/pub/firefox/releases/52.0.2/'
@@ -574,6 +839,51 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
             await download_links('firefox', '54.0')
         assert str(excinfo.value) == 'Download page not available  (404)'
 
+    async def test_fetch_until_stops_reading_once_consumed(self):
+        url = 'https://www.mozilla.org/en-US/firefox/all/'
+        self.mocked.get(url, status=200,
+                        body='<html data-latest-firefox="52.0.2">' + '<p>Été</p>' * 1000)
+
+        class ChunksExtractor(ElementsExtractor):
+            chunks = 0
+
+            def consume(self, text):
+                self.chunks += 1
+                return super().consume(text)
+
+        with mock.patch('pollbot.tasks.STREAM_CHUNK_SIZE', 16):
+            status, extractor = await fetch_until(url, ChunksExtractor)
+        assert status == 200
+        assert extractor.attr('data-latest-firefox') == '52.0.2'
+        assert extractor.chunks == 3
+
+    async def test_fetch_until_returns_the_error_status_without_reading(self):
+        url = 'https://www.mozilla.org/en-US/firefox/all/'
+        self.mocked.get(url, status=503, body='Unavailable')
+
+        status, extractor = await fetch_until(url, ElementsExtractor)
+        assert status == 503
+        assert extractor.html is None
+
+    async def test_fetch_until_shares_concurrent_identical_calls(self):
+        url = 'https://www.mozilla.org/en-US/firefox/all/'
+        self.mocked.get(url, status=200, body='<html data-latest-firefox="52.0.2">')
+
+        (_, first), (_, second) = await asyncio.gather(
+            fetch_until(url, ElementsExtractor, ('firefox52',)),
+            fetch_until(url, ElementsExtractor, ('firefox52',)))
+        assert first is second
+        assert len(self.mocked.requests[('GET', URL(url))]) == 1
+
+    def test_elements_extractor_is_done_once_all_ids_are_found(self):
+        extractor = ElementsExtractor(ids=['firefox57', 'firefox56'])
+        assert not extractor.consume('<html lang="en"><h3 id="firefox57" class="level')
+        assert extractor.attr('lang') == 'en'
+        assert not extractor.consume('-heading"></h3><h3 id="firefox5')
+        assert extractor.attr('class', 'firefox57') == 'level-heading'
+        assert extractor.consume('6"></h3>')
+        assert extractor.attr('class', 'firefox56') is None
+
     async def test_security_advisories_tasks_returns_missing_for_beta(self):
         received = await security_advisories('firefox', '56.0b2')
         assert received["status"] == Status.MISSING.value
@@ -833,7 +1143,9 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
         url = 'https://www.thunderbird.net/en-US/thunderbird/all/'
         self.mocked.get(url, status=404)
 
-        resp = await heartbeat(None)
+        request = mock.MagicMock()
+        request.app = {}
+        resp = await heartbeat(request)
         assert json.loads(resp.body.decode()) == {
             "archive": False,
             "balrog": False,
@@ -846,6 +1158,52 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
         }
         assert resp.status == 503
 
+    async def test_heartbeat_prober_records_latest_outcomes(self):
+        async def working():
+            return True
+
+        async def failing():
+            raise aiohttp.ClientConnectionError()
+
+        prober = HeartbeatProber({"working": working, "failing": failing})
+        assert prober.snapshot() is None
+
+        assert await prober.refresh() == {"working": True, "failing": False}
+        stats = prober.stats()
+        assert stats["working"]["last_success"] == stats["working"]["checked_at"]
+        assert stats["working"]["latency"] >= 0
+        assert stats["failing"]["last_success"] is None
+
+    async def test_heartbeat_prober_shares_concurrent_probes(self):
+        calls = []
+
+        async def working():
+            calls.append(1)
+            await asyncio.sleep(0)
+            return True
+
+        prober = HeartbeatProber({"working": working})
+        await asyncio.gather(prober.refresh(), prober.refresh())
+        assert calls == [1]
+
+    async def test_heartbeat_prober_probes_on_a_schedule(self):
+        calls = []
+
+        async def working():
+            calls.append(1)
+            return True
+
+        prober = HeartbeatProber({"working": working}, interval=0.001)
+        prober.start()
+        await asyncio.sleep(0.01)
+        await prober.stop()
+        assert len(calls) > 1
+
+    async def test_heartbeat_prober_does_not_run_without_interval(self):
+        prober = HeartbeatProber({}, interval=0)
+        prober.start()
+        assert prober._task is None
+
     async def test_get_ongoing_versions_return_ongoing_versions(self):
         url = 'https://product-details.mozilla.org/1.0/firefox_versions.json'
         body = {
@@ -1007,6 +1365,46 @@ https://hg.mozilla.org/releases/mozilla-release/rev/3702966a64c80e17d01f613b0a46
         received = await buildhub('firefox', '56.0b12')
         assert received["status"] == Status.EXISTS.value
         assert received["message"] == "Build IDs for this release: 20170914024831"
+        assert not received.immutable
+
+    async def test_buildhub_task_results_are_immutable_for_finished_releases(self):
+        self._mock_buildhub_search("20170914024831")
+        url = 'https://product-details.mozilla.org/1.0/firefox_versions.json'
+        self.mocked.get(url, status=200, body=json.dumps({"LATEST_FIREFOX_VERSION": "56.0.1"}))
+        received = await buildhub('firefox', '56.0')
+        assert received["status"] == Status.EXISTS.value
+        assert received.immutable
+
+    async def test_buildhub_task_results_are_not_immutable_for_the_current_release(self):
+        self._mock_buildhub_search("20170914024831")
+        url = 'https://product-details.mozilla.org/1.0/firefox_versions.json'
+        self.mocked.get(url, status=200, body=json.dumps({"LATEST_FIREFOX_VERSION": "56.0"}))
+        received = await buildhub('firefox', '56.0')
+        assert received["status"] == Status.EXISTS.value
+        assert not received.immutable
+
+    async def test_buildhub_task_results_are_immutable_for_finished_esr_releases(self):
+        self._mock_buildhub_search("20170914024831")
+        url = 'https://product-details.mozilla.org/1.0/firefox_versions.json'
+        self.mocked.get(url, status=200, body=json.dumps({"FIREFOX_ESR": "52.5.0esr"}))
+        received = await buildhub('firefox', '52.4.0esr')
+        assert received.immutable
+
+    async def test_buildhub_task_results_are_not_immutable_for_older_esr_branches(self):
+        self._mock_buildhub_search("20170914024831")
+        url = 'https://product-details.mozilla.org/1.0/firefox_versions.json'
+        self.mocked.get(url, status=200, body=json.dumps({"FIREFOX_ESR": "60.0esr"}))
+        received = await buildhub('firefox', '52.4.0esr')
+        assert received["status"] == Status.EXISTS.value
+        assert not received.immutable
+
+    async def test_buildhub_task_results_are_not_immutable_without_product_details(self):
+        self._mock_buildhub_search("20170914024831")
+        url = 'https://product-details.mozilla.org/1.0/firefox_versions.json'
+        self.mocked.get(url, status=503)
+        received = await buildhub('firefox', '56.0')
+        assert received["status"] == Status.EXISTS.value
+        assert not received.immutable
 
     def _telemetry_mock_query(self, body=None, id=None, status=200):
         id = id or telemetry.TELEMETRY_UPTAKE_QUERY_ID
@@ -3,8 +3,11 @@ import datetime
 import pytest
 from pollbot.tasks.archives import verdict
 from pollbot.utils import (
+    Channel,
     build_version_id,
     get_version_from_filename,
+    is_valid_version,
+    parse_version,
     yesterday,
 )
 
@@ -34,6 +37,32 @@ def test_parse_nightly_filename(arg, output):
     assert build_version_id(arg) == output
 
 
+def test_versions_are_ordered_like_their_ids():
+    versions = [parse_version(version) for version, _ in VERSIONS]
+    assert sorted(versions) == sorted(versions, key=lambda version: version.key)
+    assert sorted(VERSIONS, key=lambda v: parse_version(v[0])) == sorted(
+        VERSIONS, key=lambda v: v[1])
+    assert parse_version('53.0b99build3') == parse_version('53.0b99')
+    assert parse_version('50.0.1') > parse_version('50.0')
+    assert len({parse_version('53.0rc3'), parse_version('53.0')}) == 1
+
+
+def test_parsed_versions_are_memoized():
+    assert parse_version('57.0b3') is parse_version('57.0b3')
+    assert str(parse_version('57.0b3')) == '57.0b3'
+    with pytest.raises(AttributeError):
+        parse_version('57.0b3').extra = 1
+
+
+def test_parsed_versions_carry_their_channel():
+    assert parse_version('57.0b3').channel is Channel.BETA
+    assert parse_version('57.0b3').get_channel('devedition') is Channel.AURORA
+    assert parse_version('52.5.0esr').get_channel('firefox') is Channel.ESR
+    assert parse_version('57.0build1').channel is Channel.CANDIDATE
+    assert not is_valid_version('57')
+    assert not is_valid_version('57.0a1a')
+
+
 FILENAMES = [
     ('firefox-57.0a1.zh-TW.win64.zip', '57.0a1'),
     ('firefox-57.0a1.fr.win64.zip', '57.0a1'),
@@ -1,18 +1,29 @@
+import asyncio
 import json
 import os.path
+import time
 
 from aiohttp import web, ClientError
 import mock
 import pytest
 import ruamel.yaml as yaml
+from aioresponses import aioresponses
+from yarl import URL
 
 from pollbot import __version__ as pollbot_version, HTTP_API_VERSION, PRODUCTS
 from pollbot.app import get_app
-from pollbot.middlewares import NO_CACHE_ENDPOINTS
+from pollbot.cache import ResultsCache
+from pollbot.cache.backends import MemoryBackend
+from pollbot.middlewares import NO_CACHE_ENDPOINTS, cache_control_middleware
 from pollbot.exceptions import TaskError
+from pollbot.tasks import build_task_response
 from pollbot.tasks.buildhub import get_build_ids_for_version
-from pollbot.views.release import status_response
-from pollbot.utils import Status
+from pollbot.views.release import (CHECK_PLANS, CHECKS_TASKS, status_response,
+                                   view_get_releases)
+from pollbot.views.scheduler import Scheduler
+from pollbot.views.subscriptions import VersionWatcher
+from pollbot.views.webhooks import Webhooks
+from pollbot.utils import Channel, Status
 
 HERE = os.path.dirname(__file__)
 
@@ -29,6 +40,9 @@ def cli(event_loop, aiohttp_client):
         raise ValueError()
 
     app = get_app()
+    # Probe the upstreams heartbeats on demand only, and don't precompute checks.
+    app['heartbeat_prober'].interval = 0
+    app['scheduler'].fast_interval = 0
     app.router.add_get('/error', error)
     app.router.add_get('/error-403', error403)
     app.router.add_get('/error-404', error404)
@@ -85,6 +99,23 @@ async def test_oas_spec(cli):
     await check_yaml_resource(cli, "/v1/__api__", "api.yaml", host="127.0.0.1")
 
 
+async def test_oas_spec_has_got_an_etag_per_host(cli):
+    resp = await cli.get("/v1/__api__", headers={"Host": "127.0.0.1"})
+    etag = resp.headers["ETag"]
+    resp = await cli.get("/v1/__api__", headers={"Host": "localhost"})
+    assert resp.headers["ETag"] != etag
+    assert (await resp.json())["host"] == "localhost"
+
+
+async def test_static_documents_are_not_sent_again_if_not_modified(cli):
+    resp = await cli.get("/v1/contribute.json")
+    etag = resp.headers["ETag"]
+    resp = await cli.get("/v1/contribute.json", headers={"If-None-Match": etag})
+    assert resp.status == 304
+    assert resp.headers["ETag"] == etag
+    assert await resp.read() == b""
+
+
 async def test_contribute_redirect(cli):
     resp = await check_response(cli, "/contribute.json", status=302, allow_redirects=False)
     assert resp.headers['Location'] == "/v1/contribute.json"
@@ -145,6 +176,121 @@ async def test_status_response_handle_client_errors(cli):
     }
 
 
+async def test_status_response_caches_task_results(cli):
+    calls = []
+
+    async def task(product, version):
+        calls.append((product, version))
+        return {"status": Status.EXISTS.value, "message": "Found", "link": "url"}
+    endpoint = status_response(task, "archive")
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox", "version": "57.0"}
+    first = await endpoint(request)
+    second = await endpoint(request)
+    assert first.body == second.body
+    assert calls == [("firefox", "57.0")]
+    assert request.app["results_cache"].hits == 1
+
+
+async def test_status_response_does_not_cache_task_errors(cli):
+    calls = []
+
+    async def error_task(product, version):
+        calls.append((product, version))
+        raise TaskError('Error message')
+    endpoint = status_response(error_task, "archive")
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox", "version": "57.0"}
+    await endpoint(request)
+    await endpoint(request)
+    assert len(calls) == 2
+
+
+async def test_status_response_caches_missing_results_apart(cli):
+    calls = []
+
+    async def task(product, version):
+        calls.append((product, version))
+        return {"status": Status.MISSING.value, "message": "Not found", "link": "url"}
+    endpoint = status_response(task, "archive")
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox", "version": "57.0"}
+    await endpoint(request)
+    await endpoint(request)
+    assert calls == [("firefox", "57.0")]
+    assert len(request.app["results_cache"]) == 0
+    assert len(request.app["results_cache"].negatives) == 1
+
+
+async def test_status_response_cache_ttl_can_be_parametrized(cli):
+    async def task(product, version):
+        return {"status": Status.EXISTS.value, "message": "Found", "link": "url"}
+    endpoint = status_response(task, "archive")
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox", "version": "57.0"}
+    with mock.patch.dict(os.environ, {"POLLBOT_CACHE_TTL_ARCHIVE": "0"}):
+        await endpoint(request)
+    assert len(request.app["results_cache"]) == 0
+
+
+async def test_status_response_pins_immutable_results(cli):
+    async def task(product, version):
+        return build_task_response(True, "url", "Found", immutable=True)
+    endpoint = status_response(task, "archive")
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox", "version": "57.0"}
+    resp = await endpoint(request)
+    assert resp['immutable']
+    assert request.app["results_cache"].is_immutable(("archive", "firefox", "57.0"))
+
+    resp = await endpoint(request)
+    assert resp['immutable']
+
+
+async def test_status_response_does_not_pin_missing_results(cli):
+    async def task(product, version):
+        return build_task_response(False, "url", "Not found", immutable=True)
+    endpoint = status_response(task, "archive")
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox", "version": "57.0"}
+    resp = await endpoint(request)
+    assert not resp['immutable']
+
+
+async def test_immutable_responses_have_got_long_cache_control_headers(cli):
+    async def handler(request):
+        response = web.json_response({})
+        response['immutable'] = True
+        return response
+    request = mock.MagicMock()
+    request.path = "/v1/firefox/52.0/archive"
+    middleware = await cache_control_middleware(None, handler)
+    resp = await middleware(request)
+    assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+
+async def test_get_releases_are_served_from_the_results_cache(cli):
+    calls = []
+
+    async def get_releases(product):
+        calls.append(product)
+        return ["57.0"]
+    request = mock.MagicMock()
+    request.app = {"results_cache": ResultsCache()}
+    request.match_info = {"product": "firefox"}
+    with mock.patch("pollbot.views.release.get_releases", get_releases):
+        await view_get_releases(request)
+        resp = await view_get_releases(request)
+    assert json.loads(resp.body.decode()) == {"releases": ["57.0"]}
+    assert calls == ["firefox"]
+
+
 async def test_status_response_validates_product_name(cli):
     async def dummy_task(product, version):
         return True
@@ -400,6 +546,151 @@ async def test_get_checks_response_validates_product_name(cli):
     }, status=404)
 
 
+async def test_run_checks_for_esr(cli):
+    calls = []
+
+    def task_for(check_name):
+        async def task(product, version):
+            calls.append(check_name)
+            if check_name == "bouncer":
+                raise TaskError("Bouncer is down", url="https://bouncer.example.com")
+            return build_task_response(True, "url", check_name, immutable=True)
+        return task
+
+    tasks = {check_name: task_for(check_name) for check_name in CHECKS_TASKS}
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", tasks):
+        resp = await check_response(cli, "/v1/firefox/52.0esr/all")
+    body = await resp.json()
+    assert (body["product"], body["version"], body["channel"]) == ("firefox", "52.0esr", "esr")
+    assert sorted(calls) == ["archive", "balrog-rules", "bouncer", "buildhub",
+                             "download-links", "product-details", "release-notes",
+                             "security-advisories", "telemetry-main-summary-uptake"]
+    checks = {check["title"]: check for check in body["checks"]}
+    assert checks["Archive Release"]["result"] == {
+        "status": "exists", "message": "archive", "link": "url"}
+    assert checks["Bouncer"]["result"] == {
+        "status": "error", "message": "Bouncer is down", "link": "https://bouncer.example.com"}
+    assert checks["Bouncer"]["url"].endswith("/v1/firefox/52.0esr/bouncer")
+    assert all(check["duration"] >= 0 for check in body["checks"])
+    assert not body["checks"][-1]["actionable"]
+    # A failing check makes the whole response mutable.
+    assert "immutable" not in resp.headers["Cache-Control"]
+
+
+def slow_tasks(slow_check_name):
+    def task_for(check_name):
+        async def task(product, version):
+            if check_name == slow_check_name:
+                await asyncio.sleep(0.1)
+            return build_task_response(True, "url", check_name)
+        return task
+    return {check_name: task_for(check_name) for check_name in CHECKS_TASKS}
+
+
+async def test_run_checks_can_be_streamed_as_ndjson(cli):
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", slow_tasks("archive")):
+        resp = await check_response(cli, "/v1/firefox/52.0esr/all",
+                                    headers={"Accept": "application/x-ndjson"})
+        lines = (await resp.text()).splitlines()
+    assert resp.headers["Content-Type"] == "application/x-ndjson"
+    assert resp.headers["Cache-Control"] == "no-cache"
+    records = [json.loads(line) for line in lines]
+    assert len(records) == 9
+    # The slowest check comes last.
+    assert records[-1]["title"] == "Archive Release"
+    assert records[-1]["result"]["status"] == "exists"
+
+
+async def test_run_checks_can_be_streamed_as_server_sent_events(cli):
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", slow_tasks("bouncer")):
+        resp = await check_response(cli, "/v1/firefox/57.0a1/all",
+                                    headers={"Accept": "text/event-stream"})
+        events = (await resp.text()).split("\n\n")
+    assert resp.headers["Content-Type"] == "text/event-stream"
+    assert events[-2] == "event: end\ndata: {}"
+    event, data = events[-3].split("\n")
+    assert event == "event: check"
+    assert json.loads(data[len("data: "):])["title"] == "Bouncer"
+
+
+async def test_run_checks_response_validates_product_name(cli):
+    await check_response(cli, "/v1/invalid-product/56.0/all", body={
+        "status": 404,
+        "message": "Invalid product: invalid-product not in ('firefox', "
+                   "'devedition', 'thunderbird')"
+    }, status=404)
+
+
+def toggling_archive_tasks(statuses):
+    calls = []
+
+    async def archive(product, version):
+        calls.append(version)
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        return build_task_response(status, "url", "Archive")
+    return calls, dict(CHECKS_TASKS, archive=archive)
+
+
+async def test_subscribers_share_a_watcher_and_receive_status_transitions(cli):
+    calls, tasks = toggling_archive_tasks([False, False, False, True])
+    watchers = cli.server.app['watchers']
+    watchers.interval = 0.01
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", tasks), \
+            mock.patch.dict(os.environ, {"POLLBOT_CACHE_TTL_ARCHIVE": "0"}):
+        first = await cli.ws_connect("/v1/firefox/57.0/subscribe?checks=archive")
+        second = await cli.ws_connect("/v1/firefox/57.0/subscribe?checks=archive")
+        assert watchers.stats() == {"watchers": 1, "subscribers": 2}
+
+        for ws in (first, second):
+            events = [await ws.receive_json() for _ in range(2)]
+            assert [event["status"] for event in events] == ["missing", "exists"]
+            assert events[0]["check"] == "archive"
+            assert events[0]["version"] == "57.0"
+        # A single upstream polling loop for both subscribers.
+        assert len(calls) < 8
+        await first.close()
+        await second.close()
+
+    await asyncio.sleep(0.05)
+    assert watchers.stats() == {"watchers": 0, "subscribers": 0}
+
+
+async def test_subscriptions_can_be_server_sent_events(cli):
+    calls, tasks = toggling_archive_tasks([True])
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", tasks):
+        resp = await cli.get("/v1/firefox/57.0/subscribe?checks=archive")
+        assert resp.headers["Content-Type"] == "text/event-stream"
+        assert await resp.content.readline() == b"event: check\n"
+        data = await resp.content.readline()
+        resp.close()
+    assert json.loads(data.decode()[len("data: "):])["status"] == "exists"
+
+
+async def test_slow_subscribers_only_get_the_latest_status_of_their_checks(cli):
+    watcher = VersionWatcher(cli.server.app, "firefox", "57.0")
+    queue = watcher.subscribe(["archive", "release-notes"])
+    for status in ["missing", "exists"] * 50:
+        watcher.publish("archive", {"status": status})
+        watcher.publish("release-notes", {"status": "missing"})
+        watcher.publish("bouncer", {"status": status})
+    watcher.publish("release-notes", {"status": "exists"})
+
+    assert queue.maxsize == 2
+    events = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert [(event["check"], event["status"]) for event in events] == [
+        ("archive", "exists"),
+        ("release-notes", "exists"),
+    ]
+
+
+async def test_subscriptions_validate_check_names(cli):
+    await check_response(cli, "/v1/firefox/57.0/subscribe?checks=archive,devedition-beta-matches",
+                         status=400, body={
+                             "status": 400,
+                             "message": "Invalid checks for firefox 57.0: devedition-beta-matches"
+                         })
+
+
 # These are currently functional tests.
 
 async def test_nightly_archive(cli):
@@ -725,14 +1016,100 @@ async def test_heartbeat(cli):
                          })
 
 
-async def test_version_view_return_404_if_missing_file(cli):
-    with mock.patch("builtins.open", side_effect=IOError):
-        await check_response(cli, "/v1/__version__",
-                             status=404,
-                             body={
-                                 "status": 404,
-                                 "message": "Page '/v1/__version__' not found"
-                             })
+async def test_heartbeat_serves_the_latest_snapshot(cli):
+    calls = []
+
+    async def working():
+        calls.append(1)
+        return True
+    prober = cli.server.app['heartbeat_prober']
+    prober.heartbeats = {"working": working}
+    prober.interval = 3600
+    prober.start()
+
+    await check_response(cli, "/v1/__heartbeat__", body={"working": True})
+    await check_response(cli, "/v1/__heartbeat__", body={"working": True})
+    assert len(calls) == 1
+
+    await check_response(cli, "/v1/__heartbeat__?fresh=1", body={"working": True})
+    assert len(calls) == 2
+
+    resp = await check_response(cli, "/v1/__stats__")
+    assert (await resp.json())["heartbeats"]["working"]["success"] is True
+
+
+async def test_heartbeat_probes_on_demand_without_interval(cli):
+    outcomes = [False, True]
+
+    async def recovering():
+        return outcomes.pop(0)
+    prober = cli.server.app['heartbeat_prober']
+    prober.heartbeats = {"recovering": recovering}
+
+    await check_response(cli, "/v1/__heartbeat__", status=503, body={"recovering": False})
+    await check_response(cli, "/v1/__heartbeat__", body={"recovering": True})
+
+
+async def test_heartbeat_prober_starts_with_the_app(aiohttp_client):
+    probed = asyncio.Event()
+
+    async def working():
+        probed.set()
+        return True
+    app = get_app()
+    prober = app['heartbeat_prober']
+    prober.heartbeats = {"working": working}
+    prober.interval = 3600
+    cli = await aiohttp_client(app)
+
+    await asyncio.wait_for(probed.wait(), 1)
+    await check_response(cli, "/v1/__heartbeat__", body={"working": True})
+    await cli.close()
+    assert prober._task is None
+
+
+async def test_stats_view_returns_results_cache_counters(cli):
+    resp = await check_response(cli, "/v1/__stats__")
+    body = await resp.json()
+    assert body["results_cache"] == {
+        "size": 0,
+        "max_size": 2048,
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+        "stale_hits": 0,
+        "refreshing": 0,
+        "negatives": {
+            "size": 0,
+            "max_size": 512,
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        },
+    }
+    assert sorted(body["upstream_requests"].keys()) == ["calls", "inflight", "shared"]
+    assert body["locales"]["max_size"] == 256
+
+
+async def test_version_view_return_404_if_missing_file(aiohttp_client):
+    # The version file is read once, when the app is set up.
+    with mock.patch("pollbot.views.utilities.VERSION_FILE", "missing-version.json"):
+        cli = await aiohttp_client(get_app())
+    await check_response(cli, "/v1/__version__",
+                         status=404,
+                         body={
+                             "status": 404,
+                             "message": "Page '/v1/__version__' not found"
+                         })
+
+
+async def test_version_view_serves_the_file_read_on_startup(aiohttp_client, tmp_path):
+    version_file = tmp_path / "version.json"
+    version_file.write_text(json.dumps({"version": "1.0"}))
+    with mock.patch("pollbot.views.utilities.VERSION_FILE", str(version_file)):
+        cli = await aiohttp_client(get_app())
+    version_file.write_text(json.dumps({"version": "2.0"}))
+    await check_response(cli, "/v1/__version__", body={"version": "1.0"})
 
 
 async def test_version_view_return_200(cli):
@@ -810,3 +1187,406 @@ async def test_get_buildid_for_nightly_version(cli):
         '20170810100255', '20170809100326', '20170808114032', '20170808100224', '20170807113452',
         '20170807100344', '20170806100257', '20170805100334', '20170804193726', '20170804180022',
         '20170804100354', '20170803134456', '20170803100352', '20170802100302']
+
+
+async def test_webhooks_are_disabled_without_a_token(cli):
+    await check_response(cli, "/v1/__webhooks__", status=403, body={
+        "status": 403,
+        "message": "Webhooks are disabled"
+    })
+
+
+async def test_webhooks_require_the_token(cli):
+    with mock.patch("pollbot.views.webhooks.WEBHOOKS_TOKEN", "s3cr3t"):
+        await check_response(cli, "/v1/__webhooks__", status=401,
+                             headers={"Authorization": "Bearer foo"}, body={
+                                 "status": 401,
+                                 "message": "Invalid webhooks token"
+                             })
+
+
+async def test_webhooks_can_be_registered_and_deleted(cli):
+    headers = {"Authorization": "Bearer s3cr3t"}
+    watchers = cli.server.app['watchers']
+    with mock.patch("pollbot.views.webhooks.WEBHOOKS_TOKEN", "s3cr3t"), \
+            mock.patch.dict("pollbot.views.release.CHECKS_TASKS", slow_tasks(None)):
+        await check_response(cli, "/v1/__webhooks__", method="post", status=400, headers=headers,
+                             json={"url": "ftp://example.com", "product": "firefox",
+                                   "version": "57.0"},
+                             body={"status": 400, "message": "Invalid webhook URL: "
+                                                             "ftp://example.com"})
+        resp = await check_response(cli, "/v1/__webhooks__", method="post", status=201,
+                                    headers=headers,
+                                    json={"url": "https://example.com/hook",
+                                          "product": "firefox", "version": "57.0",
+                                          "checks": ["archive", "bouncer"]})
+        webhook = await resp.json()
+        assert webhook["checks"] == ["archive", "bouncer"]
+        assert watchers.stats() == {"watchers": 1, "subscribers": 1}
+
+        await check_response(cli, "/v1/__webhooks__", headers=headers,
+                             body={"webhooks": [webhook]})
+        await check_response(cli, "/v1/__webhooks__/{}".format(webhook["id"]),
+                             method="delete", status=204, headers=headers)
+        await check_response(cli, "/v1/__webhooks__/{}".format(webhook["id"]),
+                             method="delete", status=404, headers=headers)
+    assert watchers.stats() == {"watchers": 0, "subscribers": 0}
+
+
+async def test_webhooks_validate_their_version_and_checks(cli):
+    headers = {"Authorization": "Bearer s3cr3t"}
+    webhook = {"url": "https://example.com/hook", "product": "firefox"}
+    with mock.patch("pollbot.views.webhooks.WEBHOOKS_TOKEN", "s3cr3t"):
+        await check_response(cli, "/v1/__webhooks__", method="post", status=400, headers=headers,
+                             json=dict(webhook, version="57.0a1a"),
+                             body={"status": 400, "message": "Invalid version number: 57.0a1a"})
+        await check_response(cli, "/v1/__webhooks__", method="post", status=400, headers=headers,
+                             json=dict(webhook, version="57.0", checks=[{}]),
+                             body={"status": 400, "message": "Invalid checks: [{}]"})
+
+
+def webhook_registration():
+    return {"id": "abc", "url": "https://example.com/hook", "product": "firefox",
+            "version": "57.0", "checks": ["archive", "bouncer"], "statuses": {}}
+
+
+def webhook_event(check_name, status):
+    return {"check": check_name, "product": "firefox", "version": "57.0",
+            "status": status, "message": "", "link": "url"}
+
+
+async def notify_transition(webhooks, registration, check_name):
+    await webhooks.notify(registration, webhook_event(check_name, "missing"))
+    await webhooks.notify(registration, webhook_event(check_name, "exists"))
+
+
+def webhook_calls(mocked, url="https://example.com/hook"):
+    return [json.loads(call.kwargs["data"])
+            for call in mocked.requests.get(("POST", URL(url)), [])]
+
+
+async def test_webhooks_are_called_with_batched_transitions_to_exists():
+    webhooks = Webhooks({}, batch_delay=0.01, timeout=3)
+    registration = webhook_registration()
+    with aioresponses() as mocked:
+        mocked.post("https://example.com/hook", status=200)
+        await webhooks.notify(registration, webhook_event("archive", "missing"))
+        await webhooks.notify(registration, webhook_event("archive", "exists"))
+        await webhooks.notify(registration, webhook_event("bouncer", "incomplete"))
+        await webhooks.notify(registration, webhook_event("bouncer", "error"))
+        await webhooks.notify(registration, webhook_event("bouncer", "exists"))
+        await webhooks.notify(registration, webhook_event("bouncer", "exists"))
+        await asyncio.gather(*webhooks._deliveries.values())
+
+        calls = webhook_calls(mocked)
+        request = mocked.requests[("POST", URL("https://example.com/hook"))][0]
+    assert len(calls) == 1
+    assert [(event["check"], event["webhook"]) for event in calls[0]["events"]] == [
+        ("archive", "abc"), ("bouncer", "abc")]
+    assert request.kwargs["timeout"].total == 3
+    assert webhooks.stats()["delivered"] == 2
+
+
+async def test_webhooks_are_not_called_for_the_first_status_of_a_check():
+    webhooks = Webhooks({}, batch_delay=0)
+    registration = webhook_registration()
+    await webhooks.notify(registration, webhook_event("archive", "exists"))
+    assert registration["statuses"] == {"archive": "exists"}
+    assert webhooks._deliveries == {}
+    assert webhooks.stats()["pending"] == 0
+
+
+async def test_failed_webhook_deliveries_are_retried_then_dropped():
+    webhooks = Webhooks({}, batch_delay=0, retries=1, retry_delay=0.01)
+    with aioresponses() as mocked:
+        mocked.post("https://example.com/hook", status=500)
+        mocked.post("https://example.com/hook", status=200)
+        mocked.post("https://example.com/hook", exception=asyncio.TimeoutError())
+        mocked.post("https://example.com/hook", status=503)
+        await notify_transition(webhooks, webhook_registration(), "archive")
+        await asyncio.gather(*webhooks._deliveries.values())
+        await notify_transition(webhooks, webhook_registration(), "archive")
+        await asyncio.gather(*webhooks._deliveries.values())
+
+        assert len(webhook_calls(mocked)) == 4
+    assert webhooks.stats() == {"leader": True, "registrations": 0, "pending": 0,
+                                "delivered": 1, "dropped": 1}
+
+
+class FakeWatchers:
+    def __init__(self):
+        self.subscribers = 0
+
+    def subscribe(self, product, version, checks):
+        self.subscribers += 1
+        return None, asyncio.Queue()
+
+    async def unsubscribe(self, watcher, queue):
+        self.subscribers -= 1
+
+
+async def test_pending_webhook_events_survive_restarts():
+    app = {"cache_backend": MemoryBackend(), "watchers": FakeWatchers()}
+    webhooks = Webhooks(app, batch_delay=60)
+    await notify_transition(webhooks, webhook_registration(), "archive")
+    await webhooks.close()
+
+    restarted = Webhooks(app, batch_delay=0)
+    with aioresponses() as mocked:
+        mocked.post("https://example.com/hook", status=200)
+        await restarted.load()
+        assert restarted.stats()["pending"] == 1
+        await asyncio.gather(*restarted._deliveries.values())
+        assert len(webhook_calls(mocked)) == 1
+    await restarted.close()
+    assert await app["cache_backend"].load("webhooks:pending:https://example.com/hook") is None
+
+
+async def test_webhooks_are_called_by_a_single_replica():
+    backend = MemoryBackend()
+    replicas = [Webhooks({"cache_backend": backend, "watchers": FakeWatchers()})
+                for _ in range(2)]
+    leader, follower = replicas
+    for replica in replicas:
+        await replica.load()
+    assert leader.leader and not follower.leader
+
+    registration = await follower.register("https://example.com/hook", "firefox", "57.0",
+                                           ["archive"])
+    assert follower.app["watchers"].subscribers == 0
+    assert await leader.get_registrations() == [registration]
+    await leader.sync()
+    await asyncio.sleep(0)
+    assert leader.app["watchers"].subscribers == 1
+
+    # Registrations are stored apart, updating one doesn't override the others.
+    other = await leader.register("https://example.com/other", "firefox", "58.0", ["archive"])
+    assert sorted(r["id"] for r in await follower.get_registrations()) == sorted(
+        [registration["id"], other["id"]])
+
+    assert await follower.unregister(registration["id"])
+    await leader.sync()
+    assert list(leader.registrations) == [other["id"]]
+
+    # Once the lease of the leader expires, another replica takes over.
+    await leader.close()
+    await backend.remove("webhooks:lease")
+    await follower.sync()
+    assert follower.leader
+    assert list(follower.registrations) == [other["id"]]
+    await follower.close()
+
+
+async def test_batch_runs_each_distinct_check_once(cli):
+    calls = []
+
+    def task_for(check_name):
+        async def task(product, version):
+            calls.append((product, version, check_name))
+            return build_task_response(True, "url", check_name)
+        return task
+
+    tasks = {check_name: task_for(check_name) for check_name in CHECKS_TASKS}
+    checks = [
+        {"product": "firefox", "version": "57.0", "check": "archive"},
+        {"product": "devedition", "version": "58.0b1", "check": "bouncer"},
+        {"product": "firefox", "version": "57.0", "check": "archive"},
+        {"product": "firefox", "version": "57.0", "check": "unknown"},
+        {"product": "chrome", "version": "57.0", "check": "archive"},
+        {"product": "firefox", "version": "57.0a1a", "check": "archive"},
+    ]
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", tasks):
+        resp = await check_response(cli, "/v1/batch", method="post", json={"checks": checks})
+    results = (await resp.json())["results"]
+    assert [result["check"] for result in results] == [
+        "archive", "bouncer", "archive", "unknown", "archive", "archive"]
+    assert results[0]["result"] == results[2]["result"] == {
+        "status": "exists", "message": "archive", "link": "url"}
+    assert results[3]["result"] == {"status": "error", "message": "Invalid check: unknown"}
+    assert results[4]["result"]["message"].startswith("Invalid product: chrome")
+    assert results[5]["result"] == {"status": "error",
+                                    "message": "Invalid version number: 57.0a1a"}
+    assert sorted(calls) == [("devedition", "58.0b1", "bouncer"), ("firefox", "57.0", "archive")]
+
+
+async def test_batch_concurrency_is_capped(cli):
+    running = []
+
+    async def task(product, version):
+        running.append(version)
+        await asyncio.sleep(0.01)
+        assert len(running) <= 2
+        running.remove(version)
+        return build_task_response(True, "url", "archive")
+
+    checks = [{"product": "firefox", "version": "57.0.{}".format(i), "check": "archive"}
+              for i in range(6)]
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", {"archive": task}), \
+            mock.patch("pollbot.views.release.BATCH_CONCURRENCY", 2):
+        resp = await check_response(cli, "/v1/batch", method="post", json={"checks": checks})
+    results = (await resp.json())["results"]
+    assert [result["result"]["status"] for result in results] == ["exists"] * 6
+
+
+async def test_batch_validates_its_body(cli):
+    await check_response(cli, "/v1/batch", method="post", status=400, data="{",
+                         body={"status": 400, "message": "Invalid JSON body"})
+    await check_response(cli, "/v1/batch", method="post", status=400, json={"checks": [42]},
+                         body={"status": 400, "message": "Invalid check: 42"})
+    with mock.patch("pollbot.views.release.BATCH_MAX_SIZE", 1):
+        await check_response(cli, "/v1/batch", method="post", status=400,
+                             json={"checks": [{}, {}]},
+                             body={"status": 400, "message": "Too many checks: 2 > 1"})
+
+
+def scheduler_tasks(calls, immutable=False):
+    def task_for(check_name):
+        async def task(product, version):
+            calls.append((check_name, version))
+            return build_task_response(check_name != "bouncer", "url", check_name,
+                                       immutable=immutable)
+        return task
+    return {check_name: task_for(check_name) for check_name in CHECKS_TASKS}
+
+
+async def firefox_ongoing_versions(product):
+    return {"esr": "52.5.3esr", "release": "57.0.4", "beta": "58.0b6",
+            "nightly": "59.0a1", "devedition": "58.0b6"}
+
+
+async def test_scheduler_precomputes_the_checks_of_ongoing_versions():
+    calls = []
+    now = [1000]
+    app = {"results_cache": ResultsCache()}
+    scheduler = Scheduler(app, products=("firefox",), clock=lambda: now[0])
+    with mock.patch("pollbot.views.scheduler.ongoing_versions", firefox_ongoing_versions), \
+            mock.patch.dict("pollbot.views.release.CHECKS_TASKS", scheduler_tasks(calls)):
+        await scheduler.tick()
+        assert sorted({version for _, version in calls}) == [
+            "52.5.3esr", "57.0.4", "58.0b6", "59.0a1"]
+        assert len(calls) == len(scheduler.jobs) == 37
+        assert ("archive", "firefox", "57.0.4") in app["results_cache"]
+
+        # Missing checks are refreshed sooner than existing ones.
+        now[0] += 4 * 60
+        await scheduler.tick()
+        assert sorted(version for _, version in calls[37:]) == ["57.0.4", "58.0b6"]
+        assert {check_name for check_name, _ in calls[37:]} == {"bouncer"}
+    assert scheduler.stats() == {"versions": 4, "jobs": 37, "done": 0, "runs": 39}
+
+
+async def test_scheduler_runs_on_a_single_replica():
+    backend = MemoryBackend()
+    calls = [[], []]
+    schedulers = [Scheduler({"results_cache": ResultsCache(backend=backend),
+                             "cache_backend": backend}, products=("firefox",))
+                  for _ in calls]
+    with mock.patch("pollbot.views.scheduler.ongoing_versions", firefox_ongoing_versions):
+        for scheduler, scheduler_calls in zip(schedulers, calls):
+            with mock.patch.dict("pollbot.views.release.CHECKS_TASKS",
+                                 scheduler_tasks(scheduler_calls)):
+                await scheduler.tick()
+    assert len(calls[0]) == 37
+    assert calls[1] == []
+    assert await backend.load("result:archive:firefox:57.0.4") is not None
+
+
+async def test_scheduler_intervals_depend_on_channel_status_and_requests():
+    now = [1000]
+    scheduler = Scheduler({}, fast_interval=10, slow_interval=100, idle_time=60,
+                          clock=lambda: now[0])
+    scheduler.touch("firefox", "57.0")
+    scheduler.touch("firefox", "52.5.0esr")
+    assert scheduler.interval(("archive", "firefox", "57.0"), "missing") == 10
+    assert scheduler.interval(("archive", "firefox", "57.0"), "exists") == 100
+    assert scheduler.interval(("archive", "firefox", "52.5.0esr"), "exists") == 200
+    assert scheduler.interval(("archive", "firefox", "58.0b6"), "incomplete") == 40
+    now[0] += 61
+    assert scheduler.interval(("archive", "firefox", "57.0"), "missing") == 40
+
+
+async def test_scheduler_keeps_the_configured_ttl_of_the_results():
+    calls = []
+    app = {"results_cache": ResultsCache(ttl=30)}
+    scheduler = Scheduler(app, products=("firefox",), slow_interval=600, idle_time=60)
+    with mock.patch("pollbot.views.scheduler.ongoing_versions", firefox_ongoing_versions), \
+            mock.patch.dict("pollbot.views.release.CHECKS_TASKS", scheduler_tasks(calls)), \
+            mock.patch.dict("pollbot.views.release.CHECKS_TTL", {"archive": 30}):
+        await scheduler.tick()
+    _, fresh_until = app["results_cache"]._data[("archive", "firefox", "57.0.4")][0]
+    assert fresh_until <= time.monotonic() + 30
+
+
+async def test_scheduler_refreshes_idle_versions_sooner_once_requested():
+    calls = []
+    now = [1000]
+    app = {"results_cache": ResultsCache()}
+    scheduler = Scheduler(app, products=("firefox",), fast_interval=60, idle_time=900,
+                          clock=lambda: now[0])
+    with mock.patch("pollbot.views.scheduler.ongoing_versions", firefox_ongoing_versions), \
+            mock.patch.dict("pollbot.views.release.CHECKS_TASKS", scheduler_tasks(calls)):
+        await scheduler.tick()
+    key = ("archive", "firefox", "57.0.4")
+    assert scheduler.jobs[key] == 1000 + 600 * 4
+
+    now[0] += 100
+    scheduler.touch("firefox", "57.0.4")
+    assert scheduler.jobs[key] == 1100 + 60
+    assert scheduler.jobs[("archive", "firefox", "58.0b6")] == 1000 + 600 * 4
+
+    # Already requested versions keep their schedule.
+    scheduler.jobs[key] = 2000
+    now[0] += 10
+    scheduler.touch("firefox", "57.0.4")
+    assert scheduler.jobs[key] == 2000
+
+
+async def test_scheduler_forgets_idle_versions():
+    now = [1000]
+    scheduler = Scheduler({}, products=("firefox",), idle_time=900, clock=lambda: now[0])
+    for minor in range(100):
+        scheduler.touch("firefox", "57.0.{}".format(minor))
+    now[0] += 100
+    scheduler.touch("firefox", "58.0b6")
+
+    now[0] += 850
+    with mock.patch("pollbot.views.scheduler.ongoing_versions", firefox_ongoing_versions):
+        await scheduler.update_versions()
+    assert list(scheduler.requested) == [("firefox", "58.0b6")]
+
+
+async def test_scheduler_stops_refreshing_immutable_results():
+    calls = []
+    now = [1000]
+    app = {"results_cache": ResultsCache()}
+    scheduler = Scheduler(app, products=("firefox",), clock=lambda: now[0])
+    tasks = scheduler_tasks(calls, immutable=True)
+    with mock.patch("pollbot.views.scheduler.ongoing_versions", firefox_ongoing_versions), \
+            mock.patch.dict("pollbot.views.release.CHECKS_TASKS", tasks):
+        await scheduler.tick()
+        now[0] += 10000
+        await scheduler.tick()
+    # Only the missing bouncer checks are refreshed.
+    assert len(calls) == 37 + 4
+    assert scheduler.stats()["done"] == 33
+
+
+async def test_requested_versions_are_touched(cli):
+    scheduler = cli.server.app['scheduler']
+    scheduler.fast_interval = 60
+    with mock.patch.dict("pollbot.views.release.CHECKS_TASKS", slow_tasks(None)):
+        await check_response(cli, "/v1/firefox/57.0/all")
+    assert ("firefox", "57.0") in scheduler.requested
+
+
+async def test_check_plans_are_prepared_by_product_and_channel(cli):
+    plans = cli.server.app['check_plans']
+    with pytest.raises(TypeError):
+        plans[("firefox", Channel.NIGHTLY)] = ()
+    nightly = plans[("firefox", Channel.NIGHTLY)]
+    assert nightly[0] == ("archive", "Archive Release", "/v1/firefox/{version}/archive", True)
+    assert nightly[-1].name == "telemetry-main-summary-uptake"
+    assert not nightly[-1].actionable
+    assert "partner-repacks" not in [plan.name for plan in plans[("thunderbird", Channel.BETA)]]
+    assert [plan.name for plan in CHECK_PLANS[("firefox", Channel.NIGHTLY)]] == [
+        plan.name for plan in nightly]